@@ -0,0 +1,276 @@
+"""
+请求与渲染热点路径的基准测试
+
+使用本地模拟服务器，不需要真实的Ollama服务和图形界面：
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --quick --compare results.json
+
+结果以JSON格式保存；指定 --compare 时与之前的结果比较，中位数变慢超过阈值时返回非零退出码。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Awaitable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from chat_api import OllamaChatAPI  # noqa: E402
+from chat_controller import ChatController  # noqa: E402
+from chat_render import get_renderer, render_page  # noqa: E402
+from config_manager import IniConfigManager  # noqa: E402
+from mock_server import MockOllamaServer  # noqa: E402
+
+MODEL = "mock:latest"
+
+CODE_HEAVY_REPLY = """下面是示例代码：
+
+```python
+import asyncio
+
+async def fetch(session, url):
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.json()
+
+async def main(urls):
+    results = await asyncio.gather(*(fetch(session, url) for url in urls))
+    return {url: result for url, result in zip(urls, results)}
+```
+
+| 参数 | 说明 |
+| --- | --- |
+| `urls` | 要请求的地址列表 |
+
+```javascript
+function debounce(fn, wait) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), wait);
+    };
+}
+```
+"""
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """计算耗时统计（毫秒）"""
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    return {
+        "iterations": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 4),
+        "median_ms": round(median * 1000, 4),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+        "ops_per_sec": round(1 / median, 2) if median > 0 else None,
+    }
+
+
+def measure(fn: Callable[[], None], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    """多次执行同步函数并统计耗时"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def measure_async(fn: Callable[[], Awaitable], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    """多次执行协程函数并统计耗时"""
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def make_history(count: int, reply: str = CODE_HEAVY_REPLY) -> List[Dict[str, str]]:
+    """生成用户消息与代码较多的回复交替的历史，每条回复内容不同以避免命中缓存"""
+    messages = []
+    for index in range(count):
+        if index % 2 == 0:
+            messages.append({"role": "user", "content": f"问题 {index}：如何并发请求多个地址？"})
+        else:
+            messages.append({"role": "assistant", "content": f"回复 {index}\n\n{reply}"})
+    return messages
+
+
+def bench_render(sizes: List[int], iterations: int) -> Dict[str, Dict]:
+    """完整页面渲染（对应 ChatPanel._generate_chat_html），分别测量无缓存和命中缓存"""
+    results = {}
+    renderer = get_renderer()
+    for size in sizes:
+        messages = make_history(size)
+
+        def cold():
+            renderer.cache.clear()
+            render_page(messages)
+
+        results[f"render_page[{size}]_cold"] = measure(cold, iterations)
+        results[f"render_page[{size}]_warm"] = measure(lambda: render_page(messages), iterations)
+    return results
+
+
+def bench_save_config(iterations: int) -> Dict[str, Dict]:
+    """配置文件写入和设置项修改"""
+    with tempfile.TemporaryDirectory() as directory:
+        config_manager = IniConfigManager(os.path.join(directory, "config.ini"), "localhost:11434", 60.0)
+        config_manager.load_config()
+        for index in range(20):
+            config_manager.favorite_servers.append(f"192.168.1.{index}:11434")
+        urls = iter(f"192.168.2.{index % 250}:11434" for index in range(iterations * 2 + 10))
+        results = {
+            "save_config": measure(config_manager.save_config, iterations),
+            # 设置项修改只更新内存并延迟写入
+            "set_server_url": measure(lambda: config_manager.set_server_url(next(urls)), iterations),
+        }
+        config_manager.flush()
+        return results
+
+
+async def bench_api(server_url: str, iterations: int) -> Dict[str, Dict]:
+    """单次请求往返开销：模拟服务器不加延迟，只回复一个token"""
+    api = OllamaChatAPI(server_url, 60.0)
+    messages = [{"role": "user", "content": "你好"}]
+
+    async def stream():
+        async for _ in api.stream_message(MODEL, messages):
+            pass
+
+    try:
+        return {
+            "api.get_models": await measure_async(api.get_models, iterations),
+            "api.send_message": await measure_async(lambda: api.send_message(MODEL, messages), iterations),
+            "api.stream_message": await measure_async(stream, iterations),
+        }
+    finally:
+        await api.disconnect()
+
+
+async def bench_controller(server_url: str, sizes: List[int], iterations: int) -> Dict[str, Dict]:
+    """控制器发送消息（包括上下文窗口裁剪）随历史长度的变化"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        config_manager = IniConfigManager(os.path.join(directory, "config.ini"), server_url, 60.0)
+        controller = ChatController(config_manager, OllamaChatAPI(server_url, 60.0))
+        controller.initialize()
+        await controller.connect(server_url)
+        try:
+            for size in sizes:
+                conversation = controller.new_conversation()
+                conversation.model = MODEL
+                conversation.messages.extend(make_history(size))
+
+                async def send():
+                    await controller.send_message("继续", conversation_id=conversation.id)
+                    del conversation.messages[size:]  # 保持历史长度不变
+
+                results[f"controller.send_message[{size}]"] = await measure_async(send, iterations)
+        finally:
+            await controller.disconnect()
+    return results
+
+
+async def bench_network(api_iterations: int, controller_sizes: List[int],
+                        controller_iterations: int) -> Dict[str, Dict]:
+    server = MockOllamaServer(models=[MODEL], response_tokens=1)
+    server_url = await server.start()
+    try:
+        results = await bench_api(server_url, api_iterations)
+        results.update(await bench_controller(server_url, controller_sizes, controller_iterations))
+        return results
+    finally:
+        await server.stop()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """返回中位数变慢超过阈值的测试项"""
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if not old or not old.get("median_ms"):
+            continue
+        ratio = stats["median_ms"] / old["median_ms"]
+        marker = "  <-- 变慢" if ratio > 1 + threshold else ""
+        print(f"{name:45s} {old['median_ms']:10.3f} -> {stats['median_ms']:10.3f} ms ({ratio:5.2f}x){marker}")
+        if marker:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="请求与渲染热点路径的基准测试")
+    parser.add_argument("-o", "--output", help="结果JSON文件，默认输出到标准输出")
+    parser.add_argument("--quick", action="store_true", help="减少迭代次数和历史长度，用于快速检查")
+    parser.add_argument("--compare", help="与之前保存的结果比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为变慢的中位数增幅，默认0.2（20%%）")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        render_sizes, history_sizes = [10, 100], [10, 100, 1000]
+        render_iterations, api_iterations, controller_iterations, save_iterations = 3, 50, 10, 50
+    else:
+        render_sizes, history_sizes = [10, 100, 1000], [10, 100, 1000, 5000]
+        render_iterations, api_iterations, controller_iterations, save_iterations = 10, 300, 30, 300
+
+    results: Dict[str, Dict] = {}
+    results.update(bench_render(render_sizes, render_iterations))
+    results.update(bench_save_config(save_iterations))
+    results.update(asyncio.run(bench_network(api_iterations, history_sizes, controller_iterations)))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项变慢超过 {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Optional, Union
+import json
+import os
+import sys
+import time
+
+BatchItems = Union[Iterable[Dict], AsyncIterable[Dict]]
+
+
+async def iterate_items(items: BatchItems) -> AsyncIterator[Dict]:
+    """把普通可迭代对象和异步迭代器统一为异步迭代器，逐项读取而不一次性展开"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class InvalidItem(ValueError):
+    """输入中无法解析的一项，批量任务把它记录为失败的结果，不中断其余的项"""
+
+    def __init__(self, message: str, item_id=None):
+        super().__init__(message)
+        self.item_id = item_id
+
+
+def normalize_item(item: Any, index: int, default_model: Optional[str]) -> Dict:
+    """
+    整理批量任务的一项
+
+    每项可以是字符串（单条提示词），或包含 prompt 或 messages 的字典，可选 id 和 model，
+    没有 id 时使用在输入中的序号。
+
+    Raises:
+        ValueError: 格式不正确或没有指定模型时，输入中无法解析的项（InvalidItem）原样抛出
+    """
+    if isinstance(item, InvalidItem):
+        raise item
+    if isinstance(item, str):
+        item = {"prompt": item}
+    if not isinstance(item, dict):
+        raise ValueError(f"第{index}项不是字典或字符串")
+    if "messages" in item:
+        messages = item["messages"]
+    elif isinstance(item.get("prompt"), str):
+        messages = [{"role": "user", "content": item["prompt"]}]
+    else:
+        raise ValueError(f"第{index}项缺少 prompt 或 messages 字段")
+    model = item.get("model") or default_model
+    if not model:
+        raise ValueError(f"第{index}项没有指定模型")
+    normalized = dict(item, messages=messages, model=model)
+    normalized.setdefault("id", index)
+    return normalized
+
+
+class BatchCheckpoint:
+    """
+    批量任务的进度文件
+
+    每完成一项追加一行JSON结果，中断后重新运行同一批任务时，已完成的项直接使用保存的结果。
+    失败的项不记录，重新运行时会再次请求。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Dict[str, Dict] = {}
+        self.skipped = 0  # 无法解析而跳过的行数
+        if os.path.exists(path):
+            valid = 0  # 已读取的完整行结束处的字节偏移
+            with open(path, "rb") as f:
+                for number, line in enumerate(f, 1):
+                    if not line.endswith(b"\n"):
+                        break  # 上次写入中断，最后一行不完整
+                    valid += len(line)
+                    try:
+                        result = json.loads(line)
+                        self.completed[self.key(result["id"])] = result
+                    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                        # 中间损坏的行只跳过，之后的结果仍然有效，该项重新运行时再次请求
+                        self.skipped += 1
+                        print(f"进度文件 {path} 第{number}行无法解析，已跳过", file=sys.stderr)
+            # 只截掉末尾不完整的行，否则之后追加的结果会接在残缺的行后面，下次读取时丢失
+            if os.path.getsize(path) > valid:
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(item_id) -> str:
+        """进度文件中的ID经过JSON往返，统一转换为字符串比较"""
+        return json.dumps(item_id, ensure_ascii=False)
+
+    def get(self, item_id) -> Optional[Dict]:
+        return self.completed.get(self.key(item_id))
+
+    def record(self, result: Dict) -> None:
+        """记录已完成的结果"""
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.completed[self.key(result["id"])] = result
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class BatchStats:
+    """批量任务的吞吐量统计"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0  # 从进度文件中恢复、未重新请求的项
+        self.generated_tokens = 0
+
+    def record(self, result: Dict) -> None:
+        if result.get("resumed"):
+            self.resumed += 1
+        elif "error" in result:
+            self.failed += 1
+        else:
+            self.completed += 1
+            self.generated_tokens += result.get("tokens") or 0
+
+    def finish(self) -> None:
+        self.end = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def requests_per_second(self) -> float:
+        """每秒完成的请求数，不含从进度文件中恢复的项"""
+        return (self.completed + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        """每秒生成的token数（来自服务器返回的 eval_count）"""
+        return self.generated_tokens / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "resumed": self.resumed,
+            "generated_tokens": self.generated_tokens,
+            "elapsed": round(self.elapsed, 3),
+            "requests_per_second": round(self.requests_per_second, 3),
+            "tokens_per_second": round(self.tokens_per_second, 3),
+        }
+
+    def summary(self) -> str:
+        return (f"完成 {self.completed} 条，失败 {self.failed} 条，恢复 {self.resumed} 条，"
+                f"用时 {self.elapsed:.1f} 秒，{self.requests_per_second:.2f} 请求/秒，"
+                f"{self.tokens_per_second:.1f} token/秒")
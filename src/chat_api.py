@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, AsyncIterator, Awaitable, Callable
 import aiohttp
 import asyncio
+import hashlib
+import json
+import time
+import weakref
+from connection_manager import ConnectionManager
+from metrics import MetricsRegistry, get_metrics, record_generation_stats
 
 class ChatAPI(ABC):
     """聊天API接口"""
@@ -22,36 +28,58 @@ class ChatAPI(ABC):
         pass
     
     @abstractmethod
-    async def send_message(self, model: str, messages: List[Dict[str, str]]) -> Dict:
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
         """发送消息"""
         pass
+    
+    @abstractmethod
+    def stream_message(self, model: str, messages: List[Dict[str, str]],
+                       options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        """流式发送消息，逐块返回响应"""
+        pass
+    
+    @abstractmethod
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        """预加载模型到服务器内存"""
+        pass
+    
+    @abstractmethod
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        """计算文本的向量表示，一次请求可以包含多条文本"""
+        pass
 
 class OllamaChatAPI(ChatAPI):
     """Ollama API实现"""
     
-    def __init__(self, base_url: str, timeout: float):
+    def __init__(self, base_url: str, timeout: float, connection_manager: Optional[ConnectionManager] = None):
         """
         初始化Ollama API客户端
         
         Args:
             base_url: API的基础URL
-            timeout: 请求超时时间（秒）
+            timeout: 读取超时时间（秒），即两次收到数据之间的最长等待时间
+            connection_manager: 共享的连接管理器，不提供时使用独立的连接池
         """
         if not base_url.startswith(('http://', 'https://')):
             base_url = f'http://{base_url}'
         self.base_url = base_url.rstrip('/')
-        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._owns_connection_manager = connection_manager is None
+        self.connection_manager = connection_manager or ConnectionManager(read_timeout=timeout)
+        self.timeout = self.connection_manager.make_timeout(timeout)
+        self.metrics = self.connection_manager.metrics
         self.session: Optional[aiohttp.ClientSession] = None
     
     async def connect(self) -> None:
-        """连接到服务器（创建会话）"""
-        if self.session is None:
-            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        """连接到服务器（获取会话）"""
+        if self.session is None or self.session.closed:
+            self.session = await self.connection_manager.get_session()
     
     async def disconnect(self) -> None:
-        """断开连接（关闭会话）"""
+        """断开连接（共享会话由连接管理器负责关闭）"""
         if self.session:
-            await self.session.close()
+            if self._owns_connection_manager:
+                await self.connection_manager.close()
             self.session = None
     
     async def get_models(self) -> List[Dict]:
@@ -65,24 +93,41 @@ class OllamaChatAPI(ChatAPI):
             aiohttp.ClientError: 当API请求失败时
             asyncio.TimeoutError: 当请求超时时
         """
-        if not self.session:
+        if not self.session or self.session.closed:
             await self.connect()
         
         try:
-            async with self.session.get(f"{self.base_url}/api/tags") as response:
+            async with self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout) as response:
                 response.raise_for_status()
                 data = await response.json()
                 return data["models"]
         except asyncio.TimeoutError:
             raise asyncio.TimeoutError("服务器连接超时，请检查网络或稍后重试")
     
-    async def send_message(self, model: str, messages: List[Dict[str, str]]) -> Dict:
+    def _build_chat_request(self, model: str, messages: List[Dict[str, str]], stream: bool,
+                            options: Optional[Dict], keep_alive: Optional[str]) -> Dict:
+        """构造 /api/chat 请求体"""
+        data = {
+            "model": model,
+            "messages": messages,
+            "stream": stream
+        }
+        if options:
+            data["options"] = options
+        if keep_alive is not None:
+            data["keep_alive"] = keep_alive
+        return data
+    
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
         """
         发送聊天请求
         
         Args:
             model: 模型名称
             messages: 消息历史列表
+            options: 生成参数（如 num_ctx、temperature）
+            keep_alive: 请求结束后模型在服务器内存中保留的时间（如 "30m"）
         
         Returns:
             Dict: API响应的消息内容
@@ -91,19 +136,322 @@ class OllamaChatAPI(ChatAPI):
             aiohttp.ClientError: 当API请求失败时
             asyncio.TimeoutError: 当请求超时时
         """
-        if not self.session:
+        if not self.session or self.session.closed:
             await self.connect()
         
-        data = {
-            "model": model,
-            "messages": messages,
-            "stream": False
-        }
+        data = self._build_chat_request(model, messages, False, options, keep_alive)
+        start = time.perf_counter()
         
         try:
-            async with self.session.post(f"{self.base_url}/api/chat", json=data) as response:
+            async with self.session.post(f"{self.base_url}/api/chat", json=data, timeout=self.timeout) as response:
                 response.raise_for_status()
                 data = await response.json()
+                self.metrics.observe("ollama_request_seconds", time.perf_counter() - start)
+                record_generation_stats(self.metrics, data)
                 return data["message"]
         except asyncio.TimeoutError:
-            raise asyncio.TimeoutError("服务器响应超时，请稍后重试") 
\ No newline at end of file
+            raise asyncio.TimeoutError("服务器响应超时，请稍后重试")
+    
+    async def stream_message(self, model: str, messages: List[Dict[str, str]],
+                             options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        流式发送聊天请求
+        
+        Ollama以NDJSON格式逐行返回响应块，每块包含 message.content 片段，
+        最后一块 done 为 True 并附带统计信息（eval_count、eval_duration 等）。
+        
+        Args:
+            model: 模型名称
+            messages: 消息历史列表
+            options: 生成参数（如 num_ctx、temperature）
+            keep_alive: 请求结束后模型在服务器内存中保留的时间（如 "30m"）
+        
+        Yields:
+            Dict: 服务器返回的原始响应块
+        
+        Raises:
+            aiohttp.ClientError: 当API请求失败时
+            asyncio.TimeoutError: 当请求超时时
+            RuntimeError: 当服务器在流中返回错误时
+        """
+        if not self.session or self.session.closed:
+            await self.connect()
+        
+        data = self._build_chat_request(model, messages, True, options, keep_alive)
+        start = time.perf_counter()
+        first_chunk = True
+        
+        try:
+            async with self.session.post(f"{self.base_url}/api/chat", json=data, timeout=self.timeout) as response:
+                response.raise_for_status()
+                try:
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            raise RuntimeError(f"服务器返回错误：{chunk['error']}")
+                        if first_chunk:
+                            first_chunk = False
+                            self.metrics.observe("ollama_first_chunk_seconds", time.perf_counter() - start)
+                        if chunk.get("done"):
+                            self.metrics.observe("ollama_request_seconds", time.perf_counter() - start)
+                            record_generation_stats(self.metrics, chunk)
+                        yield chunk
+                        if chunk.get("done"):
+                            break
+                except (asyncio.CancelledError, GeneratorExit):
+                    # 请求被取消时立即关闭连接，服务器检测到断开后会停止生成
+                    response.close()
+                    raise
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("服务器响应超时，请稍后重试")
+    
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        """
+        预加载模型
+        
+        向 /api/chat 发送空消息列表，服务器只加载模型而不生成内容，
+        避免第一条真实消息承担模型冷启动的耗时。
+        
+        Args:
+            model: 模型名称
+            keep_alive: 模型在服务器内存中保留的时间
+        
+        Raises:
+            aiohttp.ClientError: 当API请求失败时
+            asyncio.TimeoutError: 当请求超时时
+        """
+        if not self.session or self.session.closed:
+            await self.connect()
+        
+        data = self._build_chat_request(model, [], False, None, keep_alive)
+        
+        try:
+            async with self.session.post(f"{self.base_url}/api/chat", json=data, timeout=self.timeout) as response:
+                response.raise_for_status()
+                await response.read()
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("模型加载超时，请稍后重试")
+    
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        """
+        批量计算文本的向量表示
+        
+        多条文本在一次 /api/embed 请求中提交，由服务器批量计算，
+        超过模型上下文长度的文本由服务器截断。
+        
+        Args:
+            model: 向量模型名称（如 nomic-embed-text）
+            inputs: 文本列表
+            keep_alive: 模型在服务器内存中保留的时间
+        
+        Returns:
+            List[List[float]]: 与 inputs 顺序对应的向量列表
+        
+        Raises:
+            aiohttp.ClientError: 当API请求失败时
+            asyncio.TimeoutError: 当请求超时时
+        """
+        if not inputs:
+            return []
+        if not self.session or self.session.closed:
+            await self.connect()
+        
+        data = {"model": model, "input": inputs, "truncate": True}
+        if keep_alive is not None:
+            data["keep_alive"] = keep_alive
+        start = time.perf_counter()
+        
+        try:
+            async with self.session.post(f"{self.base_url}/api/embed", json=data, timeout=self.timeout) as response:
+                response.raise_for_status()
+                data = await response.json()
+                self.metrics.observe("ollama_embed_seconds", time.perf_counter() - start)
+                self.metrics.increment("ollama_embedded_inputs", len(inputs))
+                return data["embeddings"]
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("计算向量超时，请稍后重试")
+
+
+class _Flight:
+    """进行中的共享调用"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """进行中的共享流式请求，已收到的响应块保留到请求结束，后加入的订阅者从头读取"""
+    
+    def __init__(self):
+        self.chunks: List[Dict] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求
+    
+    同一个键的请求进行中时，之后的相同请求不再发出新的HTTP请求，而是等待同一个结果，
+    流式请求则把响应块分发给所有订阅者。请求结束后键即被移除，之后的请求重新发出。
+    所有等待者都取消时才取消共享的请求。
+    """
+    
+    def __init__(self, metrics: Optional[MetricsRegistry] = None):
+        self.metrics = metrics or get_metrics()
+        self.coalesced: Dict[str, int] = {}  # 操作名称 -> 被合并的请求数
+        self._flights: Dict[str, _Flight] = {}
+        self._broadcasts: Dict[str, _Broadcast] = {}
+    
+    def _record(self, operation: str) -> None:
+        self.coalesced[operation] = self.coalesced.get(operation, 0) + 1
+        self.metrics.increment("coalesced_requests")
+        self.metrics.increment(f"coalesced_{operation}_requests")
+    
+    async def do(self, operation: str, key: str, call: Callable[[], Awaitable]):
+        """执行请求，相同键的请求进行中时等待其结果"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda _: self._discard(self._flights, key, flight))
+        else:
+            self._record(operation)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._discard(self._flights, key, flight)
+                flight.task.cancel()
+    
+    async def stream(self, operation: str, key: str, open_stream: Callable[[], AsyncIterator[Dict]]) -> AsyncIterator[Dict]:
+        """流式请求，相同键的请求进行中时订阅其响应块"""
+        broadcast = self._broadcasts.get(key)
+        if broadcast is None:
+            broadcast = self._broadcasts[key] = _Broadcast()
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, open_stream()))
+        else:
+            self._record(operation)
+        broadcast.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(broadcast.chunks):
+                    yield broadcast.chunks[index]
+                    index += 1
+                elif broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                else:
+                    async with broadcast.condition:
+                        await broadcast.condition.wait_for(
+                            lambda: index < len(broadcast.chunks) or broadcast.done
+                        )
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.task.done():
+                # 所有订阅者都已停止，取消请求并断开连接
+                self._discard(self._broadcasts, key, broadcast)
+                broadcast.task.cancel()
+    
+    async def _pump(self, key: str, broadcast: _Broadcast, source: AsyncIterator[Dict]) -> None:
+        """读取上游的响应块并通知订阅者"""
+        try:
+            async for chunk in source:
+                broadcast.chunks.append(chunk)
+                async with broadcast.condition:
+                    broadcast.condition.notify_all()
+        except asyncio.CancelledError:
+            broadcast.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            self._discard(self._broadcasts, key, broadcast)
+            async with broadcast.condition:
+                broadcast.condition.notify_all()
+    
+    @staticmethod
+    def _discard(calls: Dict, key: str, call) -> None:
+        if calls.get(key) is call:
+            del calls[key]
+
+
+_single_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SingleFlight]" = weakref.WeakKeyDictionary()
+
+
+def get_single_flight() -> SingleFlight:
+    """获取当前事件循环共享的请求合并器，同一服务器的多个客户端（如重新连接前后）之间也会合并"""
+    loop = asyncio.get_running_loop()
+    flight = _single_flights.get(loop)
+    if flight is None:
+        flight = _single_flights[loop] = SingleFlight()
+    return flight
+
+
+def request_key(*parts) -> str:
+    """把请求参数编码为合并请求使用的键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CoalescingChatAPI(ChatAPI):
+    """合并并发的相同请求的包装器，键包含服务器地址，不同服务器的请求不会合并"""
+    
+    def __init__(self, inner: ChatAPI, name: str, single_flight: Optional[SingleFlight] = None):
+        """
+        Args:
+            inner: 被包装的API客户端
+            name: 服务器地址
+            single_flight: 请求合并器，默认使用当前事件循环共享的合并器
+        """
+        self.inner = inner
+        self.name = name
+        self._single_flight = single_flight
+    
+    @property
+    def single_flight(self) -> SingleFlight:
+        return self._single_flight or get_single_flight()
+    
+    async def connect(self) -> None:
+        await self.inner.connect()
+    
+    async def disconnect(self) -> None:
+        await self.inner.disconnect()
+    
+    async def get_models(self) -> List[Dict]:
+        return await self.single_flight.do(
+            "get_models", request_key("get_models", self.name), self.inner.get_models
+        )
+    
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
+        key = request_key("send_message", self.name, model, messages, options, keep_alive)
+        return await self.single_flight.do(
+            "send_message", key, lambda: self.inner.send_message(model, messages, options, keep_alive)
+        )
+    
+    def stream_message(self, model: str, messages: List[Dict[str, str]],
+                       options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        key = request_key("stream_message", self.name, model, messages, options, keep_alive)
+        return self.single_flight.stream(
+            "stream_message", key, lambda: self.inner.stream_message(model, messages, options, keep_alive)
+        )
+    
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        key = request_key("load_model", self.name, model, keep_alive)
+        await self.single_flight.do("load_model", key, lambda: self.inner.load_model(model, keep_alive))
+    
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        key = request_key("embed", self.name, model, inputs, keep_alive)
+        return await self.single_flight.do("embed", key, lambda: self.inner.embed(model, inputs, keep_alive))
@@ -1,65 +1,492 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, AsyncIterator, Set, TYPE_CHECKING
+import asyncio
+import sys
+import time
 from config_manager import ConfigManager
 from chat_api import ChatAPI
+from chat_pool import parse_server_urls
+from context_window import ContextPolicy, create_context_policy
+from conversation import Conversation, ConversationManager
+from chat_store import ChatStore
+from batch import BatchItems, BatchCheckpoint, BatchStats, InvalidItem, iterate_items, normalize_item
+from model_cache import ModelCache
+from metrics import get_metrics
+from constant import HISTORY_PAGE_SIZE, HISTORY_CONVERSATION_LIMIT, BATCH_WINDOW_FACTOR
+
+if TYPE_CHECKING:
+    from retrieval import Retriever
 
 class ChatController:
     """聊天控制器，处理业务逻辑"""
     
-    def __init__(self, config_manager: ConfigManager, chat_api: ChatAPI):
+    def __init__(self, config_manager: ConfigManager, chat_api: ChatAPI,
+                 context_policy: Optional[ContextPolicy] = None,
+                 api_factory: Optional[Callable[[str, float], ChatAPI]] = None,
+                 store: Optional[ChatStore] = None,
+                 model_cache: Optional[ModelCache] = None,
+                 retriever: Optional["Retriever"] = None):
+        """
+        Args:
+            config_manager: 配置管理器
+            chat_api: 初始API客户端
+            context_policy: 上下文窗口策略，默认根据配置创建
+            api_factory: 根据服务器地址和超时时间创建API客户端，默认使用 chat_api 的类型
+            store: 对话历史存储，不提供时历史只保存在内存中
+            model_cache: 模型列表缓存，连接已知服务器时先使用缓存，再在后台重新验证
+            retriever: 语义检索器，提供时在发送前把相关的历史片段和文档片段注入提示词
+        """
         self.config_manager = config_manager
         self.chat_api = chat_api
-        self.messages: List[Dict[str, str]] = []
+        self.api_factory = api_factory or type(chat_api)
+        self.context_policy = context_policy
+        self.store = store
+        self.model_cache = model_cache
+        self.conversations = ConversationManager()
+        self.conversations.create()
         self.is_connected = False
-        self.current_model: Optional[str] = None
+        self.server_url: Optional[str] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}  # 每个服务器的并发请求限制
+        self._revalidate_task: Optional[asyncio.Task] = None
+        self.retriever = retriever
+        self._index_task: Optional[asyncio.Task] = None
+        self._index_pending = False
+    
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        """当前对话的消息历史"""
+        return self.conversations.active.messages
+    
+    @property
+    def current_model(self) -> Optional[str]:
+        """当前对话使用的模型"""
+        return self.conversations.active.model
+    
+    @current_model.setter
+    def current_model(self, model: Optional[str]):
+        self.conversations.active.model = model
     
     def initialize(self):
         """初始化配置"""
         self.config_manager.load_config()
+        if self.context_policy is None:
+            self.context_policy = create_context_policy(self.config_manager)
+        self.load_conversations()
+    
+    def load_conversations(self):
+        """从存储中恢复最近的对话列表，消息在切换到对话时才读取"""
+        if not self.store:
+            return
+        for row in self.store.list_conversations(HISTORY_CONVERSATION_LIMIT):
+            if self.conversations.has(row["id"]):
+                continue
+            conversation = Conversation(row["id"], row["model"], row["title"], row["created_at"], loaded=False)
+            self.conversations.add(conversation)
+    
+    def ensure_loaded(self, conversation: Conversation):
+        """读取对话最近一页的消息"""
+        if conversation.loaded:
+            return
+        conversation.loaded = True
+        if self.store:
+            page = self.store.load_messages(conversation.id, limit=HISTORY_PAGE_SIZE)
+            conversation.messages[:0] = [{"role": row["role"], "content": row["content"]} for row in page]
+            conversation.oldest_message_id = page[0]["id"] if page else None
+            conversation.has_more_history = len(page) == HISTORY_PAGE_SIZE
+    
+    def load_more_messages(self, conversation_id: Optional[str] = None) -> int:
+        """
+        向前读取一页更早的消息
+
+        Returns:
+            int: 读取到的消息数量
+        """
+        conversation = self.conversations.get(conversation_id)
+        self.ensure_loaded(conversation)
+        if not self.store or not conversation.has_more_history:
+            return 0
+        page = self.store.load_messages(conversation.id, conversation.oldest_message_id, HISTORY_PAGE_SIZE)
+        conversation.messages[:0] = [{"role": row["role"], "content": row["content"]} for row in page]
+        if page:
+            conversation.oldest_message_id = page[0]["id"]
+        conversation.has_more_history = len(page) == HISTORY_PAGE_SIZE
+        return len(page)
     
-    async def connect(self, server_url: str) -> List[Dict]:
-        """连接到服务器"""
+    async def connect(self, server_url: str,
+                      on_models_changed: Optional[Callable[[List[Dict]], None]] = None,
+                      on_revalidate_error: Optional[Callable[[Exception], None]] = None) -> List[Dict]:
+        """
+        连接到服务器
+        
+        有缓存的模型列表时立即返回缓存，同时在后台重新获取模型列表，
+        列表有变化时通过 on_models_changed 通知，获取失败时通过 on_revalidate_error 通知。
+        
+        Args:
+            server_url: 服务器地址
+            on_models_changed: 后台刷新发现模型列表变化时的回调，参数为新的模型列表
+            on_revalidate_error: 后台刷新失败时的回调，参数为异常，此时缓存的模型列表可能已过期、服务器可能不可用
+        """
         try:
-            self.chat_api = type(self.chat_api)(
+            self._cancel_revalidation()
+            # 释放旧客户端占用的连接，避免重复连接时泄漏套接字
+            if self.chat_api:
+                await self.chat_api.disconnect()
+            self.chat_api = self.api_factory(
                 server_url,
                 self.config_manager.get_timeout()
             )
-            models = await self.chat_api.get_models()
+            models = self.model_cache.get(server_url) if self.model_cache else None
+            if models:
+                self._revalidate_task = asyncio.create_task(
+                    self._revalidate_models(server_url, on_models_changed, on_revalidate_error)
+                )
+            else:
+                models = await self.chat_api.get_models()
+                if self.model_cache:
+                    await self._put_models(server_url, models)
             self.is_connected = True
+            self.server_url = server_url
             self.config_manager.set_server_url(server_url)
+            # 补建上次运行之后保存的消息的索引
+            self._schedule_indexing()
             return models
         except Exception as e:
             self.is_connected = False
             raise e
     
+    async def _put_models(self, server_url: str, models: List[Dict]) -> bool:
+        """在线程池中更新模型列表缓存，写缓存文件时不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.model_cache.put, server_url, models)
+    
+    async def _revalidate_models(self, server_url: str,
+                                 on_models_changed: Optional[Callable[[List[Dict]], None]],
+                                 on_revalidate_error: Optional[Callable[[Exception], None]]):
+        """在后台重新获取模型列表并更新缓存"""
+        try:
+            models = await self.chat_api.get_models()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"刷新模型列表失败：{e}", file=sys.stderr)
+            if on_revalidate_error:
+                on_revalidate_error(e)
+            return
+        if await self._put_models(server_url, models) and on_models_changed:
+            on_models_changed(models)
+    
+    def _cancel_revalidation(self):
+        """取消进行中的模型列表刷新"""
+        if self._revalidate_task and not self._revalidate_task.done():
+            self._revalidate_task.cancel()
+        self._revalidate_task = None
+    
     async def disconnect(self):
         """断开连接"""
+        self._cancel_revalidation()
+        if self._index_task and not self._index_task.done():
+            self._index_task.cancel()
+        self._index_task = None
         if self.chat_api:
             await self.chat_api.disconnect()
         self.is_connected = False
-        self.current_model = None
-        self.messages.clear()
+        self.server_url = None
     
-    async def send_message(self, message: str) -> Dict:
-        """发送消息"""
-        if not self.is_connected or not self.current_model:
+    def _concurrency_limit(self) -> int:
+        """
+        当前连接同时进行的请求总数上限：每个服务器的并发数乘以服务器数量
+        
+        连接池中每个后端的上限由 PooledChatAPI 保证，这里只限制总数。
+        """
+        servers = max(len(parse_server_urls(self.server_url or "")), 1)
+        return self.config_manager.get_max_concurrency() * servers
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """获取当前连接的请求总数限制，超出的请求在这里排队"""
+        semaphore = self._semaphores.get(self.server_url)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._concurrency_limit())
+            self._semaphores[self.server_url] = semaphore
+        return semaphore
+    
+    async def send_message(self, message: str, on_chunk: Optional[Callable[[str], None]] = None,
+                           conversation_id: Optional[str] = None) -> Dict:
+        """
+        发送消息（流式接收回复）
+        
+        不同对话的请求可以并发执行，同一服务器上的并发数受配置限制。
+        
+        Args:
+            message: 用户输入的消息
+            on_chunk: 每收到一块回复时的回调，参数为目前已收到的完整内容
+            conversation_id: 对话ID，默认为当前对话
+        
+        Returns:
+            Dict: 完整的助手回复消息
+        """
+        conversation = self.conversations.get(conversation_id)
+        if not self.is_connected or not conversation.model:
             raise RuntimeError("未连接到服务器或未选择模型")
+        if conversation.is_busy:
+            raise RuntimeError("该对话正在等待回复")
         
-        self.messages.append({"role": "user", "content": message})
+        model = conversation.model
+        chat_api = self.chat_api
+        self.ensure_loaded(conversation)
+        conversation.is_busy = True
+        conversation.update_title(message)
+        user_message = {"role": "user", "content": message}
+        conversation.messages.append(user_message)
+        content = ""
+        role = "assistant"
+        metrics = get_metrics()
+        start = time.perf_counter()
         try:
-            response = await self.chat_api.send_message(
-                self.current_model,
-                self.messages
-            )
-            self.messages.append(response)
+            async with self._get_semaphore():
+                metrics.observe("chat_queue_seconds", time.perf_counter() - start)
+                context = conversation.messages
+                if self.context_policy:
+                    with metrics.timer("context_prepare_seconds"):
+                        context = await self.context_policy.prepare(model, conversation.messages, chat_api)
+                if self.retriever:
+                    with metrics.timer("retrieval_seconds"):
+                        context = await self._augment_context(context, message, conversation.id, chat_api)
+                
+                stream = chat_api.stream_message(
+                    model,
+                    context,
+                    self.config_manager.get_model_options(model),
+                    self.config_manager.get_keep_alive()
+                )
+                async for chunk in stream:
+                    delta = chunk.get("message", {})
+                    role = delta.get("role", role)
+                    if delta.get("content"):
+                        if not content:
+                            # 从用户发送到收到第一个字，包括排队和上下文处理的耗时
+                            metrics.observe("chat_first_token_seconds", time.perf_counter() - start)
+                        content += delta["content"]
+                        if on_chunk:
+                            on_chunk(content)
+            response = {"role": role, "content": content}
+            conversation.messages.append(response)
+            self._persist(conversation, [user_message, response])
             return response
+        except asyncio.CancelledError:
+            # 被用户停止时保留已生成的部分回复
+            if content:
+                response = {"role": role, "content": content}
+                conversation.messages.append(response)
+                self._persist(conversation, [user_message, response])
+            else:
+                conversation.messages.pop()
+            raise
         except Exception as e:
-            self.messages.pop()  # 移除未成功的消息
+            conversation.messages.pop()  # 移除未成功的消息
             raise e
+        finally:
+            conversation.is_busy = False
+    
+    async def _augment_context(self, context: List[Dict[str, str]], message: str,
+                               conversation_id: str, chat_api: ChatAPI) -> List[Dict[str, str]]:
+        """
+        检索相关片段，作为系统消息插在最后一条用户消息之前
+        
+        插在末尾而不是开头，之前的消息前缀保持不变，服务器仍可复用KV缓存。
+        检索失败时不影响发送。
+        """
+        try:
+            snippets = await self.retriever.retrieve(chat_api, message, exclude_conversation=conversation_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"检索相关内容失败：{e}", file=sys.stderr)
+            return context
+        if not snippets:
+            return context
+        from retrieval import format_snippets
+        get_metrics().increment("retrieval_injected_snippets", len(snippets))
+        return context[:-1] + [{"role": "system", "content": format_snippets(snippets)}] + context[-1:]
+    
+    async def run_batch(self, items: BatchItems, model: Optional[str] = None, ordered: bool = False,
+                        checkpoint_file: Optional[str] = None,
+                        stats: Optional[BatchStats] = None) -> AsyncIterator[Dict]:
+        """
+        批量发送对话，逐项返回结果
+        
+        输入逐项读取，同时进行的请求数受与 send_message 相同的并发限制（连接池中每个后端
+        分别限制），已读取但未输出的项不超过并发数的若干倍，输入再多内存占用也有上限。
+        批量对话不加入对话列表，也不保存到历史记录。
+        
+        Args:
+            items: 可迭代对象或异步迭代器，每项为字符串或包含 prompt/messages 的字典，可选 id 和 model
+            model: 未指定模型的项使用的模型，默认为当前对话的模型
+            ordered: 为True时按输入顺序返回结果，否则按完成顺序返回
+            checkpoint_file: 进度文件，已完成的项不再请求，直接返回保存的结果（带 resumed 标记）
+            stats: 吞吐量统计，调用方可以在运行中或结束后读取
+        
+        Yields:
+            Dict: 包含 id、model、elapsed，成功时包含 response 和 tokens，失败时包含 error；
+            格式不正确的项只包含 id 和 error，不中断其余的项
+        
+        Raises:
+            RuntimeError: 未连接到服务器时
+        """
+        if not self.is_connected:
+            raise RuntimeError("未连接到服务器")
+        model = model or self.current_model
+        stats = stats if stats is not None else BatchStats()
+        checkpoint = BatchCheckpoint(checkpoint_file) if checkpoint_file else None
+        semaphore = self._get_semaphore()
+        window = self._concurrency_limit() * BATCH_WINDOW_FACTOR
+        source = iterate_items(items)
+        pending: Set[asyncio.Future] = set()
+        indexes: Dict[asyncio.Future, int] = {}  # 任务 -> 输入序号
+        finished: Dict[int, Dict] = {}  # 输入序号 -> 已完成但尚未按顺序输出的结果
+        next_index = 0  # 按顺序输出时下一个要输出的序号
+        read = 0
+        exhausted = False
+        try:
+            while True:
+                # 补充进行中的请求，直到达到窗口大小
+                while not exhausted and len(pending) + len(finished) < window:
+                    try:
+                        item = await source.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    invalid = None
+                    try:
+                        item = normalize_item(item, read, model)
+                    except ValueError as e:
+                        invalid = {"id": self._invalid_item_id(item, e, read), "error": str(e)}
+                    saved = checkpoint.get(item["id"]) if checkpoint and invalid is None else None
+                    if invalid is not None or saved is not None:
+                        task = asyncio.get_running_loop().create_future()
+                        task.set_result(invalid or dict(saved, resumed=True))
+                    else:
+                        task = asyncio.create_task(self._run_batch_item(item, semaphore))
+                    indexes[task] = read
+                    pending.add(task)
+                    read += 1
+                if not pending:
+                    break
+                
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=indexes.get):
+                    index = indexes.pop(task)
+                    result = task.result()
+                    stats.record(result)
+                    if checkpoint and "error" not in result and not result.get("resumed"):
+                        checkpoint.record(result)
+                    if ordered:
+                        finished[index] = result
+                    else:
+                        yield result
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in pending:
+                task.cancel()
+            if checkpoint:
+                checkpoint.close()
+            stats.finish()
+    
+    @staticmethod
+    def _invalid_item_id(item, error: ValueError, index: int):
+        """格式不正确的项在结果中使用的ID：输入中给出的ID，没有时使用序号"""
+        if isinstance(error, InvalidItem) and error.item_id is not None:
+            return error.item_id
+        if isinstance(item, dict) and "id" in item:
+            return item["id"]
+        return index
+    
+    async def _run_batch_item(self, item: Dict, semaphore: asyncio.Semaphore) -> Dict:
+        """执行批量任务中的一项，错误记录在结果中而不抛出"""
+        model = item["model"]
+        result = {key: value for key, value in item.items() if key != "messages"}
+        chat_api = self.chat_api
+        start = time.monotonic()
+        try:
+            async with semaphore:
+                context = item["messages"]
+                if self.context_policy:
+                    context = await self.context_policy.prepare(model, context, chat_api)
+                content = ""
+                tokens = None
+                async for chunk in chat_api.stream_message(
+                    model, context, self.config_manager.get_model_options(model), self.config_manager.get_keep_alive()
+                ):
+                    content += chunk.get("message", {}).get("content", "")
+                    if chunk.get("done"):
+                        tokens = chunk.get("eval_count")
+            result["response"] = content
+            result["tokens"] = tokens
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+        result["elapsed"] = round(time.monotonic() - start, 3)
+        return result
+    
+    def _persist(self, conversation: Conversation, messages: List[Dict[str, str]]):
+        """追加写入新消息"""
+        if not self.store:
+            return
+        try:
+            self.store.save_conversation(conversation.id, conversation.title, conversation.model,
+                                         conversation.created_at)
+            self.store.append_messages(conversation.id, messages)
+        except Exception as e:
+            print(f"保存对话记录失败：{e}", file=sys.stderr)
+            return
+        self._schedule_indexing()
+    
+    def _schedule_indexing(self):
+        """在后台为新保存的消息建立检索索引，同一时间只有一个索引任务"""
+        if not self.retriever or not self.store or not self.is_connected:
+            return
+        self._index_pending = True
+        if self._index_task is None or self._index_task.done():
+            self._index_task = asyncio.create_task(self._index_messages())
+    
+    async def _index_messages(self):
+        while self._index_pending:
+            self._index_pending = False
+            try:
+                await self.retriever.sync(self.chat_api)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"更新检索索引失败：{e}", file=sys.stderr)
+                return
+    
+    async def attach_document(self, path: str) -> int:
+        """
+        把文本文件加入检索索引，之后的提问会引用其中相关的片段
+        
+        Returns:
+            int: 加入索引的片段数量，文件未变化时为0
+        
+        Raises:
+            RuntimeError: 未启用检索或未连接服务器时
+        """
+        if not self.retriever:
+            raise RuntimeError("未启用语义检索")
+        if not self.is_connected:
+            raise RuntimeError("未连接到服务器")
+        return await self.retriever.add_document(self.chat_api, path)
     
     def set_current_model(self, model: str):
         """设置当前模型"""
         self.current_model = model
     
+    async def prewarm(self):
+        """预加载当前模型，避免第一条消息承担冷启动耗时"""
+        if not self.is_connected or not self.current_model:
+            return
+        await self.chat_api.load_model(self.current_model, self.config_manager.get_keep_alive())
+    
     def toggle_favorite(self, server_url: str) -> bool:
         """切换收藏状态"""
         favorites = self.config_manager.get_favorite_servers()
@@ -70,9 +497,65 @@ class ChatController:
             self.config_manager.add_favorite_server(server_url)
             return True
     
-    def get_messages(self) -> List[Dict[str, str]]:
-        """获取消息历史"""
-        return self.messages.copy()
+    def get_messages(self, conversation_id: Optional[str] = None) -> List[Dict[str, str]]:
+        """获取消息历史，默认为当前对话"""
+        return self.conversations.get(conversation_id).messages.copy()
+    
+    def new_conversation(self) -> Conversation:
+        """新建对话，沿用当前对话的模型"""
+        return self.conversations.create(self.current_model)
+    
+    def switch_conversation(self, conversation_id: str) -> Conversation:
+        """切换当前对话"""
+        conversation = self.conversations.activate(conversation_id)
+        self.ensure_loaded(conversation)
+        return conversation
+    
+    def close_conversation(self, conversation_id: str) -> None:
+        """关闭对话并删除其历史记录，至少保留一个对话"""
+        model = self.current_model
+        self.conversations.remove(conversation_id)
+        if self.store:
+            self.store.delete_conversation(conversation_id)
+        if self.retriever:
+            self.retriever.remove_conversation(conversation_id)
+        if not self.conversations.list():
+            self.conversations.create(model)
+    
+    def get_conversations(self) -> List[Conversation]:
+        """获取所有对话"""
+        return self.conversations.list()
+    
+    def search_messages(self, query: str, limit: int = 50) -> List[Dict]:
+        """全文检索历史消息"""
+        if not self.store:
+            return []
+        return self.store.search(query, limit)
+    
+    def open_message(self, conversation_id: str, message_id: int) -> Optional[int]:
+        """
+        切换到消息所在的对话，并读取到包含该消息的历史页
+        
+        Returns:
+            Optional[int]: 消息在对话消息列表中的位置，找不到时返回None
+        """
+        if not self.store:
+            return None
+        if not self.conversations.has(conversation_id):
+            row = self.store.get_conversation(conversation_id)
+            if row is None:
+                return None
+            self.conversations.add(
+                Conversation(row["id"], row["model"], row["title"], row["created_at"], loaded=False)
+            )
+        conversation = self.switch_conversation(conversation_id)
+        while (conversation.oldest_message_id is not None
+               and conversation.oldest_message_id > message_id
+               and conversation.has_more_history):
+            self.load_more_messages(conversation_id)
+        if conversation.oldest_message_id is None or conversation.oldest_message_id > message_id:
+            return None
+        return self.store.count_messages(conversation_id, conversation.oldest_message_id, message_id)
     
     def get_favorite_servers(self) -> List[str]:
         """获取收藏的服务器列表"""
@@ -0,0 +1,291 @@
+from typing import List, Dict, Optional, AsyncIterator, Awaitable, Callable, Set
+import aiohttp
+import asyncio
+import sys
+import time
+from chat_api import ChatAPI, OllamaChatAPI, CoalescingChatAPI
+from connection_manager import ConnectionManager
+from resilient_api import ResilientChatAPI
+from response_cache import CachingChatAPI, ResponseCache
+
+# 这些错误说明后端暂时不可用，可以切换到其他后端重试
+FAILOVER_ERRORS = (asyncio.TimeoutError, aiohttp.ClientConnectionError)
+
+
+def is_failover_error(error: Exception) -> bool:
+    """判断错误是否应切换到其他后端"""
+    if isinstance(error, FAILOVER_ERRORS):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and error.status >= 500
+
+
+class Backend:
+    """连接池中的单个后端服务器"""
+
+    def __init__(self, api: ChatAPI, url: str):
+        self.api = api
+        self.url = url
+        self.healthy = True
+        self.latency: Optional[float] = None  # 探测延迟的指数移动平均（秒）
+        self.models: Set[str] = set()
+        self.model_list: List[Dict] = []
+        self.in_flight = 0
+
+    def record_latency(self, latency: float, alpha: float = 0.3):
+        """更新延迟统计"""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = alpha * latency + (1 - alpha) * self.latency
+
+    def load_key(self):
+        """负载排序键：进行中的请求越少、延迟越低越优先"""
+        return (self.in_flight, self.latency if self.latency is not None else float("inf"))
+
+
+class PooledChatAPI(ChatAPI):
+    """
+    多服务器连接池，按健康状态和负载路由请求
+
+    设置了每个后端的并发上限时，请求只会发往还有空闲名额的后端，所有候选后端都满时排队等待，
+    一个后端变慢时请求自然流向其他后端，而不会在慢的后端上堆积。
+    """
+
+    def __init__(self, server_urls: List[str], timeout: float, health_interval: float = 30.0,
+                 connection_manager: Optional[ConnectionManager] = None,
+                 retry_settings: Optional[Dict] = None,
+                 max_concurrency: int = 0):
+        """
+        初始化连接池
+
+        Args:
+            server_urls: 后端服务器地址列表
+            timeout: 读取超时时间（秒）
+            health_interval: 健康检查间隔（秒）
+            connection_manager: 共享的连接管理器，不提供时每个后端使用独立的会话
+            retry_settings: 重试与熔断设置，为每个后端单独设置熔断器
+            max_concurrency: 每个后端同时进行的聊天和向量请求数上限，0表示不限制
+        """
+        if not server_urls:
+            raise ValueError("服务器地址列表不能为空")
+        self.backends = [
+            Backend(create_backend_api(url, timeout, connection_manager, retry_settings), url)
+            for url in server_urls
+        ]
+        self.health_interval = health_interval
+        self.max_concurrency = max_concurrency
+        self._health_task: Optional[asyncio.Task] = None
+        self._probed = False
+        self._slot_freed: Optional[asyncio.Event] = None  # 有后端释放名额时通知排队的请求
+
+    async def connect(self) -> None:
+        """连接所有后端并启动健康检查"""
+        for backend in self.backends:
+            await backend.api.connect()
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def disconnect(self) -> None:
+        """停止健康检查并断开所有后端"""
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for backend in self.backends:
+            await backend.api.disconnect()
+        self._probed = False
+
+    async def _health_loop(self):
+        """定期探测所有后端"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.probe()
+
+    async def _probe_backend(self, backend: Backend):
+        """探测单个后端的可用性、延迟和模型列表"""
+        start = time.monotonic()
+        try:
+            models = await backend.api.get_models()
+        except Exception as e:
+            backend.healthy = False
+            print(f"服务器 {backend.url} 健康检查失败：{e}", file=sys.stderr)
+            return
+        backend.record_latency(time.monotonic() - start)
+        backend.model_list = models
+        backend.models = {model["name"] for model in models}
+        backend.healthy = True
+
+    async def probe(self):
+        """并发探测所有后端"""
+        await asyncio.gather(*(self._probe_backend(backend) for backend in self.backends))
+        self._probed = True
+
+    async def get_models(self) -> List[Dict]:
+        """
+        获取所有健康后端上可用模型的并集
+
+        Raises:
+            aiohttp.ClientError: 当所有后端都不可用时
+        """
+        if self._health_task is None:
+            await self.connect()
+        await self.probe()
+
+        models: Dict[str, Dict] = {}
+        for backend in self.backends:
+            if backend.healthy:
+                for model in backend.model_list:
+                    models.setdefault(model["name"], model)
+        if not any(backend.healthy for backend in self.backends):
+            raise aiohttp.ClientConnectionError("所有服务器均无法连接")
+        return list(models.values())
+
+    def _candidates(self, model: str) -> List[Backend]:
+        """按优先级排列可处理该模型的后端"""
+        with_model = [b for b in self.backends if model in b.models] or list(self.backends)
+        healthy = sorted((b for b in with_model if b.healthy), key=Backend.load_key)
+        unhealthy = sorted((b for b in with_model if not b.healthy), key=Backend.load_key)
+        # 健康后端都失败时，再尝试被标记为不健康的后端
+        return healthy + unhealthy
+
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
+        """发送消息到负载最低的健康后端，失败时切换后端"""
+        return await self._with_failover(
+            model, lambda api: api.send_message(model, messages, options, keep_alive)
+        )
+
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        """在负载最低的健康后端上计算向量，失败时切换后端"""
+        return await self._with_failover(model, lambda api: api.embed(model, inputs, keep_alive))
+
+    async def _acquire(self, model: str, tried: Set[Backend]) -> Optional[Backend]:
+        """
+        占用优先级最高且有空闲名额的候选后端，都满时等待其他请求结束
+
+        Returns:
+            Optional[Backend]: 占用的后端，所有候选后端都已尝试过时返回None
+        """
+        while True:
+            candidates = [backend for backend in self._candidates(model) if backend not in tried]
+            if not candidates:
+                return None
+            # 还有未尝试的健康后端时只在健康后端中选择，都满时等待，而不是转向不健康的后端
+            healthy = [backend for backend in candidates if backend.healthy]
+            for backend in healthy or candidates:
+                if not self.max_concurrency or backend.in_flight < self.max_concurrency:
+                    backend.in_flight += 1
+                    return backend
+            if self._slot_freed is None:
+                self._slot_freed = asyncio.Event()
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+
+    def _release(self, backend: Backend) -> None:
+        backend.in_flight -= 1
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+
+    async def _with_failover(self, model: str, operation: Callable[[ChatAPI], Awaitable]):
+        """依次在候选后端上执行请求，直到成功或遇到不应切换后端的错误"""
+        if not self._probed:
+            await self.get_models()
+
+        last_error: Optional[Exception] = None
+        tried: Set[Backend] = set()
+        while True:
+            backend = await self._acquire(model, tried)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+            try:
+                return await operation(backend.api)
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                backend.healthy = False
+                last_error = e
+            finally:
+                self._release(backend)
+
+    async def stream_message(self, model: str, messages: List[Dict[str, str]],
+                             options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        """流式发送消息，只在收到第一块响应之前切换后端"""
+        if not self._probed:
+            await self.get_models()
+
+        last_error: Optional[Exception] = None
+        tried: Set[Backend] = set()
+        while True:
+            backend = await self._acquire(model, tried)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+            started = False
+            try:
+                async for chunk in backend.api.stream_message(model, messages, options, keep_alive):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not is_failover_error(e):
+                    raise
+                backend.healthy = False
+                last_error = e
+            finally:
+                self._release(backend)
+
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        """在所有提供该模型的健康后端上预加载模型"""
+        if not self._probed:
+            await self.get_models()
+
+        backends = [b for b in self.backends if b.healthy and model in b.models]
+        results = await asyncio.gather(
+            *(b.api.load_model(model, keep_alive) for b in backends),
+            return_exceptions=True
+        )
+        for backend, result in zip(backends, results):
+            if isinstance(result, Exception):
+                print(f"服务器 {backend.url} 预加载模型失败：{result}", file=sys.stderr)
+
+
+def parse_server_urls(server_url: str) -> List[str]:
+    """解析以逗号分隔的服务器地址"""
+    return [url.strip() for url in server_url.split(",") if url.strip()]
+
+
+def create_backend_api(server_url: str, timeout: float,
+                       connection_manager: Optional[ConnectionManager] = None,
+                       retry_settings: Optional[Dict] = None) -> ChatAPI:
+    """创建单个服务器的API客户端，启用重试时加上重试和熔断包装"""
+    api = OllamaChatAPI(server_url, timeout, connection_manager)
+    if retry_settings and retry_settings.get("enabled"):
+        settings = {key: value for key, value in retry_settings.items() if key != "enabled"}
+        api = ResilientChatAPI(api, server_url, **settings)
+    return api
+
+
+def create_chat_api(server_url: str, timeout: float, health_interval: float = 30.0,
+                    connection_manager: Optional[ConnectionManager] = None,
+                    retry_settings: Optional[Dict] = None,
+                    response_cache: Optional[ResponseCache] = None,
+                    max_concurrency: int = 0) -> ChatAPI:
+    """
+    根据服务器地址创建API客户端，多个地址时创建连接池
+
+    并发的相同请求合并为一个；提供回复缓存时在最外层加上缓存，未命中的请求再合并。
+    max_concurrency 为连接池中每个后端的并发上限，单个服务器时由调用方限制。
+    """
+    urls = parse_server_urls(server_url)
+    if len(urls) > 1:
+        api = PooledChatAPI(urls, timeout, health_interval, connection_manager, retry_settings, max_concurrency)
+    else:
+        api = create_backend_api(urls[0] if urls else server_url, timeout, connection_manager, retry_settings)
+    api = CoalescingChatAPI(api, ",".join(urls) or server_url)
+    if response_cache is not None:
+        api = CachingChatAPI(api, response_cache)
+    return api
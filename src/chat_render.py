@@ -0,0 +1,572 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable, Any
+
+from metrics import get_metrics
+from startup_profile import get_profiler
+
+
+CHAT_PAGE_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background-color: #f5f5f5;
+            font-size: 14px;
+            line-height: 1.5;
+        }
+        .message {
+            margin-bottom: 20px;
+            padding: 15px;
+            border-radius: 10px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        .user-message {
+            background-color: #e3f2fd;
+            margin-left: 20%;
+        }
+        .ai-message {
+            background-color: #ffffff;
+            margin-right: 20%;
+        }
+        .highlight {
+            outline: 2px solid #ffb300;
+        }
+        .virtual {
+            box-sizing: border-box;
+            box-shadow: none;
+            background-color: transparent;
+        }
+        .message-header {
+            font-weight: 600;
+            margin-bottom: 8px;
+            color: #666;
+            font-size: 12px;
+        }
+        pre {
+            position: relative;
+            background-color: #1e1e1e !important;
+            color: #d4d4d4;
+            padding: 1em 1.5em;
+            border-radius: 8px;
+            overflow-x: auto;
+            font-family: "SF Mono", "Cascadia Code", Menlo, Consolas, "DejaVu Sans Mono", monospace;
+            font-size: 13px;
+            line-height: 1.6;
+            margin: 1em 0;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.15);
+            border: 1px solid #333;
+        }
+        pre::before {
+            content: attr(data-language);
+            position: absolute;
+            top: 0;
+            right: 0;
+            padding: 4px 8px;
+            font-size: 12px;
+            font-weight: 600;
+            color: #d4d4d4;
+            background: #333;
+            border-radius: 0 8px 0 8px;
+        }
+        code {
+            font-family: "SF Mono", "Cascadia Code", Menlo, Consolas, "DejaVu Sans Mono", monospace;
+            background-color: #f3f4f6;
+            padding: 0.2em 0.4em;
+            border-radius: 4px;
+            font-size: 85%;
+            color: #24292e;
+        }
+        pre code {
+            background-color: transparent;
+            padding: 0;
+            font-size: inherit;
+            color: inherit;
+            white-space: pre;
+            word-break: normal;
+            word-wrap: normal;
+        }
+        /* VS Code Dark+ 主题配色 */
+        .codehilite .hll { background-color: #3c3c3c }
+        .codehilite .c { color: #6a9955 } /* Comment */
+        .codehilite .err { color: #f44747 } /* Error */
+        .codehilite .k { color: #569cd6 } /* Keyword */
+        .codehilite .l { color: #ce9178 } /* Literal */
+        .codehilite .n { color: #d4d4d4 } /* Name */
+        .codehilite .o { color: #d4d4d4 } /* Operator */
+        .codehilite .p { color: #d4d4d4 } /* Punctuation */
+        .codehilite .cm { color: #6a9955 } /* Comment.Multiline */
+        .codehilite .cp { color: #6a9955 } /* Comment.Preproc */
+        .codehilite .c1 { color: #6a9955 } /* Comment.Single */
+        .codehilite .cs { color: #6a9955 } /* Comment.Special */
+        .codehilite .kc { color: #569cd6 } /* Keyword.Constant */
+        .codehilite .kd { color: #569cd6 } /* Keyword.Declaration */
+        .codehilite .kn { color: #569cd6 } /* Keyword.Namespace */
+        .codehilite .kp { color: #569cd6 } /* Keyword.Pseudo */
+        .codehilite .kr { color: #569cd6 } /* Keyword.Reserved */
+        .codehilite .kt { color: #569cd6 } /* Keyword.Type */
+        .codehilite .ld { color: #ce9178 } /* Literal.Date */
+        .codehilite .m { color: #b5cea8 } /* Literal.Number */
+        .codehilite .s { color: #ce9178 } /* Literal.String */
+        .codehilite .na { color: #9cdcfe } /* Name.Attribute */
+        .codehilite .nb { color: #dcdcaa } /* Name.Builtin */
+        .codehilite .nc { color: #4ec9b0 } /* Name.Class */
+        .codehilite .no { color: #4fc1ff } /* Name.Constant */
+        .codehilite .nd { color: #dcdcaa } /* Name.Decorator */
+        .codehilite .ni { color: #d4d4d4 } /* Name.Entity */
+        .codehilite .ne { color: #f44747 } /* Name.Exception */
+        .codehilite .nf { color: #dcdcaa } /* Name.Function */
+        .codehilite .nl { color: #d4d4d4 } /* Name.Label */
+        .codehilite .nn { color: #d4d4d4 } /* Name.Namespace */
+        .codehilite .nx { color: #4ec9b0 } /* Name.Other */
+        .codehilite .py { color: #d4d4d4 } /* Name.Property */
+        .codehilite .nt { color: #569cd6 } /* Name.Tag */
+        .codehilite .nv { color: #9cdcfe } /* Name.Variable */
+        .codehilite .ow { color: #569cd6 } /* Operator.Word */
+        .codehilite .mb { color: #b5cea8 } /* Literal.Number.Bin */
+        .codehilite .mf { color: #b5cea8 } /* Literal.Number.Float */
+        .codehilite .mh { color: #b5cea8 } /* Literal.Number.Hex */
+        .codehilite .mi { color: #b5cea8 } /* Literal.Number.Integer */
+        .codehilite .mo { color: #b5cea8 } /* Literal.Number.Oct */
+        .codehilite .sa { color: #ce9178 } /* Literal.String.Affix */
+        .codehilite .sb { color: #ce9178 } /* Literal.String.Backtick */
+        .codehilite .sc { color: #ce9178 } /* Literal.String.Char */
+        .codehilite .dl { color: #ce9178 } /* Literal.String.Delimiter */
+        .codehilite .sd { color: #6a9955 } /* Literal.String.Doc */
+        .codehilite .s2 { color: #ce9178 } /* Literal.String.Double */
+        .codehilite .se { color: #ce9178 } /* Literal.String.Escape */
+        .codehilite .sh { color: #ce9178 } /* Literal.String.Heredoc */
+        .codehilite .si { color: #ce9178 } /* Literal.String.Interpol */
+        .codehilite .sx { color: #ce9178 } /* Literal.String.Other */
+        .codehilite .sr { color: #d16969 } /* Literal.String.Regex */
+        .codehilite .s1 { color: #ce9178 } /* Literal.String.Single */
+        .codehilite .ss { color: #ce9178 } /* Literal.String.Symbol */
+    </style>
+    <script>
+        function scrollToBottom() {
+            window.scrollTo(0, document.body.scrollHeight);
+        }
+
+        function isNearBottom() {
+            return window.innerHeight + window.scrollY >= document.body.scrollHeight - 40;
+        }
+
+        // 为代码块添加语言标识
+        function decorateCodeBlocks(root) {
+            root.querySelectorAll('pre').forEach(function(pre) {
+                var code = pre.querySelector('code');
+                if (code && code.className) {
+                    var lang = code.className.split('-')[1];
+                    if (lang) {
+                        pre.setAttribute('data-language', lang);
+                    }
+                }
+            });
+        }
+
+        // 追加消息，仅解析新增部分；用户停留在底部时才自动滚动
+        function appendMessages(html) {
+            var stick = isNearBottom();
+            removeStreaming();
+            var holder = document.createElement('div');
+            holder.innerHTML = html;
+            decorateCodeBlocks(holder);
+            var chat = document.getElementById('chat');
+            while (holder.firstElementChild) {
+                var el = holder.firstElementChild;
+                el.setAttribute('data-index', chat.children.length);
+                chat.appendChild(el);
+                if (virtualObserver) {
+                    virtualObserver.observe(el);
+                }
+            }
+            if (stick) {
+                scrollToBottom();
+            }
+        }
+
+        // 虚拟化：远离可视区域的消息替换为保持原高度的空占位，接近可视区域时再向程序请求HTML
+        var virtualObserver = null;
+
+        function enableVirtualization(margin) {
+            if (virtualObserver || !window.IntersectionObserver || !window.ollamaChat) {
+                return;
+            }
+            virtualObserver = new IntersectionObserver(function(entries) {
+                entries.forEach(function(entry) {
+                    var el = entry.target;
+                    var state = el.getAttribute('data-virtual');
+                    if (!entry.isIntersecting && !state) {
+                        el.style.height = el.offsetHeight + 'px';
+                        el.innerHTML = '';
+                        el.classList.add('virtual');
+                        el.setAttribute('data-virtual', 'idle');
+                    } else if (entry.isIntersecting && state === 'idle') {
+                        el.setAttribute('data-virtual', 'pending');
+                        window.ollamaChat.postMessage(JSON.stringify({
+                            type: 'render',
+                            index: parseInt(el.getAttribute('data-index'), 10)
+                        }));
+                    }
+                });
+            }, {rootMargin: margin + 'px 0px'});
+            var children = document.getElementById('chat').children;
+            for (var i = 0; i < children.length; i++) {
+                virtualObserver.observe(children[i]);
+            }
+        }
+
+        // 用程序返回的HTML恢复占位消息
+        function restoreMessage(index, html) {
+            var chat = document.getElementById('chat');
+            var el = chat.children[index];
+            if (!el || el.getAttribute('data-virtual') !== 'pending') {
+                return;
+            }
+            var holder = document.createElement('div');
+            holder.innerHTML = html;
+            var restored = holder.firstElementChild;
+            decorateCodeBlocks(restored);
+            restored.setAttribute('data-index', index);
+            if (el.classList.contains('highlight')) {
+                restored.classList.add('highlight');
+            }
+            virtualObserver.unobserve(el);
+            chat.replaceChild(restored, el);
+            virtualObserver.observe(restored);
+        }
+
+        // 保留前count条消息，移除其余消息
+        function truncateMessages(count) {
+            removeStreaming();
+            var chat = document.getElementById('chat');
+            while (chat.children.length > count) {
+                if (virtualObserver) {
+                    virtualObserver.unobserve(chat.lastElementChild);
+                }
+                chat.removeChild(chat.lastElementChild);
+            }
+        }
+
+        // 更新正在生成中的回复
+        function setStreaming(html) {
+            var stick = isNearBottom();
+            var el = document.getElementById('streaming');
+            if (!el) {
+                el = document.createElement('div');
+                el.id = 'streaming';
+                document.body.appendChild(el);
+            }
+            el.innerHTML = html;
+            decorateCodeBlocks(el);
+            if (stick) {
+                scrollToBottom();
+            }
+        }
+
+        // 滚动到指定消息并短暂高亮
+        function scrollToMessage(index) {
+            var el = document.getElementById('chat').children[index];
+            if (!el) {
+                return;
+            }
+            el.scrollIntoView({block: 'center'});
+            el.classList.add('highlight');
+            setTimeout(function() {
+                el.classList.remove('highlight');
+            }, 2000);
+        }
+
+        function removeStreaming() {
+            var el = document.getElementById('streaming');
+            if (el) {
+                el.parentNode.removeChild(el);
+            }
+        }
+
+        document.addEventListener('DOMContentLoaded', function() {
+            decorateCodeBlocks(document);
+        });
+    </script>
+</head>
+<body onload="scrollToBottom()">
+    <div id="chat"><!--MESSAGES--></div>
+</body>
+</html>
+"""
+
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "codehilite", "tables"]
+MARKDOWN_EXTENSION_CONFIGS = {
+    "codehilite": {
+        "css_class": "codehilite",
+        "use_pygments": True,
+        "noclasses": False,
+        "guess_lang": True,
+    }
+}
+RENDER_CACHE_MAX_BYTES = 16 * 1024 * 1024  # 渲染缓存上限（字节）
+RENDER_WORKERS = 2  # 后台渲染线程数
+VIRTUAL_MARGIN = 2000  # 可视区域上下保留完整消息的范围（像素），范围外的消息替换为占位
+VIRTUAL_RENDER_TAIL = 30  # 一次追加大量消息时只完整渲染最后的消息数，其余先以占位显示
+
+
+class RenderCache:
+    """按字节大小淘汰的LRU渲染结果缓存"""
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """获取缓存，命中时移到最近使用的位置"""
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key: str, html: str) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.encode("utf-8"))
+            self._entries[key] = html
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.encode("utf-8"))
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class MarkdownRenderer:
+    """每个线程复用各自的Markdown解析器并共享渲染结果缓存的渲染器"""
+
+    def __init__(self, cache: Optional[RenderCache] = None):
+        self.cache = cache if cache is not None else RenderCache()
+        # markdown和Pygments（由codehilite引入）导入较慢，在第一次渲染AI回复时才加载
+        with get_profiler().phase("加载Markdown和Pygments"):
+            import markdown
+            self._markdown = markdown
+            self._local = threading.local()
+            self._parser()
+        # 渲染配置参与缓存键，配置变化时旧结果自然失效
+        self._config_key = json.dumps(
+            [MARKDOWN_EXTENSIONS, MARKDOWN_EXTENSION_CONFIGS, "escape_html"], sort_keys=True
+        )
+
+    def _parser(self):
+        """
+        获取当前线程的Markdown实例
+
+        Markdown实例不是线程安全的，每个渲染线程使用自己的实例，
+        流式回复的渲染不会挡住另一个线程上的历史消息渲染。
+        """
+        md = getattr(self._local, "md", None)
+        if md is None:
+            md = self._markdown.Markdown(
+                extensions=MARKDOWN_EXTENSIONS,
+                extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+            )
+            # 不保留文本中的原始HTML，转义后显示，避免回复中的脚本调用页面的 window.ollamaChat
+            md.preprocessors.deregister("html_block")
+            md.inlinePatterns.deregister("html")
+            self._local.md = md
+        return md
+
+    def cache_key(self, content: str) -> str:
+        """根据内容和渲染配置计算缓存键"""
+        digest = hashlib.sha256(self._config_key.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def render(self, content: str) -> str:
+        """将Markdown文本转换为HTML，优先使用缓存"""
+        key = self.cache_key(content)
+        html = self.cache.get(key)
+        if html is None:
+            with get_metrics().timer("render_markdown_seconds"):
+                html = self._parser().reset().convert(content)
+            self.cache.put(key, html)
+        return html
+
+
+_renderer: Optional[MarkdownRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> MarkdownRenderer:
+    """获取共享的Markdown渲染器，首次调用时创建"""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = MarkdownRenderer()
+    return _renderer
+
+
+def render_markdown(content: str) -> str:
+    """将Markdown文本转换为HTML"""
+    return get_renderer().render(content)
+
+
+def render_message_html(message: Dict[str, str]) -> str:
+    """生成单条消息的HTML片段，不经过Markdown渲染的内容转义后插入"""
+    role = message["role"]
+    content = message["content"]
+
+    if role == "user":
+        return f"""
+        <div class="message user-message">
+            <div class="message-header">用户</div>
+            <div>{escape(content)}</div>
+        </div>
+        """
+
+    try:
+        md = render_markdown(content)
+    except Exception as e:
+        print(f"渲染Markdown失败，显示原文：{e}")
+        md = f"<pre>{escape(content)}</pre>"
+    return f"""
+        <div class="message ai-message">
+            <div class="message-header">AI</div>
+            <div>{md}</div>
+        </div>
+        """
+
+
+def render_placeholder_html(message: Dict[str, str]) -> str:
+    """生成未渲染消息的占位，高度按内容长度估算，滚动到附近时再替换为完整内容"""
+    role_class = "user-message" if message["role"] == "user" else "ai-message"
+    content = message["content"]
+    lines = content.count("\n") + len(content) // 80 + 1
+    height = 60 + lines * 21
+    return (f'<div class="message {role_class} virtual" data-virtual="idle" '
+            f'style="height:{height}px"></div>')
+
+
+def render_page(messages: List[Dict[str, str]]) -> str:
+    """生成包含全部消息的完整页面"""
+    html = "".join(render_message_html(msg) for msg in messages)
+    return CHAT_PAGE_TEMPLATE.replace("<!--MESSAGES-->", html)
+
+
+def js_call(function: str, *args) -> str:
+    """生成调用页面脚本函数的JS代码，参数以JSON编码"""
+    return f"{function}({', '.join(json.dumps(arg) for arg in args)});"
+
+
+class RenderPipeline:
+    """
+    后台渲染流水线
+
+    渲染任务在工作线程中执行，结果按提交顺序交回界面线程：先完成的任务会等待之前提交的任务，
+    保证页面更新的顺序与提交顺序一致。调用 reset() 开始新的一代后，之前提交但尚未交付的结果
+    都会被丢弃，尚未开始的任务也不再执行。
+    """
+
+    def __init__(self, dispatch: Callable[[Callable[[], None]], Any], max_workers: int = RENDER_WORKERS):
+        """
+        Args:
+            dispatch: 在界面线程中执行回调的函数（如 wx.CallAfter）
+            max_workers: 工作线程数
+        """
+        self._dispatch = dispatch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._next_seq = 0  # 下一个提交的任务序号
+        self._next_delivery = 0  # 下一个应交付的任务序号
+        self._ready: Dict[int, tuple] = {}  # 已完成但还未轮到交付的结果
+        self.generation = 0
+
+    def submit(self, job: Callable[[], Any], on_ready: Callable[[Any], None]) -> int:
+        """
+        提交渲染任务
+
+        Args:
+            job: 在工作线程中执行的任务，返回None表示没有需要交付的结果
+            on_ready: 在界面线程中按顺序接收结果的回调
+
+        Returns:
+            int: 任务序号
+        """
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            generation = self.generation
+        submitted = time.perf_counter()
+
+        def run():
+            result = None
+            if generation == self.generation:
+                try:
+                    with get_metrics().timer("render_job_seconds"):
+                        result = job()
+                except Exception as e:
+                    print(f"渲染失败：{e}")
+            with self._lock:
+                self._ready[seq] = (generation, result, on_ready, submitted)
+            self._dispatch(self._deliver)
+
+        self._executor.submit(run)
+        return seq
+
+    def reset(self) -> None:
+        """开始新的一代，丢弃之前提交的任务结果"""
+        with self._lock:
+            self.generation += 1
+
+    def _deliver(self) -> None:
+        """在界面线程中按序号交付已完成的结果"""
+        while True:
+            with self._lock:
+                item = self._ready.pop(self._next_delivery, None)
+                if item is None:
+                    return
+                self._next_delivery += 1
+            generation, result, on_ready, submitted = item
+            if generation == self.generation and result is not None:
+                get_metrics().observe("render_latency_seconds", time.perf_counter() - submitted)
+                on_ready(result)
+
+    def shutdown(self) -> None:
+        """停止工作线程，未开始的任务不再执行，已完成的结果不再交付"""
+        self.reset()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,386 @@
+from typing import List, Dict, Optional
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    model TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations(updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages(conversation_id, id);
+"""
+
+# trigram分词不依赖空格，可以检索中文；索引通过触发器随消息写入增量更新
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+# trigram无法匹配少于3个字符的词，而中文词多为一两个字，另建一个索引：
+# 连续的中日韩文字切分为单字和相邻两字，其他文字按单词切分。
+# 索引不保存原文，切分由连接上注册的Python函数完成，删除时以相同的切分结果删除
+CJK_SCHEMA = """
+CREATE VIRTUAL TABLE messages_cjk USING fts5(unigrams, bigrams, content='');
+CREATE TRIGGER messages_cjk_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_cjk(rowid, unigrams, bigrams)
+    VALUES (new.id, cjk_unigrams(new.content), cjk_bigrams(new.content));
+END;
+CREATE TRIGGER messages_cjk_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_cjk(messages_cjk, rowid, unigrams, bigrams)
+    VALUES ('delete', old.id, cjk_unigrams(old.content), cjk_bigrams(old.content));
+END;
+"""
+CJK_BACKFILL = """
+INSERT INTO messages_cjk(rowid, unigrams, bigrams)
+SELECT id, cjk_unigrams(content), cjk_bigrams(content) FROM messages
+"""
+FTS_MIN_TERM_LENGTH = 3  # trigram索引无法匹配少于3个字符的词
+SNIPPET_CONTEXT = 24  # 摘要中匹配词前后保留的字符数
+CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+
+
+def cjk_unigrams(text: str) -> str:
+    """文本中的中日韩文字，以空格分隔为单字"""
+    return " ".join("".join(CJK_RUN.findall(text)))
+
+
+def cjk_bigrams(text: str) -> str:
+    """把连续的中日韩文字切分为相邻两字的词（只有一个字时保留单字），其他文字原样保留"""
+    def split(match):
+        run = match.group()
+        if len(run) == 1:
+            return f" {run} "
+        return " " + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + " "
+    return CJK_RUN.sub(split, text)
+
+
+def make_snippet(content: str, terms: List[str], context: int = SNIPPET_CONTEXT) -> str:
+    """截取第一个匹配词附近的内容，匹配词用【】标出"""
+    lowered = content.lower()
+    positions = [(lowered.find(term.lower()), term) for term in terms]
+    positions = [(position, term) for position, term in positions if position >= 0]
+    if not positions:
+        return content[:context * 2]
+    position, term = min(positions)
+    start = max(position - context, 0)
+    end = min(position + len(term) + context, len(content))
+    return (("…" if start > 0 else "") + content[start:position]
+            + "【" + content[position:position + len(term)] + "】"
+            + content[position + len(term):end] + ("…" if end < len(content) else ""))
+
+
+class ChatStore:
+    """基于SQLite（WAL模式）的对话历史存储，逐条追加消息并按对话分页读取"""
+
+    def __init__(self, db_file: str):
+        """
+        打开或创建历史数据库
+
+        Args:
+            db_file: 数据库文件路径
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        # 界面线程和事件循环线程都会访问数据库，由锁保证串行
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # 中文索引的触发器调用这两个函数，每个连接都需要注册
+        self._conn.create_function("cjk_unigrams", 1, cjk_unigrams, deterministic=True)
+        self._conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self.fts_enabled = self._init_fts()
+            self._conn.commit()
+
+    def _init_fts(self) -> bool:
+        """创建全文索引，已有消息会被一次性补建索引；SQLite不支持FTS5时退回LIKE查询"""
+        indexes = (
+            ("messages_fts", FTS_SCHEMA, "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"),
+            ("messages_cjk", CJK_SCHEMA, CJK_BACKFILL),
+        )
+        try:
+            for name, schema, backfill in indexes:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+                ).fetchone()
+                if not exists:
+                    self._conn.executescript(schema)
+                    self._conn.execute(backfill)
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"全文索引不可用，将使用普通查询：{e}", file=sys.stderr)
+            return False
+
+    def close(self) -> None:
+        """关闭数据库"""
+        with self._lock:
+            self._conn.close()
+
+    def save_conversation(self, conversation_id: str, title: str, model: Optional[str],
+                          created_at: float) -> None:
+        """保存对话信息，已存在时更新标题和模型"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO conversations (id, title, model, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET title = excluded.title, model = excluded.model
+                """,
+                (conversation_id, title, model, created_at, created_at)
+            )
+            self._conn.commit()
+
+    def append_messages(self, conversation_id: str, messages: List[Dict[str, str]]) -> List[int]:
+        """
+        追加消息到对话末尾
+
+        Returns:
+            List[int]: 新消息的ID
+        """
+        now = time.time()
+        ids = []
+        with self._lock:
+            for message in messages:
+                cursor = self._conn.execute(
+                    "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    (conversation_id, message["role"], message["content"], now)
+                )
+                ids.append(cursor.lastrowid)
+            self._conn.execute(
+                "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                (now, conversation_id)
+            )
+            self._conn.commit()
+        return ids
+
+    def list_conversations(self, limit: int = 50, before: Optional[float] = None) -> List[Dict]:
+        """
+        按最近更新时间倒序列出对话
+
+        Args:
+            limit: 最多返回的数量
+            before: 只返回更新时间早于该时间的对话，用于分页
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, title, model, created_at, updated_at FROM conversations
+                WHERE updated_at < ? ORDER BY updated_at DESC LIMIT ?
+                """,
+                (before if before is not None else float("inf"), limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_messages(self, conversation_id: str, before_id: Optional[int] = None,
+                      limit: int = 100) -> List[Dict]:
+        """
+        读取对话中的一页消息（按时间正序）
+
+        Args:
+            conversation_id: 对话ID
+            before_id: 只读取ID小于该值的消息，用于向前翻页
+            limit: 每页消息数量
+
+        Returns:
+            List[Dict]: 包含 id、role、content、created_at 的消息列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, role, content, created_at FROM messages
+                WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+                """,
+                (conversation_id, before_id if before_id is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def messages_after(self, after_id: int, limit: int = 100) -> List[Dict]:
+        """
+        按ID顺序读取所有对话中ID大于 after_id 的消息，用于增量建立索引
+
+        Returns:
+            List[Dict]: 包含 id、conversation_id、role、content 的消息列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, conversation_id, role, content FROM messages
+                WHERE id > ? ORDER BY id LIMIT ?
+                """,
+                (after_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_conversation(self, conversation_id: str) -> None:
+        """删除对话及其所有消息"""
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._conn.commit()
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """获取对话信息"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, title, model, created_at, updated_at FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def count_messages(self, conversation_id: str, from_id: int, to_id: int) -> int:
+        """统计对话中ID在 [from_id, to_id) 区间内的消息数量"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND id >= ? AND id < ?",
+                (conversation_id, from_id, to_id)
+            ).fetchone()
+        return row[0]
+
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """
+        全文检索历史消息，按相关度（bm25）排序
+
+        每个词都不短于3个字符时使用trigram索引，可以匹配词的任意部分；
+        否则使用中文索引，中文按单字和相邻两字匹配，其他文字按整词匹配。
+
+        Args:
+            query: 检索词，多个词以空格分隔，需同时包含
+            limit: 最多返回的数量
+
+        Returns:
+            List[Dict]: 包含 id、conversation_id、title、role、snippet、created_at 的结果列表
+        """
+        terms = query.split()
+        if not terms:
+            return []
+
+        if self.fts_enabled:
+            if all(len(term) >= FTS_MIN_TERM_LENGTH for term in terms):
+                return self._search_fts(terms, limit)
+            match = self._cjk_match(terms)
+            if match:
+                return self._search_cjk(match, terms, limit)
+        return self._search_like(terms, limit)
+
+    def _search_fts(self, terms: List[str], limit: int) -> List[Dict]:
+        """使用trigram索引检索"""
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        with self._lock:
+            # 对全部匹配结果按相关度排序后再取前 limit 条
+            rows = self._conn.execute(
+                """
+                SELECT m.id, m.conversation_id, c.title, m.role, m.created_at
+                FROM (
+                    SELECT rowid, rank FROM messages_fts
+                    WHERE messages_fts MATCH ?
+                    ORDER BY rank, rowid DESC LIMIT ?
+                ) AS hits
+                JOIN messages m ON m.id = hits.rowid
+                JOIN conversations c ON c.id = m.conversation_id
+                ORDER BY hits.rank, hits.rowid DESC
+                """,
+                (match, limit)
+            ).fetchall()
+            results = [dict(row) for row in rows]
+            if not results:
+                return []
+
+            # 只为最终结果生成摘要
+            placeholders = ", ".join("?" for _ in results)
+            snippets = dict(self._conn.execute(
+                f"""
+                SELECT rowid, snippet(messages_fts, 0, '【', '】', '…', 24) FROM messages_fts
+                WHERE messages_fts MATCH ? AND rowid IN ({placeholders})
+                """,
+                (match, *(result["id"] for result in results))
+            ).fetchall())
+        for result in results:
+            result["snippet"] = snippets.get(result["id"], "")
+        return results
+
+    @staticmethod
+    def _cjk_match(terms: List[str]) -> Optional[str]:
+        """
+        生成中文索引的查询：单个汉字匹配单字列，其他词按与索引相同的切分结果作为短语匹配
+
+        Returns:
+            Optional[str]: FTS5查询表达式，有词切分后为空（如只有标点）时返回None
+        """
+        phrases = []
+        for term in terms:
+            if len(term) == 1 and CJK_RUN.fullmatch(term):
+                column, tokens = "unigrams", term
+            else:
+                column, tokens = "bigrams", " ".join(cjk_bigrams(term).split())
+            if not tokens:
+                return None
+            phrases.append(f'{column} : "' + tokens.replace('"', '""') + '"')
+        return " AND ".join(phrases)
+
+    def _search_cjk(self, match: str, terms: List[str], limit: int) -> List[Dict]:
+        """使用中文索引检索，索引不保存原文，摘要由消息内容生成"""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT m.id, m.conversation_id, c.title, m.role, m.created_at, m.content
+                FROM (
+                    SELECT rowid, rank FROM messages_cjk
+                    WHERE messages_cjk MATCH ?
+                    ORDER BY rank, rowid DESC LIMIT ?
+                ) AS hits
+                JOIN messages m ON m.id = hits.rowid
+                JOIN conversations c ON c.id = m.conversation_id
+                ORDER BY hits.rank, hits.rowid DESC
+                """,
+                (match, limit)
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["snippet"] = make_snippet(result.pop("content"), terms)
+            results.append(result)
+        return results
+
+    def _search_like(self, terms: List[str], limit: int) -> List[Dict]:
+        """逐条匹配检索：短词无法使用trigram索引，按时间倒序返回"""
+        conditions = " AND ".join("m.content LIKE ? ESCAPE '\\'" for _ in terms)
+        params = tuple(
+            "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            for term in terms
+        )
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT m.id, m.conversation_id, c.title, m.role, m.created_at,
+                       substr(m.content, 1, 80) AS snippet
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE {conditions}
+                ORDER BY m.id DESC LIMIT ?
+                """,
+                params + (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
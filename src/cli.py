@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import queue
+import sys
+import threading
+from typing import Any, AsyncIterator, List, Dict, Iterator, Iterable, Optional, TextIO, Union
+from config_manager import IniConfigManager
+from chat_pool import create_chat_api
+from connection_manager import ConnectionManager
+from chat_controller import ChatController
+from batch import BatchItems, BatchStats, InvalidItem
+from response_cache import ResponseCache
+from metrics import get_metrics
+from constant import CONFIG_FILE, VECTOR_INDEX_DIR, RESPONSE_CACHE_FILE, DEFAULT_SERVER, DEFAULT_TIMEOUT
+
+
+class ReadOnlyConfigManager(IniConfigManager):
+    """命令行模式使用的配置：读取配置文件，但命令行参数的修改不写回文件"""
+
+    def save_config(self) -> None:
+        pass
+
+
+def read_prompts(input_file: TextIO) -> Iterator[Union[Dict, InvalidItem]]:
+    """
+    逐行读取JSONL格式的提示词，批量任务按需读取，不会一次读入整个文件
+
+    每行为一个JSON对象，包含 prompt 或 messages 字段，可选 id 和 model 字段；也可以直接是一个JSON字符串。
+    没有 id 时使用行号。字段由 normalize_item 检查。
+    不是有效JSON的行以 InvalidItem 返回，批量任务把它记录为失败的结果后继续处理后面的行。
+    """
+    for line_number, line in enumerate(input_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield InvalidItem(f"第{line_number}行不是有效的JSON：{e}", line_number)
+            continue
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if isinstance(item, dict):
+            item.setdefault("id", line_number)
+        yield item
+
+
+async def read_in_thread(items: Iterable) -> AsyncIterator[Any]:
+    """
+    在后台线程中逐项读取，标准输入等读取较慢的输入不会阻塞事件循环
+
+    每次只读取一项，仍然按需读取。使用守护线程，退出时不等待阻塞在读取上的线程。
+    """
+    loop = asyncio.get_running_loop()
+    requests: "queue.Queue[Optional[asyncio.Future]]" = queue.Queue()
+    end = object()
+
+    def resolve(future: asyncio.Future, item, error: Optional[BaseException]):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(item)
+
+    def reader():
+        iterator = iter(items)
+        while True:
+            future = requests.get()
+            if future is None:
+                return
+            item, error = end, None
+            try:
+                item = next(iterator, end)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(resolve, future, item, error)
+            except RuntimeError:
+                return  # 事件循环已关闭
+
+    threading.Thread(target=reader, daemon=True).start()
+    try:
+        while True:
+            future = loop.create_future()
+            requests.put(future)
+            item = await future
+            if item is end:
+                return
+            yield item
+    finally:
+        requests.put(None)
+
+
+class ChatCLI:
+    """无界面模式，复用 ChatController 和 API 客户端"""
+
+    def __init__(self, config_manager: IniConfigManager):
+        self.config_manager = config_manager
+        self.connection_manager: Optional[ConnectionManager] = None
+        self.response_cache: Optional[ResponseCache] = None
+        self.controller = ChatController(
+            config_manager,
+            create_chat_api(DEFAULT_SERVER, DEFAULT_TIMEOUT),
+            api_factory=self.create_chat_api
+        )
+
+    def create_chat_api(self, server_url: str, timeout: float):
+        """创建API客户端，多个地址时创建多服务器连接池"""
+        return create_chat_api(
+            server_url,
+            timeout,
+            self.config_manager.get_health_interval(),
+            self.connection_manager,
+            self.config_manager.get_retry_settings(),
+            self.response_cache,
+            self.config_manager.get_max_concurrency()
+        )
+
+    async def connect(self, server_url: str, model: Optional[str]) -> str:
+        """
+        连接服务器并确定默认模型
+
+        Returns:
+            str: 默认使用的模型
+        """
+        self.connection_manager = ConnectionManager(
+            read_timeout=self.config_manager.get_timeout(),
+            **self.config_manager.get_network_settings()
+        )
+        models = await self.controller.connect(server_url)
+        names = [item["name"] for item in models]
+        if model is None:
+            if not names:
+                raise RuntimeError("没有可用的模型")
+            model = names[0]
+        elif model not in names:
+            raise RuntimeError(f"服务器上没有模型 {model}")
+        self.controller.set_current_model(model)
+        return model
+
+    async def close(self):
+        """断开连接并释放连接池"""
+        await self.controller.disconnect()
+        if self.connection_manager:
+            await self.connection_manager.close()
+        if self.response_cache:
+            self.response_cache.close()
+
+    async def ask(self, prompt: str, model: str, output: TextIO) -> None:
+        """发送单条消息，将回复流式输出"""
+        conversation = self.controller.conversations.create(model)
+        written = 0
+
+        def on_chunk(content: str):
+            nonlocal written
+            output.write(content[written:])
+            output.flush()
+            written = len(content)
+
+        await self.controller.send_message(prompt, on_chunk, conversation.id)
+        output.write("\n")
+        output.flush()
+
+    async def run_batch(self, prompts: BatchItems, model: str, output: TextIO, ordered: bool = False,
+                        checkpoint_file: Optional[str] = None) -> BatchStats:
+        """
+        并发处理一批提示词，写出JSONL结果
+
+        Args:
+            prompts: 提示词，可迭代对象或异步迭代器，逐项读取
+            model: 未指定模型的提示词使用的模型
+            output: 结果输出
+            ordered: 为True时按输入顺序写出，否则按完成顺序写出
+            checkpoint_file: 进度文件，中断后重新运行时跳过已完成的提示词
+
+        Returns:
+            BatchStats: 吞吐量统计
+        """
+        stats = BatchStats()
+        async for result in self.controller.run_batch(prompts, model, ordered, checkpoint_file, stats):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+        return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ollama AI 命令行模式")
+    parser.add_argument("prompt", nargs="?", help="要发送的消息，回复将流式输出到标准输出")
+    parser.add_argument("-s", "--server", help="服务器地址，多个地址以逗号分隔，默认使用配置文件中的地址")
+    parser.add_argument("-m", "--model", help="使用的模型，默认使用服务器上的第一个模型")
+    parser.add_argument("-i", "--input", help="JSONL格式的提示词文件，- 表示标准输入")
+    parser.add_argument("-o", "--output", help="批量模式的JSONL结果文件，默认输出到标准输出")
+    parser.add_argument("-p", "--parallel", type=int, help="每个服务器的并发请求数，默认使用配置文件中的设置")
+    parser.add_argument("--ordered", action="store_true", help="批量模式按输入顺序写出结果，默认按完成顺序")
+    parser.add_argument("--checkpoint", help="批量模式的进度文件，中断后使用同一文件重新运行时跳过已完成的提示词")
+    parser.add_argument("-c", "--config", default=CONFIG_FILE, help="配置文件路径")
+    parser.add_argument("-d", "--document", action="append", default=[],
+                        help="参考文档，提问时自动引用其中相关的内容，可以多次指定；使用配置文件中的向量模型")
+    parser.add_argument("--cache", action="store_true",
+                        help="缓存确定性请求（temperature为0或指定seed）的回复，相同的提示词直接返回之前的结果")
+    parser.add_argument("--metrics", help="结束后导出性能指标，.prom 文件为Prometheus文本格式，其他为JSON Lines")
+    args = parser.parse_args(argv)
+    if not args.prompt and not args.input:
+        parser.error("需要提供消息或 --input 文件")
+    if args.parallel is not None and args.parallel < 1:
+        parser.error("--parallel 必须大于0")
+    return args
+
+
+async def run(args: argparse.Namespace) -> int:
+    """执行命令，返回退出码"""
+    config_manager = ReadOnlyConfigManager(args.config, DEFAULT_SERVER, DEFAULT_TIMEOUT)
+    cli = ChatCLI(config_manager)
+    cli.controller.initialize()
+    if args.parallel:
+        config_manager.set_max_concurrency(args.parallel)
+    cache_settings = config_manager.get_cache_settings()
+    if cache_settings.pop("enabled") or args.cache:
+        cli.response_cache = ResponseCache(RESPONSE_CACHE_FILE, **cache_settings)
+    retrieval_settings = config_manager.get_retrieval_settings()
+    if retrieval_settings["enabled"] or args.document:
+        from retrieval import create_retriever
+        cli.controller.retriever = create_retriever(retrieval_settings, VECTOR_INDEX_DIR)
+
+    input_file = None
+    if args.input:
+        input_file = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+
+    try:
+        model = await cli.connect(args.server or config_manager.get_server_url(), args.model)
+        for path in args.document:
+            await cli.controller.attach_document(path)
+        if args.prompt:
+            await cli.ask(args.prompt, model, sys.stdout)
+        if input_file is None:
+            return 0
+        prompts = read_in_thread(read_prompts(input_file))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output:
+                stats = await cli.run_batch(prompts, model, output, args.ordered, args.checkpoint)
+        else:
+            stats = await cli.run_batch(prompts, model, sys.stdout, args.ordered, args.checkpoint)
+        print(stats.summary(), file=sys.stderr)
+        return 1 if stats.failed else 0
+    finally:
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+        await cli.close()
+        if args.metrics:
+            get_metrics().export(args.metrics)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(f"错误：{e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
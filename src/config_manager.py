@@ -1,8 +1,21 @@
 from abc import ABC, abstractmethod
 import configparser
+import io
 import json
 import os
-from typing import List
+import threading
+import time
+from typing import List, Dict, Optional
+from constant import (
+    DEFAULT_CONTEXT_TOKENS, DEFAULT_KEEP_ALIVE, DEFAULT_HEALTH_INTERVAL,
+    DEFAULT_CONNECTION_LIMIT, DEFAULT_CONNECTION_LIMIT_PER_HOST, DEFAULT_KEEPALIVE_TIMEOUT,
+    DEFAULT_DNS_TTL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_RETRY_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY,
+    DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_RESET, DEFAULT_HEDGE_DELAY,
+    DEFAULT_METRICS_EXPORT_INTERVAL, CONFIG_SAVE_DELAY, CONFIG_SAVE_RETRY_DELAY,
+    DEFAULT_EMBED_MODEL, DEFAULT_RETRIEVAL_TOP_K, DEFAULT_RETRIEVAL_MIN_SCORE, DEFAULT_APPROXIMATE_THRESHOLD,
+    DEFAULT_CACHE_MEMORY_ENTRIES, DEFAULT_CACHE_MAX_BYTES, DEFAULT_CACHE_TTL
+)
 
 class ConfigManager(ABC):
     """配置管理器接口"""
@@ -14,7 +27,12 @@ class ConfigManager(ABC):
     
     @abstractmethod
     def save_config(self) -> None:
-        """保存配置"""
+        """立即保存配置"""
+        pass
+    
+    @abstractmethod
+    def flush(self) -> None:
+        """写入尚未保存的修改（退出前调用）"""
         pass
     
     @abstractmethod
@@ -37,6 +55,16 @@ class ConfigManager(ABC):
         """设置超时时间"""
         pass
     
+    @abstractmethod
+    def get_max_concurrency(self) -> int:
+        """获取每个服务器的最大并发请求数"""
+        pass
+    
+    @abstractmethod
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        """设置每个服务器的最大并发请求数"""
+        pass
+    
     @abstractmethod
     def get_favorite_servers(self) -> List[str]:
         """获取收藏的服务器列表"""
@@ -61,19 +89,102 @@ class ConfigManager(ABC):
     def set_close_action(self, action: str) -> None:
         """设置关闭行为"""
         pass
+    
+    @abstractmethod
+    def get_context_tokens(self) -> int:
+        """获取默认上下文token预算（0表示不限制）"""
+        pass
+    
+    @abstractmethod
+    def get_model_context_tokens(self) -> Dict[str, int]:
+        """获取按模型指定的上下文token预算"""
+        pass
+    
+    @abstractmethod
+    def get_context_summarize(self) -> bool:
+        """获取是否摘要被裁剪的旧消息"""
+        pass
+    
+    @abstractmethod
+    def get_keep_alive(self) -> str:
+        """获取模型在服务器内存中的保留时间"""
+        pass
+    
+    @abstractmethod
+    def get_model_options(self, model: str) -> Dict:
+        """获取模型的生成参数（默认参数与模型专属参数合并后的结果）"""
+        pass
+    
+    @abstractmethod
+    def get_health_interval(self) -> float:
+        """获取多服务器连接池的健康检查间隔"""
+        pass
+    
+    @abstractmethod
+    def get_network_settings(self) -> Dict:
+        """获取网络连接设置（连接数上限、保活时间、DNS缓存时间、连接超时）"""
+        pass
+    
+    @abstractmethod
+    def get_retry_settings(self) -> Dict:
+        """获取重试、熔断和对冲请求设置"""
+        pass
+    
+    @abstractmethod
+    def get_metrics_settings(self) -> Dict:
+        """获取性能指标导出设置（导出文件和导出间隔）"""
+        pass
+    
+    @abstractmethod
+    def get_retrieval_settings(self) -> Dict:
+        """获取语义检索设置（是否启用、向量模型、片段数量、最低相似度、近似检索阈值）"""
+        pass
+    
+    @abstractmethod
+    def get_cache_settings(self) -> Dict:
+        """获取回复缓存设置（是否启用、内存条目数、磁盘大小上限、有效期）"""
+        pass
 
 class IniConfigManager(ConfigManager):
-    """INI文件配置管理器实现"""
+    """
+    INI文件配置管理器实现
     
-    def __init__(self, config_file: str, default_server: str, default_timeout: float):
+    设置项的修改先记录在内存中，在最后一次修改后 save_delay 秒由后台线程合并写入，
+    调用方（界面线程和事件循环线程）不做文件I/O。写入时先在锁内生成配置内容，
+    再在锁外写临时文件并替换，磁盘慢时也不会阻塞修改设置的线程；
+    写入锁保证同一时间只有一个写入者，不会产生写了一半的配置文件。写入失败时稍后重试。
+    """
+    
+    def __init__(self, config_file: str, default_server: str, default_timeout: float,
+                 save_delay: float = CONFIG_SAVE_DELAY):
         self.config_file = config_file
+        self.save_delay = save_delay
         self.default_server = default_server
         self.default_timeout = default_timeout
         self.config = configparser.ConfigParser()
         self.server_url = default_server
         self.timeout = default_timeout
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
         self.favorite_servers: List[str] = []
         self.close_action = "ask"  # 默认询问
+        self.context_tokens = DEFAULT_CONTEXT_TOKENS
+        self.model_context_tokens: Dict[str, int] = {}
+        self.context_summarize = False
+        self.keep_alive = DEFAULT_KEEP_ALIVE
+        self.default_options: Dict = {}
+        self.model_options: Dict[str, Dict] = {}
+        self.health_interval = DEFAULT_HEALTH_INTERVAL
+        self.network_settings = self._default_network_settings()
+        self.retry_settings = self._default_retry_settings()
+        self.metrics_settings = self._default_metrics_settings()
+        self.retrieval_settings = self._default_retrieval_settings()
+        self.cache_settings = self._default_cache_settings()
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._changes = 0  # 修改计数，写入期间又有修改时保留修改标记
+        self._last_change = 0.0
+        self._save_timer: Optional[threading.Timer] = None
     
     def load_config(self) -> None:
         try:
@@ -85,6 +196,7 @@ class IniConfigManager(ConfigManager):
                 
                 if self.config.has_section("Chat"):
                     self.timeout = self.config.getfloat("Chat", "timeout", fallback=self.default_timeout)
+                    self.max_concurrency = self.config.getint("Chat", "max_concurrency", fallback=DEFAULT_MAX_CONCURRENCY)
                 
                 if self.config.has_section("Favorites"):
                     favorites_str = self.config.get("Favorites", "servers", fallback="[]")
@@ -92,70 +204,313 @@ class IniConfigManager(ConfigManager):
                 
                 if self.config.has_section("Window"):
                     self.close_action = self.config.get("Window", "close_action", fallback="ask")
+                
+                if self.config.has_section("Context"):
+                    self.context_tokens = self.config.getint("Context", "max_tokens", fallback=DEFAULT_CONTEXT_TOKENS)
+                    model_tokens_str = self.config.get("Context", "model_tokens", fallback="{}")
+                    self.model_context_tokens = json.loads(model_tokens_str)
+                    self.context_summarize = self.config.getboolean("Context", "summarize", fallback=False)
+                
+                if self.config.has_section("Model"):
+                    self.keep_alive = self.config.get("Model", "keep_alive", fallback=DEFAULT_KEEP_ALIVE)
+                    self.default_options = json.loads(self.config.get("Model", "options", fallback="{}"))
+                    self.model_options = json.loads(self.config.get("Model", "model_options", fallback="{}"))
+                
+                if self.config.has_section("Pool"):
+                    self.health_interval = self.config.getfloat("Pool", "health_interval", fallback=DEFAULT_HEALTH_INTERVAL)
+                
+                if self.config.has_section("Network"):
+                    self.network_settings = {
+                        "limit": self.config.getint("Network", "limit", fallback=DEFAULT_CONNECTION_LIMIT),
+                        "limit_per_host": self.config.getint("Network", "limit_per_host", fallback=DEFAULT_CONNECTION_LIMIT_PER_HOST),
+                        "keepalive_timeout": self.config.getfloat("Network", "keepalive_timeout", fallback=DEFAULT_KEEPALIVE_TIMEOUT),
+                        "dns_ttl": self.config.getint("Network", "dns_ttl", fallback=DEFAULT_DNS_TTL),
+                        "connect_timeout": self.config.getfloat("Network", "connect_timeout", fallback=DEFAULT_CONNECT_TIMEOUT),
+                    }
+                
+                if self.config.has_section("Retry"):
+                    self.retry_settings = {
+                        "enabled": self.config.getboolean("Retry", "enabled", fallback=True),
+                        "max_attempts": self.config.getint("Retry", "max_attempts", fallback=DEFAULT_RETRY_ATTEMPTS),
+                        "base_delay": self.config.getfloat("Retry", "base_delay", fallback=DEFAULT_RETRY_BASE_DELAY),
+                        "max_delay": self.config.getfloat("Retry", "max_delay", fallback=DEFAULT_RETRY_MAX_DELAY),
+                        "breaker_threshold": self.config.getint("Retry", "breaker_threshold", fallback=DEFAULT_BREAKER_THRESHOLD),
+                        "breaker_reset": self.config.getfloat("Retry", "breaker_reset", fallback=DEFAULT_BREAKER_RESET),
+                        "hedge_delay": self.config.getfloat("Retry", "hedge_delay", fallback=DEFAULT_HEDGE_DELAY),
+                    }
+                
+                if self.config.has_section("Metrics"):
+                    self.metrics_settings = {
+                        "export_file": self.config.get("Metrics", "export_file", fallback=""),
+                        "export_interval": self.config.getfloat("Metrics", "export_interval", fallback=DEFAULT_METRICS_EXPORT_INTERVAL),
+                    }
+                
+                if self.config.has_section("Retrieval"):
+                    self.retrieval_settings = {
+                        "enabled": self.config.getboolean("Retrieval", "enabled", fallback=False),
+                        "model": self.config.get("Retrieval", "model", fallback=DEFAULT_EMBED_MODEL),
+                        "top_k": self.config.getint("Retrieval", "top_k", fallback=DEFAULT_RETRIEVAL_TOP_K),
+                        "min_score": self.config.getfloat("Retrieval", "min_score", fallback=DEFAULT_RETRIEVAL_MIN_SCORE),
+                        "approximate_threshold": self.config.getint("Retrieval", "approximate_threshold", fallback=DEFAULT_APPROXIMATE_THRESHOLD),
+                    }
+                
+                if self.config.has_section("Cache"):
+                    self.cache_settings = {
+                        "enabled": self.config.getboolean("Cache", "enabled", fallback=False),
+                        "memory_entries": self.config.getint("Cache", "memory_entries", fallback=DEFAULT_CACHE_MEMORY_ENTRIES),
+                        "max_bytes": self.config.getint("Cache", "max_bytes", fallback=DEFAULT_CACHE_MAX_BYTES),
+                        "ttl": self.config.getfloat("Cache", "ttl", fallback=DEFAULT_CACHE_TTL),
+                    }
             else:
                 self._create_default_config()
         except Exception as e:
             print(f"加载配置文件失败: {e}")
             self._create_default_config()
     
+    def _schedule_save(self) -> None:
+        """标记配置已修改，在最后一次修改 save_delay 秒后写入"""
+        with self._lock:
+            self._dirty = True
+            self._changes += 1
+            self._last_change = time.monotonic()
+            if self._save_timer is None:
+                self._start_save_timer(self.save_delay)
+    
+    def _start_save_timer(self, delay: float) -> None:
+        self._save_timer = threading.Timer(delay, self._on_save_timer)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+    
+    def _on_save_timer(self) -> None:
+        """计时结束时如果期间又有修改，则顺延到最后一次修改之后，避免每次修改都重建计时器"""
+        with self._lock:
+            self._save_timer = None
+            remaining = self._last_change + self.save_delay - time.monotonic()
+            if remaining > 0:
+                self._start_save_timer(remaining)
+                return
+            if not self._dirty:
+                return
+        self.save_config()
+    
+    def flush(self) -> None:
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+            dirty = self._dirty
+        if dirty:
+            self.save_config()
+    
     def save_config(self) -> None:
-        try:
-            self._ensure_sections()
-            
-            self.config["Server"]["url"] = self.server_url
-            self.config["Chat"]["timeout"] = str(self.timeout)
-            self.config["Favorites"]["servers"] = json.dumps(self.favorite_servers)
-            self.config["Window"]["close_action"] = self.close_action
-            
-            with open(self.config_file, "w", encoding="utf-8") as f:
-                self.config.write(f)
-        except Exception as e:
-            print(f"保存配置文件失败: {e}")
+        with self._write_lock:
+            with self._lock:
+                changes = self._changes
+                text = self._render_config()
+            try:
+                self._write_file(text)
+            except Exception as e:
+                print(f"保存配置文件失败: {e}")
+                with self._lock:
+                    self._dirty = True
+                    if self._save_timer is None:
+                        self._start_save_timer(CONFIG_SAVE_RETRY_DELAY)
+                return
+            with self._lock:
+                if self._changes == changes:
+                    self._dirty = False
+    
+    def _render_config(self) -> str:
+        """把当前设置写入 self.config 并生成文件内容，需要在锁内调用"""
+        self._ensure_sections()
+        
+        self.config["Server"]["url"] = self.server_url
+        self.config["Chat"]["timeout"] = str(self.timeout)
+        self.config["Chat"]["max_concurrency"] = str(self.max_concurrency)
+        self.config["Favorites"]["servers"] = json.dumps(self.favorite_servers)
+        self.config["Window"]["close_action"] = self.close_action
+        self.config["Context"]["max_tokens"] = str(self.context_tokens)
+        self.config["Context"]["model_tokens"] = json.dumps(self.model_context_tokens)
+        self.config["Context"]["summarize"] = str(self.context_summarize).lower()
+        self.config["Model"]["keep_alive"] = self.keep_alive
+        self.config["Model"]["options"] = json.dumps(self.default_options)
+        self.config["Model"]["model_options"] = json.dumps(self.model_options)
+        self.config["Pool"]["health_interval"] = str(self.health_interval)
+        for key, value in self.network_settings.items():
+            self.config["Network"][key] = str(value)
+        for key, value in self.retry_settings.items():
+            self.config["Retry"][key] = str(value).lower() if isinstance(value, bool) else str(value)
+        for key, value in self.metrics_settings.items():
+            self.config["Metrics"][key] = str(value)
+        for key, value in self.retrieval_settings.items():
+            self.config["Retrieval"][key] = str(value).lower() if isinstance(value, bool) else str(value)
+        for key, value in self.cache_settings.items():
+            self.config["Cache"][key] = str(value).lower() if isinstance(value, bool) else str(value)
+        
+        buffer = io.StringIO()
+        self.config.write(buffer)
+        return buffer.getvalue()
+    
+    def _write_file(self, text: str) -> None:
+        """先写临时文件再替换，写入中断时原配置文件保持完整"""
+        temp_file = self.config_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.config_file)
     
     def get_server_url(self) -> str:
         return self.server_url
     
     def set_server_url(self, url: str) -> None:
+        if url == self.server_url:
+            return
         self.server_url = url
-        self.save_config()
+        self._schedule_save()
     
     def get_timeout(self) -> float:
         return self.timeout
     
     def set_timeout(self, timeout: float) -> None:
         self.timeout = timeout
-        self.save_config()
+        self._schedule_save()
+    
+    def get_max_concurrency(self) -> int:
+        return self.max_concurrency
+    
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self._schedule_save()
     
     def get_favorite_servers(self) -> List[str]:
         return self.favorite_servers.copy()
     
     def add_favorite_server(self, url: str) -> None:
-        if url not in self.favorite_servers:
-            self.favorite_servers.append(url)
-            self.save_config()
+        with self._lock:
+            if url not in self.favorite_servers:
+                self.favorite_servers.append(url)
+                self._schedule_save()
     
     def remove_favorite_server(self, url: str) -> None:
-        if url in self.favorite_servers:
-            self.favorite_servers.remove(url)
-            self.save_config()
+        with self._lock:
+            if url in self.favorite_servers:
+                self.favorite_servers.remove(url)
+                self._schedule_save()
     
     def get_close_action(self) -> str:
         return self.close_action
     
     def set_close_action(self, action: str) -> None:
         self.close_action = action
-        self.save_config()
+        self._schedule_save()
+    
+    def get_context_tokens(self) -> int:
+        return self.context_tokens
+    
+    def get_model_context_tokens(self) -> Dict[str, int]:
+        return self.model_context_tokens.copy()
+    
+    def get_context_summarize(self) -> bool:
+        return self.context_summarize
+    
+    def get_keep_alive(self) -> str:
+        return self.keep_alive
+    
+    def get_model_options(self, model: str) -> Dict:
+        options = dict(self.default_options)
+        options.update(self.model_options.get(model, {}))
+        return options
+    
+    def get_health_interval(self) -> float:
+        return self.health_interval
+    
+    def get_network_settings(self) -> Dict:
+        return self.network_settings.copy()
+    
+    def _default_network_settings(self) -> Dict:
+        """默认网络连接设置"""
+        return {
+            "limit": DEFAULT_CONNECTION_LIMIT,
+            "limit_per_host": DEFAULT_CONNECTION_LIMIT_PER_HOST,
+            "keepalive_timeout": DEFAULT_KEEPALIVE_TIMEOUT,
+            "dns_ttl": DEFAULT_DNS_TTL,
+            "connect_timeout": DEFAULT_CONNECT_TIMEOUT,
+        }
+    
+    def get_retry_settings(self) -> Dict:
+        return self.retry_settings.copy()
+    
+    def _default_retry_settings(self) -> Dict:
+        """默认重试设置"""
+        return {
+            "enabled": True,
+            "max_attempts": DEFAULT_RETRY_ATTEMPTS,
+            "base_delay": DEFAULT_RETRY_BASE_DELAY,
+            "max_delay": DEFAULT_RETRY_MAX_DELAY,
+            "breaker_threshold": DEFAULT_BREAKER_THRESHOLD,
+            "breaker_reset": DEFAULT_BREAKER_RESET,
+            "hedge_delay": DEFAULT_HEDGE_DELAY,
+        }
+    
+    def get_metrics_settings(self) -> Dict:
+        return self.metrics_settings.copy()
+    
+    def _default_metrics_settings(self) -> Dict:
+        """默认不导出性能指标"""
+        return {
+            "export_file": "",
+            "export_interval": DEFAULT_METRICS_EXPORT_INTERVAL,
+        }
+    
+    def get_retrieval_settings(self) -> Dict:
+        return self.retrieval_settings.copy()
+    
+    def _default_retrieval_settings(self) -> Dict:
+        """默认不启用语义检索"""
+        return {
+            "enabled": False,
+            "model": DEFAULT_EMBED_MODEL,
+            "top_k": DEFAULT_RETRIEVAL_TOP_K,
+            "min_score": DEFAULT_RETRIEVAL_MIN_SCORE,
+            "approximate_threshold": DEFAULT_APPROXIMATE_THRESHOLD,
+        }
+    
+    def get_cache_settings(self) -> Dict:
+        return self.cache_settings.copy()
+    
+    def _default_cache_settings(self) -> Dict:
+        """默认不缓存回复"""
+        return {
+            "enabled": False,
+            "memory_entries": DEFAULT_CACHE_MEMORY_ENTRIES,
+            "max_bytes": DEFAULT_CACHE_MAX_BYTES,
+            "ttl": DEFAULT_CACHE_TTL,
+        }
     
     def _create_default_config(self) -> None:
         """创建默认配置"""
         self.server_url = self.default_server
         self.timeout = self.default_timeout
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
         self.favorite_servers = []
         self.close_action = "ask"
+        self.context_tokens = DEFAULT_CONTEXT_TOKENS
+        self.model_context_tokens = {}
+        self.context_summarize = False
+        self.keep_alive = DEFAULT_KEEP_ALIVE
+        self.default_options = {}
+        self.model_options = {}
+        self.health_interval = DEFAULT_HEALTH_INTERVAL
+        self.network_settings = self._default_network_settings()
+        self.retry_settings = self._default_retry_settings()
+        self.metrics_settings = self._default_metrics_settings()
+        self.retrieval_settings = self._default_retrieval_settings()
+        self.cache_settings = self._default_cache_settings()
         self.save_config()
     
     def _ensure_sections(self) -> None:
         """确保所有必要的配置节点存在"""
-        for section in ["Server", "Chat", "Favorites", "Window"]:
+        for section in ["Server", "Chat", "Favorites", "Window", "Context", "Model", "Pool", "Network", "Retry", "Metrics", "Retrieval", "Cache"]:
             if not self.config.has_section(section):
                 self.config.add_section(section) 
\ No newline at end of file
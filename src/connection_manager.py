@@ -0,0 +1,128 @@
+from typing import Dict, Optional
+import aiohttp
+import time
+from metrics import MetricsRegistry, get_metrics
+from constant import (
+    DEFAULT_CONNECTION_LIMIT, DEFAULT_CONNECTION_LIMIT_PER_HOST, DEFAULT_KEEPALIVE_TIMEOUT,
+    DEFAULT_DNS_TTL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_TIMEOUT
+)
+
+
+class ConnectionManager:
+    """管理共享的aiohttp会话与连接池"""
+
+    def __init__(self,
+                 limit: int = DEFAULT_CONNECTION_LIMIT,
+                 limit_per_host: int = DEFAULT_CONNECTION_LIMIT_PER_HOST,
+                 keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+                 dns_ttl: int = DEFAULT_DNS_TTL,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_TIMEOUT,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        初始化连接管理器
+
+        Args:
+            limit: 连接池总连接数上限
+            limit_per_host: 每个服务器的连接数上限
+            keepalive_timeout: 空闲连接保持时间（秒）
+            dns_ttl: DNS缓存时间（秒）
+            connect_timeout: 建立连接的超时时间（秒）
+            read_timeout: 两次读取数据之间的超时时间（秒），流式回复不受总时长限制
+            metrics: 记录DNS解析、建立连接和首字节耗时的指标注册表，默认使用共享注册表
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._counters = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connections_queued": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    def make_timeout(self, read_timeout: Optional[float] = None) -> aiohttp.ClientTimeout:
+        """创建超时设置：不限制总时长，分别限制连接和读取时间"""
+        return aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.connect_timeout,
+            sock_read=read_timeout if read_timeout is not None else self.read_timeout
+        )
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取共享会话，首次调用时创建"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_ttl,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.make_timeout(),
+                trace_configs=[self._create_trace_config()]
+            )
+        return self.session
+
+    async def close(self) -> None:
+        """关闭会话并释放所有连接"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        """创建用于统计连接复用情况和各阶段耗时的跟踪配置"""
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def on_event(session, context, params):
+                self._counters[name] += 1
+            return on_event
+
+        trace_config.on_request_start.append(counter("requests"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_connection_queued_start.append(counter("connections_queued"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(counter("dns_cache_misses"))
+
+        # 每个请求有独立的 context，用于保存各阶段的开始时间
+        def start(attr):
+            async def on_event(session, context, params):
+                setattr(context, attr, time.perf_counter())
+            return on_event
+
+        def finish(attr, name):
+            async def on_event(session, context, params):
+                started = getattr(context, attr, None)
+                if started is not None:
+                    self.metrics.observe(name, time.perf_counter() - started)
+            return on_event
+
+        trace_config.on_dns_resolvehost_start.append(start("dns_start"))
+        trace_config.on_dns_resolvehost_end.append(finish("dns_start", "http_dns_seconds"))
+        # 建立连接的耗时包括DNS解析和TCP握手
+        trace_config.on_connection_create_start.append(start("connect_start"))
+        trace_config.on_connection_create_end.append(finish("connect_start", "http_connect_seconds"))
+        # 请求发出到收到响应头的耗时
+        trace_config.on_request_start.append(start("request_start"))
+        trace_config.on_request_end.append(finish("request_start", "http_ttfb_seconds"))
+        return trace_config
+
+    def stats(self) -> Dict:
+        """获取连接池统计信息"""
+        stats = dict(self._counters)
+        stats.update({
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "open": self.session is not None and not self.session.closed,
+        })
+        return stats
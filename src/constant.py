@@ -11,5 +11,42 @@ def get_config_path():
         return "config.ini"
 
 CONFIG_FILE = get_config_path()
+HISTORY_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "history.db")
+MODEL_CACHE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "models_cache.json")
+VECTOR_INDEX_DIR = os.path.join(os.path.dirname(CONFIG_FILE), "vector_index")
+RESPONSE_CACHE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "response_cache.db")
 DEFAULT_SERVER = "50.126.45.75:11434"
-DEFAULT_TIMEOUT = 60.0
\ No newline at end of file
+DEFAULT_TIMEOUT = 60.0
+STREAM_REFRESH_INTERVAL = 0.1  # 流式回复界面刷新间隔（秒）
+EXIT_TIMEOUT = 5.0  # 退出时等待进行中的请求保存和连接关闭的最长时间（秒）
+DEFAULT_CONTEXT_TOKENS = 0  # 默认上下文token预算，0表示不裁剪（设置了 num_ctx 的模型按 num_ctx 裁剪）
+CONTEXT_REPLY_RESERVE = 0.25  # 按 num_ctx 推算预算时留给回复的比例
+DEFAULT_KEEP_ALIVE = "30m"  # 模型在服务器内存中的默认保留时间
+DEFAULT_HEALTH_INTERVAL = 30.0  # 多服务器连接池健康检查间隔（秒）
+DEFAULT_CONNECTION_LIMIT = 100  # 连接池总连接数上限
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 8  # 每个服务器的连接数上限
+DEFAULT_KEEPALIVE_TIMEOUT = 60.0  # 空闲连接保持时间（秒）
+DEFAULT_DNS_TTL = 300  # DNS缓存时间（秒）
+DEFAULT_CONNECT_TIMEOUT = 10.0  # 建立连接的超时时间（秒）
+DEFAULT_MAX_CONCURRENCY = 2  # 每个服务器的最大并发请求数
+HISTORY_PAGE_SIZE = 100  # 每次读取的历史消息数量
+HISTORY_CONVERSATION_LIMIT = 50  # 启动时恢复的最近对话数量
+DEFAULT_RETRY_ATTEMPTS = 3  # 暂时性错误的最多尝试次数
+DEFAULT_RETRY_BASE_DELAY = 0.5  # 重试退避基础延迟（秒）
+DEFAULT_RETRY_MAX_DELAY = 8.0  # 重试退避最长延迟（秒）
+DEFAULT_BREAKER_THRESHOLD = 5  # 打开熔断器所需的连续失败次数
+DEFAULT_BREAKER_RESET = 30.0  # 熔断器冷却时间（秒）
+DEFAULT_HEDGE_DELAY = 1.0  # 获取模型列表的对冲请求延迟（秒），0表示不对冲
+METRICS_REFRESH_INTERVAL = 1000  # 状态栏性能指标刷新间隔（毫秒）
+DEFAULT_METRICS_EXPORT_INTERVAL = 60.0  # 性能指标导出间隔（秒）
+CONFIG_SAVE_DELAY = 1.0  # 配置修改后延迟写入的时间（秒），期间的多次修改合并为一次写入
+CONFIG_SAVE_RETRY_DELAY = 10.0  # 配置写入失败后重试的间隔（秒）
+DEFAULT_EMBED_MODEL = "nomic-embed-text"  # 检索使用的向量模型
+DEFAULT_RETRIEVAL_TOP_K = 4  # 每次注入提示词的相关片段数量
+DEFAULT_RETRIEVAL_MIN_SCORE = 0.5  # 注入片段的最低余弦相似度
+DEFAULT_APPROXIMATE_THRESHOLD = 50000  # 向量数量超过该值时使用近似检索
+EMBED_BATCH_SIZE = 32  # 每个向量请求包含的文本数
+DEFAULT_CACHE_MEMORY_ENTRIES = 256  # 回复缓存在内存中保留的条目数
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 回复缓存磁盘文件的大小上限（字节）
+DEFAULT_CACHE_TTL = 7 * 24 * 3600.0  # 缓存回复的有效期（秒）
+BATCH_WINDOW_FACTOR = 4  # 批量任务中已读取但未输出的项数上限为并发数的倍数
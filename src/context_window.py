@@ -0,0 +1,262 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional
+import hashlib
+import json
+import math
+import re
+import sys
+from chat_api import ChatAPI
+from config_manager import ConfigManager
+from constant import CONTEXT_REPLY_RESERVE
+
+# 中日韩文字大致每个字符对应一个token，其他文字大致每4个字符对应一个token
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色和分隔符开销
+SUMMARY_CACHE_SIZE = 64
+ANCHOR_CACHE_SIZE = 256
+
+SUMMARY_PROMPT = (
+    "请用简洁的语言总结以下对话的要点，保留关键事实、结论和未解决的问题，"
+    "总结将作为后续对话的背景信息。"
+)
+SUMMARY_PREFIX = "之前对话的摘要：\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的token数量"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    """估算单条消息的token数量"""
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """截断文本，使估算的token数量不超过 tokens"""
+    if estimate_tokens(text) <= tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+class ContextPolicy(ABC):
+    """上下文窗口策略接口"""
+
+    @abstractmethod
+    async def prepare(self, model: str, messages: List[Dict[str, str]], chat_api: ChatAPI) -> List[Dict[str, str]]:
+        """根据策略生成本次请求实际发送的消息列表"""
+        pass
+
+
+class UnlimitedPolicy(ContextPolicy):
+    """不做任何裁剪，发送完整历史"""
+
+    async def prepare(self, model: str, messages: List[Dict[str, str]], chat_api: ChatAPI) -> List[Dict[str, str]]:
+        return list(messages)
+
+
+class SlidingWindowPolicy(ContextPolicy):
+    """
+    滑动窗口策略：固定保留系统提示词，从最新消息向前保留到token预算用完
+
+    超出预算时窗口一次性收缩到预算的 low_watermark 比例，并记住窗口起点，
+    之后几轮沿用同一起点，使发送的消息前缀保持不变，服务器可以复用KV缓存，
+    而不是每轮都因为起点后移而重新处理整个上下文。
+    预算为0的模型不裁剪。
+    """
+
+    def __init__(self, default_budget: int, budgets: Optional[Dict[str, int]] = None,
+                 low_watermark: float = 0.75,
+                 model_options: Optional[Callable[[str], Dict]] = None):
+        """
+        Args:
+            default_budget: 默认token预算，0表示没有单独指定预算的模型按 num_ctx 裁剪或不裁剪
+            budgets: 按模型名称指定的token预算
+            low_watermark: 裁剪后保留的token占预算的比例
+            model_options: 获取模型生成参数的函数，用于按 num_ctx 推算预算
+        """
+        self.default_budget = default_budget
+        self.budgets = dict(budgets or {})
+        self.low_watermark = low_watermark
+        self.model_options = model_options
+        self._anchors: "OrderedDict[str, None]" = OrderedDict()  # 曾用作窗口起点的消息
+
+    def budget_for(self, model: str) -> int:
+        """
+        获取模型的token预算
+
+        依次使用按模型指定的预算、默认预算，都没有设置时按模型的 num_ctx 留出回复空间后推算，
+        返回0表示不裁剪。
+        """
+        budget = self.budgets.get(model, self.default_budget)
+        if budget > 0 or not self.model_options:
+            return budget
+        num_ctx = self.model_options(model).get("num_ctx")
+        if not num_ctx:
+            return 0
+        return int(num_ctx * (1 - CONTEXT_REPLY_RESERVE))
+
+    def split(self, messages: List[Dict[str, str]], budget: int):
+        """
+        将消息划分为固定部分、被丢弃部分和保留窗口
+
+        Returns:
+            tuple: (pinned, dropped, window)
+        """
+        pinned_count = 0
+        while pinned_count < len(messages) and messages[pinned_count]["role"] == "system":
+            pinned_count += 1
+        pinned = messages[:pinned_count]
+        rest = messages[pinned_count:]
+
+        available = budget - sum(estimate_message_tokens(m) for m in pinned)
+        costs = [estimate_message_tokens(m) for m in rest]
+        if sum(costs) <= available:
+            return pinned, [], rest
+
+        # 优先沿用之前的窗口起点，保持消息前缀稳定
+        suffix = 0
+        fits = len(rest)
+        for i in range(len(rest) - 1, -1, -1):
+            suffix += costs[i]
+            if suffix > available:
+                break
+            fits = i
+        for i in range(fits, len(rest)):
+            if self._anchor_key(rest[i]) in self._anchors:
+                return pinned, rest[:i], rest[i:]
+
+        # 重新选择起点，收缩到低水位，最新一条消息总是保留
+        start = len(rest) - 1
+        kept = costs[start]
+        target = available * self.low_watermark
+        while start > 0 and kept + costs[start - 1] <= target:
+            start -= 1
+            kept += costs[start]
+
+        self._anchors[self._anchor_key(rest[start])] = None
+        while len(self._anchors) > ANCHOR_CACHE_SIZE:
+            self._anchors.popitem(last=False)
+        return pinned, rest[:start], rest[start:]
+
+    @staticmethod
+    def _anchor_key(message: Dict[str, str]) -> str:
+        """计算窗口起点消息的标识"""
+        return hashlib.sha256(
+            json.dumps([message["role"], message["content"]], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    async def prepare(self, model: str, messages: List[Dict[str, str]], chat_api: ChatAPI) -> List[Dict[str, str]]:
+        budget = self.budget_for(model)
+        if budget <= 0:
+            return list(messages)
+        pinned, _, window = self.split(messages, budget)
+        return pinned + window
+
+
+class SummarizingPolicy(SlidingWindowPolicy):
+    """
+    在滑动窗口基础上，将被丢弃的旧消息压缩为摘要，摘要长度不超过预算中留给摘要的部分
+
+    摘要只是尽力而为，摘要请求失败时退回只发送窗口内的消息，不影响本次对话。
+    """
+
+    def __init__(self, default_budget: int, budgets: Optional[Dict[str, int]] = None,
+                 low_watermark: float = 0.75, summary_ratio: float = 0.25,
+                 model_options: Optional[Callable[[str], Dict]] = None,
+                 keep_alive: Optional[Callable[[], Optional[str]]] = None):
+        """
+        Args:
+            default_budget: 默认token预算，0表示没有单独指定预算的模型按 num_ctx 裁剪或不裁剪
+            budgets: 按模型名称指定的token预算
+            low_watermark: 裁剪后保留的token占预算的比例
+            summary_ratio: 预算中留给摘要的比例
+            model_options: 获取模型生成参数的函数，用于按 num_ctx 推算预算，摘要请求也使用这些参数
+            keep_alive: 获取模型保留时间的函数，摘要请求与普通请求使用相同的值，避免服务器重新加载模型
+        """
+        super().__init__(default_budget, budgets, low_watermark, model_options)
+        self.summary_ratio = summary_ratio
+        self.keep_alive = keep_alive
+        # 被摘要消息前缀的哈希 -> 摘要，便于增量摘要
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+
+    async def prepare(self, model: str, messages: List[Dict[str, str]], chat_api: ChatAPI) -> List[Dict[str, str]]:
+        budget = self.budget_for(model)
+        if budget <= 0:
+            return list(messages)
+        pinned, dropped, window = self.split(messages, int(budget * (1 - self.summary_ratio)))
+        if not dropped:
+            return pinned + window
+
+        limit = int(budget * self.summary_ratio) - MESSAGE_OVERHEAD_TOKENS - estimate_tokens(SUMMARY_PREFIX)
+        if limit <= 0:
+            return pinned + window
+        try:
+            summary = await self._summarize(model, dropped, chat_api, limit)
+        except Exception as e:
+            print(f"生成对话摘要失败，只发送最近的消息：{e}", file=sys.stderr)
+            return pinned + window
+        return pinned + [{"role": "system", "content": SUMMARY_PREFIX + summary}] + window
+
+    async def _summarize(self, model: str, dropped: List[Dict[str, str]], chat_api: ChatAPI, limit: int) -> str:
+        """摘要被丢弃的消息，复用已有的前缀摘要；限制生成长度，超出 limit 个token的部分截断"""
+        prefix_keys = []
+        digest = hashlib.sha256()
+        for message in dropped:
+            digest.update(json.dumps([message["role"], message["content"]], ensure_ascii=False).encode("utf-8"))
+            prefix_keys.append(digest.hexdigest())
+
+        if prefix_keys[-1] in self._summaries:
+            self._summaries.move_to_end(prefix_keys[-1])
+            return self._summaries[prefix_keys[-1]]
+
+        previous = None
+        start = 0
+        for i in range(len(prefix_keys) - 2, -1, -1):
+            if prefix_keys[i] in self._summaries:
+                previous = self._summaries[prefix_keys[i]]
+                start = i + 1
+                break
+
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped[start:])
+        if previous:
+            transcript = f"已有摘要：\n{previous}\n\n新增对话：\n{transcript}"
+
+        # 沿用模型的生成参数（如 num_ctx），与普通请求不一致时服务器会重新加载模型
+        options = dict(self.model_options(model) if self.model_options else {}, num_predict=limit)
+        response = await chat_api.send_message(model, [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ], options, self.keep_alive() if self.keep_alive else None)
+        # token估算与模型的分词不完全一致，按估算再截断一次
+        summary = truncate_to_tokens(response["content"].strip(), limit)
+
+        self._summaries[prefix_keys[-1]] = summary
+        while len(self._summaries) > SUMMARY_CACHE_SIZE:
+            self._summaries.popitem(last=False)
+        return summary
+
+
+def create_context_policy(config_manager: ConfigManager) -> ContextPolicy:
+    """
+    根据配置创建上下文窗口策略
+
+    默认不裁剪；设置了预算，或模型的生成参数中设置了 num_ctx 时按预算裁剪。
+    """
+    max_tokens = max(config_manager.get_context_tokens(), 0)
+    budgets = config_manager.get_model_context_tokens()
+    if config_manager.get_context_summarize():
+        return SummarizingPolicy(max_tokens, budgets, model_options=config_manager.get_model_options,
+                                 keep_alive=config_manager.get_keep_alive)
+    return SlidingWindowPolicy(max_tokens, budgets, model_options=config_manager.get_model_options)
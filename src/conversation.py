@@ -0,0 +1,90 @@
+from typing import List, Dict, Optional
+import time
+import uuid
+
+TITLE_MAX_LENGTH = 20
+
+
+class Conversation:
+    """单个对话，拥有独立的模型和消息历史"""
+
+    def __init__(self, conversation_id: str, model: Optional[str] = None, title: str = "新对话",
+                 created_at: Optional[float] = None, loaded: bool = True):
+        self.id = conversation_id
+        self.model = model
+        self.title = title
+        self.messages: List[Dict[str, str]] = []
+        self.created_at = created_at if created_at is not None else time.time()
+        self.is_busy = False  # 是否有进行中的请求
+        self.loaded = loaded  # 历史消息是否已从存储中读取
+        self.oldest_message_id: Optional[int] = None  # 已读取的最早一条消息的ID，用于向前翻页
+        self.has_more_history = False
+
+    def update_title(self, message: str):
+        """使用第一条用户消息作为标题"""
+        if self.title == "新对话" and message.strip():
+            title = message.strip().splitlines()[0]
+            self.title = title[:TITLE_MAX_LENGTH] + ("..." if len(title) > TITLE_MAX_LENGTH else "")
+
+
+class ConversationManager:
+    """管理多个并存的对话"""
+
+    def __init__(self):
+        self._conversations: Dict[str, Conversation] = {}
+        self.active_id: Optional[str] = None
+
+    def create(self, model: Optional[str] = None) -> Conversation:
+        """创建新对话并设为当前对话"""
+        conversation = Conversation(uuid.uuid4().hex, model)
+        self.add(conversation, activate=True)
+        return conversation
+
+    def add(self, conversation: Conversation, activate: bool = False) -> None:
+        """添加已有对话（例如从存储中恢复的对话）"""
+        self._conversations[conversation.id] = conversation
+        if activate or self.active_id is None:
+            self.active_id = conversation.id
+
+    def get(self, conversation_id: Optional[str] = None) -> Conversation:
+        """
+        获取对话，未指定时返回当前对话
+
+        Raises:
+            KeyError: 对话不存在时
+        """
+        if conversation_id is None:
+            if self.active_id is None:
+                return self.create()
+            conversation_id = self.active_id
+        return self._conversations[conversation_id]
+
+    def has(self, conversation_id: str) -> bool:
+        """对话是否存在"""
+        return conversation_id in self._conversations
+
+    @property
+    def active(self) -> Conversation:
+        """当前对话"""
+        return self.get()
+
+    def activate(self, conversation_id: str) -> Conversation:
+        """切换当前对话"""
+        conversation = self._conversations[conversation_id]
+        self.active_id = conversation_id
+        return conversation
+
+    def remove(self, conversation_id: str) -> None:
+        """移除对话，移除当前对话时切换到最近的对话"""
+        self._conversations.pop(conversation_id, None)
+        if self.active_id == conversation_id:
+            self.active_id = next(reversed(self._conversations), None)
+
+    def clear(self) -> None:
+        """移除所有对话"""
+        self._conversations.clear()
+        self.active_id = None
+
+    def list(self) -> List[Conversation]:
+        """按创建顺序列出所有对话"""
+        return list(self._conversations.values())
@@ -1,13 +1,30 @@
+import sys
+from startup_profile import get_profiler
+
+# 需要在导入其他模块之前开始统计导入耗时
+if "--profile-startup" in sys.argv:
+    get_profiler().enable()
+
 import wx
 import asyncio
+import concurrent.futures
 import threading
+import time
 import os
-import sys
 from config_manager import IniConfigManager
 from chat_api import OllamaChatAPI
+from chat_pool import create_chat_api
+from connection_manager import ConnectionManager
 from chat_controller import ChatController
-from ui_components import ServerPanel, ChatPanel, TaskBarIcon
-from constant import CONFIG_FILE, DEFAULT_SERVER, DEFAULT_TIMEOUT
+from ui_components import ServerPanel, ConversationPanel, ChatPanel, MetricsStatusBar, TaskBarIcon
+from chat_store import ChatStore
+from model_cache import ModelCache
+from response_cache import ResponseCache
+from metrics import get_metrics
+from constant import (
+    CONFIG_FILE, HISTORY_FILE, MODEL_CACHE_FILE, VECTOR_INDEX_DIR, RESPONSE_CACHE_FILE, DEFAULT_SERVER, DEFAULT_TIMEOUT,
+    STREAM_REFRESH_INTERVAL, METRICS_REFRESH_INTERVAL, EXIT_TIMEOUT
+)
 
 
 def resource_path(relative_path):
@@ -41,20 +58,35 @@ class ChatFrame(wx.Frame):
         self.Bind(wx.EVT_ICONIZE, self.on_minimize)
 
         try:
+            profiler = get_profiler()
+
             # 初始化事件循环
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
-
-            # 初始化控制器
-            config_manager = IniConfigManager(CONFIG_FILE, DEFAULT_SERVER, DEFAULT_TIMEOUT)
-            chat_api = OllamaChatAPI(DEFAULT_SERVER, DEFAULT_TIMEOUT)
-            self.controller = ChatController(config_manager, chat_api)
-
-            # 先加载配置
-            self.controller.initialize()
-
-            # 后初始化UI
-            self.init_ui()
+            self.sending_conversations = set()  # 正在等待回复的对话ID，只在界面线程中访问
+            self.send_tasks = {}  # 对话ID -> 发送任务，只在事件循环线程中访问
+            self.closing = False  # 正在退出，窗口销毁后不再更新界面
+
+            # 读取配置和历史记录的同时创建界面
+            state_loader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            controller_future = state_loader.submit(self.create_controller)
+            state_loader.shutdown(wait=False)
+
+            with profiler.phase("创建界面"):
+                self.init_ui()
+
+            with profiler.phase("等待配置加载"):
+                self.controller = controller_future.result()
+
+            # 所有服务器连接共享同一个连接池，重新连接时复用已有连接
+            config_manager = self.controller.config_manager
+            self.connection_manager = ConnectionManager(
+                read_timeout=config_manager.get_timeout(),
+                **config_manager.get_network_settings()
+            )
+
+            with profiler.phase("恢复界面状态"):
+                self.restore_ui_state()
             self.Center()
 
             # 绑定关闭事件
@@ -63,24 +95,108 @@ class ChatFrame(wx.Frame):
             wx.MessageBox(f"初始化失败：{str(e)}", "错误", wx.OK | wx.ICON_ERROR)
             raise
 
+    def create_controller(self) -> ChatController:
+        """打开历史数据库并加载配置（在后台线程中执行）"""
+        with get_profiler().phase("加载配置和历史记录"):
+            config_manager = IniConfigManager(CONFIG_FILE, DEFAULT_SERVER, DEFAULT_TIMEOUT)
+            chat_api = OllamaChatAPI(DEFAULT_SERVER, DEFAULT_TIMEOUT)
+            self.store = ChatStore(HISTORY_FILE)
+            controller = ChatController(
+                config_manager, chat_api, api_factory=self.create_chat_api, store=self.store,
+                model_cache=ModelCache(MODEL_CACHE_FILE)
+            )
+            controller.initialize()
+            cache_settings = config_manager.get_cache_settings()
+            self.response_cache = None
+            if cache_settings.pop("enabled"):
+                self.response_cache = ResponseCache(RESPONSE_CACHE_FILE, **cache_settings)
+            retrieval_settings = config_manager.get_retrieval_settings()
+            if retrieval_settings["enabled"]:
+                # 只有启用检索时才加载numpy和向量索引
+                with get_profiler().phase("加载检索索引"):
+                    from retrieval import create_retriever
+                    controller.retriever = create_retriever(retrieval_settings, VECTOR_INDEX_DIR, self.store)
+            return controller
+
+    def create_chat_api(self, server_url: str, timeout: float):
+        """创建API客户端，多个地址时创建多服务器连接池"""
+        config_manager = self.controller.config_manager
+        return create_chat_api(
+            server_url,
+            timeout,
+            config_manager.get_health_interval(),
+            self.connection_manager,
+            config_manager.get_retry_settings(),
+            self.response_cache,
+            config_manager.get_max_concurrency()
+        )
+
     def init_ui(self):
-        """初始化UI"""
+        """创建界面控件，不依赖配置和对话状态"""
         main_panel = wx.Panel(self)
         main_sizer = wx.BoxSizer(wx.VERTICAL)
 
         # 服务器连接面板
-        self.server_panel = ServerPanel(main_panel, self.on_connect, self.on_favorite)
+        self.server_panel = ServerPanel(main_panel, self.on_connect, self.on_favorite, self.on_model_change)
+
+        # 对话切换面板
+        self.conversation_panel = ConversationPanel(
+            main_panel,
+            self.on_new_conversation,
+            self.on_switch_conversation,
+            self.on_close_conversation,
+            self.on_load_more,
+            self.on_search
+        )
 
         # 聊天面板
-        self.chat_panel = ChatPanel(main_panel, self.on_send)
+        self.chat_panel = ChatPanel(main_panel, self.on_send, self.on_stop, self.on_attach_documents)
 
         # 布局
         main_sizer.Add(self.server_panel, 0, wx.ALL | wx.EXPAND, 5)
+        main_sizer.Add(self.conversation_panel, 0, wx.ALL | wx.EXPAND, 5)
         main_sizer.Add(self.chat_panel, 1, wx.ALL | wx.EXPAND, 5)
         main_panel.SetSizer(main_sizer)
 
-        # 更新UI状态
+        # 性能指标状态栏
+        self.status_bar = MetricsStatusBar(self)
+        self.SetStatusBar(self.status_bar)
+        self.last_metrics_export = time.monotonic()
+        self.metrics_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_metrics_timer, self.metrics_timer)
+
+    def restore_ui_state(self):
+        """配置和对话加载完成后更新界面状态"""
         self.update_favorites()
+        self.refresh_active_conversation()
+        self.chat_panel.set_attach_available(self.controller.retriever is not None)
+        self.metrics_timer.Start(METRICS_REFRESH_INTERVAL)
+
+    def finish_startup(self):
+        """窗口显示后再创建WebView，启用启动耗时分析时输出报告"""
+        self.chat_panel.create_web_view()
+        profiler = get_profiler()
+        profiler.mark("WebView创建完成")
+        if profiler.enabled:
+            profiler.report()
+
+    def on_metrics_timer(self, event):
+        """刷新状态栏，并按配置的间隔导出性能指标"""
+        self.status_bar.update_metrics(get_metrics())
+        settings = self.controller.config_manager.get_metrics_settings()
+        if settings["export_file"] and time.monotonic() - self.last_metrics_export >= settings["export_interval"]:
+            self.export_metrics()
+
+    def export_metrics(self):
+        """导出性能指标到配置的文件"""
+        export_file = self.controller.config_manager.get_metrics_settings()["export_file"]
+        if not export_file:
+            return
+        self.last_metrics_export = time.monotonic()
+        try:
+            get_metrics().export(export_file)
+        except OSError as e:
+            print(f"导出性能指标失败：{e}")
 
     def on_connect(self, server_url: str):
         """处理连接/断开事件"""
@@ -99,8 +215,16 @@ class ChatFrame(wx.Frame):
             except Exception as e:
                 wx.CallAfter(self.on_connect_error, str(e))
 
+        def on_models_changed(models):
+            wx.CallAfter(self.on_models_refreshed, models)
+
+        def on_revalidate_error(error):
+            wx.CallAfter(self.on_revalidate_error, server_url, str(error))
+
         self.server_panel.set_connecting_state()
-        future = asyncio.run_coroutine_threadsafe(self.controller.connect(server_url), self.loop)
+        future = asyncio.run_coroutine_threadsafe(
+            self.controller.connect(server_url, on_models_changed, on_revalidate_error), self.loop
+        )
         future.add_done_callback(on_connect_complete)
 
     def disconnect(self):
@@ -121,12 +245,50 @@ class ChatFrame(wx.Frame):
         self.server_panel.update_models(models)
         if models:
             self.controller.set_current_model(models[0]["name"])
+            self.server_panel.set_current_model(models[0]["name"])
             self.server_panel.set_connection_state(True)
             self.chat_panel.set_send_state(True)
+            self.prewarm()
             wx.MessageBox("连接成功！", "提示", wx.OK | wx.ICON_INFORMATION)
         else:
             self.on_connect_error("没有可用的模型")
 
+    def on_models_refreshed(self, models):
+        """后台刷新发现模型列表变化时更新下拉框，尽量保留当前选择"""
+        if not self.controller.is_connected or not models:
+            return
+        self.server_panel.update_models(models)
+        names = [model["name"] for model in models]
+        if self.controller.current_model in names:
+            self.server_panel.set_current_model(self.controller.current_model)
+        else:
+            self.controller.set_current_model(names[0])
+            self.prewarm()
+
+    def on_revalidate_error(self, server_url: str, error_msg: str):
+        """使用缓存的模型列表连接后，后台刷新失败说明服务器可能不可用，断开连接并提示"""
+        if not self.controller.is_connected or self.controller.server_url != server_url:
+            return
+        self.disconnect()
+        wx.MessageBox(f"无法连接到服务器，已断开连接：{error_msg}", "错误", wx.OK | wx.ICON_ERROR)
+
+    def on_model_change(self, model: str):
+        """切换模型"""
+        self.controller.set_current_model(model)
+        self.prewarm()
+
+    def prewarm(self):
+        """在后台预加载当前模型"""
+
+        def on_prewarm_complete(future):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"预加载模型失败：{e}")
+
+        future = asyncio.run_coroutine_threadsafe(self.controller.prewarm(), self.loop)
+        future.add_done_callback(on_prewarm_complete)
+
     def on_connect_error(self, error_msg: str):
         """连接失败处理"""
         self.server_panel.set_connection_state(False)
@@ -137,7 +299,8 @@ class ChatFrame(wx.Frame):
         """断开连接成功处理"""
         self.server_panel.set_connection_state(False)
         self.chat_panel.set_send_state(False)
-        self.chat_panel.update_chat_display([])
+        self.sending_conversations.clear()
+        self.update_conversations()
 
     def on_disconnect_error(self, error_msg: str):
         """断开连接失败处理"""
@@ -153,30 +316,173 @@ class ChatFrame(wx.Frame):
         is_favorite = self.controller.toggle_favorite(server_url)
         self.update_favorites()
 
-    def on_send(self, message: str):
-        """处理发送消息"""
+    def update_conversations(self):
+        """更新对话列表"""
+        self.conversation_panel.update_conversations(
+            self.controller.get_conversations(),
+            self.controller.conversations.active_id
+        )
+
+    def refresh_active_conversation(self):
+        """根据当前对话刷新聊天区域、模型选择和发送状态"""
+        conversation_id = self.controller.conversations.active_id
+        is_sending = conversation_id in self.sending_conversations
+        self.chat_panel.update_chat_display(self.controller.get_messages())
+        if self.controller.current_model:
+            self.server_panel.set_current_model(self.controller.current_model)
+        self.chat_panel.set_send_state(self.controller.is_connected and not is_sending, is_sending)
+        self.conversation_panel.set_load_more_state(self.controller.conversations.active.has_more_history)
+        self.update_conversations()
+
+    def on_new_conversation(self):
+        """新建对话"""
+        self.controller.new_conversation()
+        self.refresh_active_conversation()
+
+    def on_switch_conversation(self, conversation_id: str):
+        """切换对话"""
+        self.controller.switch_conversation(conversation_id)
+        self.refresh_active_conversation()
+
+    def on_close_conversation(self, conversation_id: str):
+        """关闭对话"""
+        if conversation_id in self.sending_conversations:
+            wx.MessageBox("该对话正在等待回复，无法关闭", "提示", wx.OK | wx.ICON_INFORMATION)
+            return
+        result = wx.MessageBox("关闭后将删除该对话的历史记录，是否继续？", "关闭对话", wx.YES_NO | wx.ICON_QUESTION)
+        if result != wx.YES:
+            return
+        self.controller.close_conversation(conversation_id)
+        self.refresh_active_conversation()
+
+    def on_load_more(self):
+        """读取当前对话更早的消息"""
+        if self.controller.load_more_messages():
+            self.refresh_active_conversation()
+
+    def on_search(self, query: str):
+        """检索聊天记录并跳转到选中的消息"""
+        results = self.controller.search_messages(query)
+        if not results:
+            wx.MessageBox("没有找到相关消息", "搜索", wx.OK | wx.ICON_INFORMATION)
+            return
+
+        choices = [
+            f"[{result['title']}] {'用户' if result['role'] == 'user' else 'AI'}：{' '.join(result['snippet'].split())}"
+            for result in results
+        ]
+        dlg = wx.SingleChoiceDialog(self, f"找到 {len(results)} 条相关消息", "搜索结果", choices)
+        if dlg.ShowModal() == wx.ID_OK:
+            result = results[dlg.GetSelection()]
+            index = self.controller.open_message(result["conversation_id"], result["id"])
+            self.refresh_active_conversation()
+            if index is not None:
+                self.chat_panel.scroll_to_message(index)
+        dlg.Destroy()
+
+    def on_attach_documents(self, paths):
+        """把选中的文件加入检索索引"""
+        if not self.controller.is_connected:
+            wx.MessageBox("请先连接服务器，计算文档向量需要使用服务器上的向量模型", "提示",
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+
+        async def attach_all():
+            return sum([await self.controller.attach_document(path) for path in paths])
 
-        def on_send_complete(future):
+        def on_attach_complete(future):
             try:
-                future.result()
-                wx.CallAfter(self.on_send_success)
+                count = future.result()
+                wx.CallAfter(wx.MessageBox, f"已添加 {len(paths)} 个文档，共 {count} 个新片段", "参考文档",
+                             wx.OK | wx.ICON_INFORMATION)
             except Exception as e:
-                wx.CallAfter(self.on_send_error, str(e))
+                wx.CallAfter(wx.MessageBox, f"添加文档失败：{e}", "错误", wx.OK | wx.ICON_ERROR)
+
+        future = asyncio.run_coroutine_threadsafe(attach_all(), self.loop)
+        future.add_done_callback(on_attach_complete)
+
+    def on_send(self, message: str):
+        """处理发送消息，不同对话的请求可以同时进行"""
+        conversation_id = self.controller.conversations.active_id
+
+        def on_send_complete(task):
+            # 在事件循环线程中、控制器处理完取消（保存部分回复、清除忙碌状态）之后执行
+            self.send_tasks.pop(conversation_id, None)
+            if self.closing:
+                return
+            if task.cancelled():
+                wx.CallAfter(self.on_send_cancelled, conversation_id)
+            elif task.exception() is not None:
+                wx.CallAfter(self.on_send_error, conversation_id, str(task.exception()))
+            else:
+                wx.CallAfter(self.on_send_success, conversation_id)
+
+        last_update = [0.0]
+
+        def on_chunk(content: str):
+            # 限制界面刷新频率，避免逐token重绘
+            now = time.monotonic()
+            if now - last_update[0] >= STREAM_REFRESH_INTERVAL:
+                last_update[0] = now
+                wx.CallAfter(self.on_send_progress, conversation_id, content)
 
         self.chat_panel.clear_input()
         self.chat_panel.set_send_state(False, True)
 
-        future = asyncio.run_coroutine_threadsafe(self.controller.send_message(message), self.loop)
-        future.add_done_callback(on_send_complete)
+        def start_send():
+            task = self.loop.create_task(self.controller.send_message(message, on_chunk, conversation_id))
+            self.send_tasks[conversation_id] = task
+            task.add_done_callback(on_send_complete)
+
+        self.sending_conversations.add(conversation_id)
+        self.loop.call_soon_threadsafe(start_send)
+        self.update_conversations()
+
+    def on_stop(self):
+        """
+        停止当前对话正在生成的回复，取消会一直传递到HTTP请求
+        
+        在事件循环中取消发送任务本身，界面在任务处理完取消后才更新。
+        回调按提交顺序执行，刚发送就停止时任务也已经创建。
+        """
+        conversation_id = self.controller.conversations.active_id
+        if conversation_id in self.sending_conversations:
+            self.loop.call_soon_threadsafe(self._cancel_send, conversation_id)
+
+    def _cancel_send(self, conversation_id: str):
+        """在事件循环线程中取消对话的发送任务"""
+        task = self.send_tasks.get(conversation_id)
+        if task:
+            task.cancel()
+
+    def on_send_progress(self, conversation_id: str, content: str):
+        """流式回复进度处理"""
+        if conversation_id != self.controller.conversations.active_id:
+            return
+        messages = self.controller.get_messages()
+        if messages and messages[-1]["role"] == "user":
+            self.chat_panel.update_chat_display(messages)
+            self.chat_panel.update_streaming_message(content)
 
-    def on_send_success(self):
+    def on_send_success(self, conversation_id: str):
         """发送成功处理"""
-        self.chat_panel.set_send_state(True)
-        self.chat_panel.update_chat_display(self.controller.get_messages())
+        self.sending_conversations.discard(conversation_id)
+        if conversation_id == self.controller.conversations.active_id:
+            self.refresh_active_conversation()
+        else:
+            self.update_conversations()
 
-    def on_send_error(self, error_msg: str):
+    def on_send_cancelled(self, conversation_id: str):
+        """停止生成处理，已生成的部分回复会保留"""
+        self.on_send_success(conversation_id)
+
+    def on_send_error(self, conversation_id: str, error_msg: str):
         """发送失败处理"""
-        self.chat_panel.set_send_state(True)
+        self.sending_conversations.discard(conversation_id)
+        if conversation_id == self.controller.conversations.active_id:
+            self.refresh_active_conversation()
+        else:
+            self.update_conversations()
         wx.MessageBox(f"发送失败：{error_msg}", "错误", wx.OK | wx.ICON_ERROR)
 
     def on_minimize(self, event):
@@ -258,11 +564,36 @@ class ChatFrame(wx.Frame):
         else:  # wx.ID_CANCEL
             event.Veto()
 
+    async def shutdown(self):
+        """
+        在事件循环线程中停止所有请求并释放资源
+
+        先取消进行中的发送任务并等待其结束，断开连接后不再有写入，最后才关闭历史数据库和回复缓存。
+        """
+        tasks = list(self.send_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.controller.is_connected:
+            await self.controller.disconnect()
+        await self.connection_manager.close()
+        self.store.close()
+        if self.response_cache:
+            self.response_cache.close()
+
     def _do_exit(self):
         """执行退出操作"""
         try:
-            if self.controller.is_connected:
-                asyncio.run_coroutine_threadsafe(self.controller.disconnect(), self.loop)
+            self.closing = True
+            self.metrics_timer.Stop()
+            self.export_metrics()
+            self.controller.config_manager.flush()
+            future = asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+            try:
+                future.result(timeout=EXIT_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                # 数据库在事件循环线程中关闭，超时后不在这里关闭，避免与仍在进行的写入冲突
+                print("等待请求结束超时，部分资源未释放")
             self.taskbar_icon.Destroy()
             self.Destroy()
         except Exception as e:
@@ -271,9 +602,14 @@ class ChatFrame(wx.Frame):
 
 def main():
     try:
+        profiler = get_profiler()
+        profiler.mark("模块导入完成")
         app = wx.App()
-        frame = ChatFrame()
+        with profiler.phase("创建主窗口"):
+            frame = ChatFrame()
         frame.Show()
+        profiler.mark("窗口显示")
+        wx.CallAfter(frame.finish_startup)
 
         # 启动事件循环
         def run_loop(loop):
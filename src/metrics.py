@@ -0,0 +1,185 @@
+from typing import Dict, List, Optional
+from collections import deque
+import json
+import threading
+import time
+
+HISTOGRAM_WINDOW = 1000  # 每个直方图保留的最近样本数
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """保留最近若干个样本的滚动直方图，累计总数和总和不受窗口限制"""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.samples[-1] if self.samples else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """窗口内样本的分位数"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict:
+        ordered = sorted(self.samples)
+        snapshot = {"count": self.count, "sum": self.sum, "last": self.last}
+        for q in QUANTILES:
+            snapshot[f"p{int(q * 100)}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+        return snapshot
+
+
+class MetricsRegistry:
+    """
+    性能指标注册表
+
+    网络线程、事件循环线程和界面线程都会记录指标，由锁保证一致。
+    耗时类指标统一以秒为单位记录。
+    """
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.window = window
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        """记录一个样本"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.window)
+            histogram.record(value)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """增加计数"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def timer(self, name: str) -> "Timer":
+        """返回记录代码块耗时的上下文管理器"""
+        return Timer(self, name)
+
+    def last(self, name: str) -> Optional[float]:
+        """指标最近一次的值"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            return histogram.last if histogram else None
+
+    def quantile(self, name: str, q: float) -> Optional[float]:
+        """指标在滚动窗口内的分位数"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            return histogram.quantile(q) if histogram else None
+
+    def snapshot(self) -> Dict:
+        """获取所有指标的快照"""
+        with self._lock:
+            return {
+                "histograms": {name: h.snapshot() for name, h in sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus文本格式，直方图以summary类型输出窗口内的分位数"""
+        snapshot = self.snapshot()
+        lines: List[str] = []
+        for name, data in snapshot["histograms"].items():
+            lines.append(f"# TYPE {name} summary")
+            for q in QUANTILES:
+                value = data[f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f'{name}{{quantile="{q}"}} {value}')
+            lines.append(f"{name}_sum {data['sum']}")
+            lines.append(f"{name}_count {data['count']}")
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        """导出为JSON Lines，每个指标一行并带时间戳"""
+        snapshot = self.snapshot()
+        timestamp = time.time()
+        lines = [
+            json.dumps({"timestamp": timestamp, "name": name, "type": "histogram", **data})
+            for name, data in snapshot["histograms"].items()
+        ]
+        lines.extend(
+            json.dumps({"timestamp": timestamp, "name": name, "type": "counter", "value": value})
+            for name, value in snapshot["counters"].items()
+        )
+        return "".join(line + "\n" for line in lines)
+
+    def export(self, path: str) -> None:
+        """
+        导出到文件：.prom/.txt 文件写入Prometheus文本格式（覆盖），其他文件追加JSON Lines
+
+        Raises:
+            OSError: 写入失败时
+        """
+        if path.endswith((".prom", ".txt")):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(self.to_jsonl())
+
+
+class Timer:
+    """记录代码块耗时"""
+
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry = registry
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def record_generation_stats(registry: MetricsRegistry, chunk: Dict) -> None:
+    """从Ollama最后一个响应块的统计字段（纳秒）计算生成速度和提示词处理速度"""
+    eval_count = chunk.get("eval_count")
+    eval_duration = chunk.get("eval_duration")
+    if eval_count and eval_duration:
+        registry.observe("ollama_tokens_per_second", eval_count / (eval_duration / 1e9))
+        registry.increment("ollama_generated_tokens", eval_count)
+    prompt_count = chunk.get("prompt_eval_count")
+    prompt_duration = chunk.get("prompt_eval_duration")
+    if prompt_count and prompt_duration:
+        registry.observe("ollama_prompt_tokens_per_second", prompt_count / (prompt_duration / 1e9))
+    if chunk.get("load_duration"):
+        registry.observe("ollama_load_seconds", chunk["load_duration"] / 1e9)
+
+
+_metrics: Optional[MetricsRegistry] = None
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取共享的指标注册表"""
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+    return _metrics
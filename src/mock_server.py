@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from typing import List, Optional
+from aiohttp import web
+
+EMBED_DIMENSIONS = 64  # 模拟向量的维数
+
+
+class MockOllamaServer:
+    """
+    模拟的Ollama服务器，用于离线测试和基准测试
+
+    实现 /api/tags、/api/chat（流式与非流式）和 /api/embed，回复内容固定，故障由随机种子决定，
+    可以配置首字延迟、生成速度、回复长度和故障注入（只作用于 /api/chat），保证测试结果可复现。
+    """
+
+    def __init__(self, models: Optional[List[str]] = None,
+                 latency: float = 0.0,
+                 token_rate: float = 0.0,
+                 response_tokens: int = 50,
+                 token_size: int = 4,
+                 failure_rate: float = 0.0,
+                 failure_status: int = 503,
+                 disconnect_rate: float = 0.0,
+                 seed: int = 0):
+        """
+        Args:
+            models: 提供的模型名称列表
+            latency: 每个请求返回第一块数据前的延迟（秒）
+            token_rate: 每秒生成的token数，0表示不限速
+            response_tokens: 每个回复的token数
+            token_size: 每个token的字符数，用于控制回复大小
+            failure_rate: 聊天请求直接返回错误状态码的概率
+            failure_status: 注入故障时返回的状态码
+            disconnect_rate: 流式回复进行到一半时断开连接的概率
+            seed: 故障注入的随机种子
+        """
+        self.models = models or ["mock:latest"]
+        self.latency = latency
+        self.token_rate = token_rate
+        self.response_tokens = response_tokens
+        self.token_size = token_size
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.requests = 0  # 收到的请求总数
+        self.failures = 0  # 注入的故障数
+        self._runner: Optional[web.AppRunner] = None
+
+    def create_app(self) -> web.Application:
+        """创建aiohttp应用"""
+        app = web.Application()
+        app.router.add_get("/api/tags", self.handle_tags)
+        app.router.add_post("/api/chat", self.handle_chat)
+        app.router.add_post("/api/embed", self.handle_embed)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        启动服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+
+        Returns:
+            str: 服务器地址（host:port），可直接用作客户端的服务器地址
+        """
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"{host}:{port}"
+
+    async def stop(self) -> None:
+        """停止服务器"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _should_fail(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+    def _tokens(self) -> List[str]:
+        """生成固定的回复，每个token为 token_size 个字符（含空格）"""
+        width = max(self.token_size - 1, 1)
+        return [(f"t{index}" + "x" * width)[:width] + " " for index in range(self.response_tokens)]
+
+    async def _wait_token(self):
+        if self.token_rate > 0:
+            await asyncio.sleep(1 / self.token_rate)
+
+    def _stats(self, model: str, messages: List[dict], tokens: int, start: float) -> dict:
+        """生成与Ollama相同格式的统计字段（单位为纳秒）"""
+        total = int((time.monotonic() - start) * 1e9)
+        return {
+            "model": model,
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": total,
+            "load_duration": 0,
+            "prompt_eval_count": sum(len(m.get("content", "")) // 4 for m in messages),
+            "prompt_eval_duration": 0,
+            "eval_count": tokens,
+            "eval_duration": total,
+        }
+
+    async def handle_tags(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.json_response({
+            "models": [
+                {
+                    "name": name,
+                    "model": name,
+                    "modified_at": "2024-01-01T00:00:00Z",
+                    "size": 0,
+                    "digest": hashlib.sha256(name.encode()).hexdigest(),
+                }
+                for name in self.models
+            ]
+        })
+
+    async def handle_chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        start = time.monotonic()
+        body = await request.json()
+        model = body.get("model")
+        messages = body.get("messages", [])
+        if model not in self.models:
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+        if self._should_fail(self.failure_rate):
+            self.failures += 1
+            return web.Response(status=self.failure_status)
+
+        await asyncio.sleep(self.latency)
+        # 空消息列表用于预加载模型
+        if not messages:
+            return web.json_response({"model": model, "message": {"role": "assistant", "content": ""},
+                                      "done": True, "done_reason": "load"})
+
+        tokens = self._tokens()
+        if not body.get("stream", True):
+            for _ in tokens:
+                await self._wait_token()
+            return web.json_response({
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                **self._stats(model, messages, len(tokens), start),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        disconnect_at = len(tokens) // 2 if self._should_fail(self.disconnect_rate) else None
+        for index, token in enumerate(tokens):
+            if index == disconnect_at:
+                self.failures += 1
+                request.transport.close()
+                return response
+            await response.write((json.dumps({
+                "model": model,
+                "message": {"role": "assistant", "content": token},
+                "done": False,
+            }) + "\n").encode())
+            await self._wait_token()
+        final = {"message": {"role": "assistant", "content": ""}, **self._stats(model, messages, len(tokens), start)}
+        await response.write((json.dumps(final) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def embed_text(text: str) -> List[float]:
+        """把文本的字符三元组哈希到固定维数并归一化，字面相近的文本得到相近的向量"""
+        vector = [0.0] * EMBED_DIMENSIONS
+        text = " ".join(text.lower().split())
+        for index in range(max(len(text) - 2, 1)):
+            digest = hashlib.md5(text[index:index + 3].encode()).digest()
+            vector[digest[0] % EMBED_DIMENSIONS] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    async def handle_embed(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        model = body.get("model")
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if model not in self.models:
+            return web.json_response({"error": f"model '{model}' not found"}, status=404)
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "model": model,
+            "embeddings": [self.embed_text(text) for text in inputs],
+            "prompt_eval_count": sum(len(text) // 4 for text in inputs),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的Ollama服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default="mock:latest", help="模型名称，多个以逗号分隔")
+    parser.add_argument("--latency", type=float, default=0.0, help="首字延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每秒生成的token数，0表示不限速")
+    parser.add_argument("--tokens", type=int, default=50, help="每个回复的token数")
+    parser.add_argument("--token-size", type=int, default=4, help="每个token的字符数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="返回错误状态码的概率")
+    parser.add_argument("--failure-status", type=int, default=503, help="注入故障时的状态码")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="流式回复中途断开的概率")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    server = MockOllamaServer(
+        models=[name.strip() for name in args.models.split(",") if name.strip()],
+        latency=args.latency,
+        token_rate=args.token_rate,
+        response_tokens=args.tokens,
+        token_size=args.token_size,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        disconnect_rate=args.disconnect_rate,
+        seed=args.seed,
+    )
+    print(f"模拟服务器运行在 {args.host}:{args.port}")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
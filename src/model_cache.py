@@ -0,0 +1,73 @@
+from typing import List, Dict, Optional
+import json
+import os
+import sys
+import threading
+import time
+
+
+def models_fingerprint(models: List[Dict]) -> List[tuple]:
+    """模型列表的比较键：名称、摘要和修改时间都相同时视为未变化"""
+    return sorted(
+        (model.get("name", ""), model.get("digest", ""), model.get("modified_at", ""))
+        for model in models
+    )
+
+
+class ModelCache:
+    """按服务器地址缓存模型列表，连接已知服务器时无需等待 /api/tags 返回"""
+
+    def __init__(self, cache_file: str):
+        """
+        Args:
+            cache_file: 缓存文件路径（JSON格式）
+        """
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        """读取缓存文件，文件不存在或损坏时返回空缓存"""
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        """写入临时文件后替换，避免写入中断时损坏缓存"""
+        temp_file = self.cache_file + ".tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            print(f"保存模型列表缓存失败：{e}", file=sys.stderr)
+
+    def get(self, server_url: str) -> Optional[List[Dict]]:
+        """获取服务器的缓存模型列表，没有缓存时返回None"""
+        with self._lock:
+            entry = self._entries.get(server_url)
+            return list(entry["models"]) if entry else None
+
+    def put(self, server_url: str, models: List[Dict]) -> bool:
+        """
+        更新服务器的模型列表
+
+        Returns:
+            bool: 模型列表是否与缓存不同
+        """
+        with self._lock:
+            entry = self._entries.get(server_url)
+            changed = entry is None or models_fingerprint(entry["models"]) != models_fingerprint(models)
+            self._entries[server_url] = {"models": models, "updated_at": time.time()}
+            if changed:
+                self._save()
+            return changed
+
+    def remove(self, server_url: str) -> None:
+        """删除服务器的缓存"""
+        with self._lock:
+            if self._entries.pop(server_url, None) is not None:
+                self._save()
@@ -0,0 +1,247 @@
+from typing import List, Dict, Optional, AsyncIterator, Callable, Awaitable
+import aiohttp
+import asyncio
+import random
+import time
+from chat_api import ChatAPI
+
+# 服务器过载或暂时不可用时返回的状态码
+TRANSIENT_STATUS = (429, 502, 503, 504)
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    """熔断器打开，服务器暂时被视为不可用"""
+    pass
+
+
+def is_transient_error(error: Exception) -> bool:
+    """判断错误是否为可重试的暂时性错误"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and error.status in TRANSIENT_STATUS
+
+
+def is_rejected_error(error: Exception) -> bool:
+    """
+    判断请求是否在服务器开始处理之前失败（连接失败或服务器以过载状态码拒绝）
+
+    超时的请求服务器可能仍在生成，重试会重复占用GPU，不属于此类。
+    """
+    if isinstance(error, (CircuitOpenError, asyncio.TimeoutError)):
+        return False
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and error.status in TRANSIENT_STATUS
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后打开，在冷却时间内直接拒绝请求；冷却结束后只放行一个试探请求，
+    试探期间的其他请求仍被拒绝，试探成功则关闭熔断器，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        Args:
+            failure_threshold: 打开熔断器所需的连续失败次数
+            reset_timeout: 熔断器打开后的冷却时间（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def check(self, name: str) -> bool:
+        """
+        检查是否允许发送请求
+
+        Returns:
+            bool: 该请求是否为半开状态下的试探请求，试探请求被放弃时需要调用 release_probe
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或已有试探请求正在进行时
+        """
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"服务器 {name} 暂时不可用，请稍后重试")
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            raise CircuitOpenError(f"服务器 {name} 正在恢复，请稍后重试")
+        self._probe_in_flight = True
+        return True
+
+    def release_probe(self) -> None:
+        """试探请求被取消、没有得到结果时放行下一个试探请求"""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        """记录成功请求"""
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """记录失败请求"""
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ResilientChatAPI(ChatAPI):
+    """
+    为单个后端增加重试、熔断和对冲请求的包装器
+
+    所有请求都经过熔断器。生成回复不是幂等的，重试会重复占用GPU：只有获取模型列表和计算向量
+    按退避策略重试；流式回复只在收到第一块之前、且服务器没有开始处理时（连接失败或过载）重试；
+    非流式回复和预加载不重试。
+    """
+
+    def __init__(self, inner: ChatAPI, name: str,
+                 max_attempts: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0,
+                 breaker_threshold: int = 5,
+                 breaker_reset: float = 30.0,
+                 hedge_delay: float = 1.0):
+        """
+        Args:
+            inner: 被包装的API客户端
+            name: 后端名称（用于错误提示）
+            max_attempts: 最多尝试次数（包括第一次）
+            base_delay: 退避基础延迟（秒），每次重试翻倍并加入随机抖动
+            max_delay: 单次退避的最长延迟（秒）
+            breaker_threshold: 打开熔断器所需的连续失败次数
+            breaker_reset: 熔断器冷却时间（秒）
+            hedge_delay: 获取模型列表超过该时间未返回时发出对冲请求（秒），0表示不对冲
+        """
+        self.inner = inner
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """计算第attempt次重试前的等待时间（指数退避加全抖动）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _call(self, operation: Callable[[], Awaitable]):
+        """经过熔断器执行一次请求并记录结果，服务器返回了非暂时性的错误也说明服务器可用"""
+        probe = self.breaker.check(self.name)
+        try:
+            result = await operation()
+        except Exception as e:
+            if is_transient_error(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        finally:
+            if probe and self.breaker.state == CircuitBreaker.HALF_OPEN:
+                self.breaker.release_probe()
+        self.breaker.record_success()
+        return result
+
+    async def _retry(self, operation: Callable[[], Awaitable]):
+        """按退避策略重试暂时性错误"""
+        for attempt in range(self.max_attempts):
+            try:
+                return await self._call(operation)
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                await asyncio.sleep(self.backoff_delay(attempt))
+
+    async def connect(self) -> None:
+        await self.inner.connect()
+
+    async def disconnect(self) -> None:
+        await self.inner.disconnect()
+
+    async def get_models(self) -> List[Dict]:
+        """获取模型列表，超过对冲延迟未返回时并行发出第二个请求，取先返回的结果"""
+        return await self._retry(self._hedged_get_models)
+
+    async def _hedged_get_models(self) -> List[Dict]:
+        if self.hedge_delay <= 0:
+            return await self.inner.get_models()
+
+        tasks = [asyncio.ensure_future(self.inner.get_models())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if done:
+                return tasks[0].result()
+
+            tasks.append(asyncio.ensure_future(self.inner.get_models()))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 调用方被取消或已有结果时，取消其余请求并等待结束，避免遗留未取得异常的任务
+            unfinished = [task for task in tasks if not task.done()]
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    task.exception()
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
+        """非流式发送消息，无法判断服务器是否已经开始生成，不重试"""
+        return await self._call(lambda: self.inner.send_message(model, messages, options, keep_alive))
+
+    async def stream_message(self, model: str, messages: List[Dict[str, str]],
+                             options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        """流式发送消息，只在收到第一块响应之前、服务器拒绝请求或无法连接时重试"""
+        for attempt in range(self.max_attempts):
+            probe = self.breaker.check(self.name)
+            started = False
+            try:
+                async for chunk in self.inner.stream_message(model, messages, options, keep_alive):
+                    if not started:
+                        started = True
+                        self.breaker.record_success()
+                    yield chunk
+                return
+            except Exception as e:
+                if not is_transient_error(e):
+                    if not started:
+                        self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if started or not is_rejected_error(e) or attempt == self.max_attempts - 1:
+                    raise
+            finally:
+                if probe and not started and self.breaker.state == CircuitBreaker.HALF_OPEN:
+                    self.breaker.release_probe()
+            await asyncio.sleep(self.backoff_delay(attempt))
+
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        await self._call(lambda: self.inner.load_model(model, keep_alive))
+
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        return await self._retry(lambda: self.inner.embed(model, inputs, keep_alive))
@@ -0,0 +1,289 @@
+from typing import List, Dict, Optional, AsyncIterator, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from chat_api import ChatAPI
+from metrics import get_metrics
+from constant import DEFAULT_CACHE_MEMORY_ENTRIES, DEFAULT_CACHE_MAX_BYTES, DEFAULT_CACHE_TTL
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at);
+"""
+
+
+def is_deterministic(options: Optional[Dict]) -> bool:
+    """温度为0或指定了随机种子时，相同的请求得到相同的回复"""
+    if not options:
+        return False
+    return options.get("seed") is not None or options.get("temperature") == 0
+
+
+def cache_key(model_id: str, messages: List[Dict[str, str]], options: Optional[Dict]) -> str:
+    """按模型摘要、消息内容和生成参数计算缓存键，消息中的其他字段不影响结果"""
+    normalized = [
+        {"role": message["role"], "content": message.get("content", ""), "images": message.get("images")}
+        for message in messages
+    ]
+    payload = json.dumps([model_id, normalized, options or {}], ensure_ascii=False,
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    两级回复缓存：内存中的LRU和SQLite磁盘缓存
+
+    条目超过有效期后失效；磁盘缓存总大小超过上限时，先淘汰最久未访问的条目。
+    磁盘命中只在内存中记录访问时间，写入新条目或关闭时再批量写回，读取不产生磁盘写入。
+    """
+
+    def __init__(self, db_file: Optional[str] = None,
+                 memory_entries: int = DEFAULT_CACHE_MEMORY_ENTRIES,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 ttl: float = DEFAULT_CACHE_TTL):
+        """
+        Args:
+            db_file: 磁盘缓存文件，不提供时只使用内存缓存
+            memory_entries: 内存中保留的条目数
+            max_bytes: 磁盘缓存的总大小上限（字节）
+            ttl: 条目有效期（秒）
+        """
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()  # 键 -> (过期时间, 回复)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        self._touched: Dict[str, float] = {}  # 磁盘命中但尚未写回的访问时间
+        if db_file:
+            self._conn = sqlite3.connect(db_file, check_same_thread=False)
+            with self._lock:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(CACHE_SCHEMA)
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - ttl,))
+                self._conn.commit()
+                self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def has_disk(self) -> bool:
+        """是否启用了磁盘缓存"""
+        return self._conn is not None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn:
+                self._flush_touched()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def get_memory(self, key: str) -> Optional[Dict]:
+        """只从内存中读取未过期的回复，不访问磁盘"""
+        now = time.time()
+        with self._lock:
+            return self._get_memory(key, now)
+
+    def _get_memory(self, key: str, now: float) -> Optional[Dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                return entry[1]
+            del self._memory[key]
+        return None
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取未过期的回复，磁盘命中的条目会放入内存"""
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+            if value is not None or not self._conn:
+                return value
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] + self.ttl <= now:
+                return None
+            self._touched[key] = now
+            value = json.loads(row[0])
+            self._remember(key, row[1] + self.ttl, value)
+            return value
+
+    def put(self, key: str, value: Dict) -> None:
+        """保存回复到内存和磁盘"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + self.ttl, value)
+            if not self._conn:
+                return
+            text = json.dumps(value, ensure_ascii=False)
+            size = len(text.encode("utf-8"))
+            if size > self.max_bytes:
+                return
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now)
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._touched.pop(key, None)
+            self._flush_touched()
+            self._evict()
+            self._conn.commit()
+
+    def _remember(self, key: str, expires_at: float, value: Dict) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self) -> None:
+        """写回磁盘命中的访问时间，淘汰条目前需要写回"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self) -> None:
+        """淘汰过期条目和最久未访问的条目，直到总大小不超过上限"""
+        if self._disk_bytes <= self.max_bytes:
+            return
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while self._disk_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._disk_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._disk_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            if self._conn:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+                self._disk_bytes = 0
+
+
+class CachingChatAPI(ChatAPI):
+    """
+    为确定性的请求缓存回复的包装器
+
+    只有温度为0或指定了随机种子的请求才使用缓存。缓存键包含模型摘要，
+    服务器上的模型更新后旧的回复自然失效。流式请求命中缓存时一次返回完整回复。
+    """
+
+    def __init__(self, inner: ChatAPI, cache: ResponseCache):
+        """
+        Args:
+            inner: 被包装的API客户端
+            cache: 回复缓存，可以在多个客户端之间共享
+        """
+        self.inner = inner
+        self.cache = cache
+        self.metrics = get_metrics()
+        self._digests: Dict[str, str] = {}  # 模型名称 -> 摘要
+
+    async def connect(self) -> None:
+        await self.inner.connect()
+
+    async def disconnect(self) -> None:
+        await self.inner.disconnect()
+
+    async def get_models(self) -> List[Dict]:
+        models = await self.inner.get_models()
+        self._digests = {model["name"]: model.get("digest", "") for model in models}
+        return models
+
+    async def _model_id(self, model: str) -> str:
+        """模型摘要，还没有获取过模型列表时先获取一次，获取失败时退回模型名称"""
+        if model not in self._digests:
+            try:
+                await self.get_models()
+            except Exception as e:
+                print(f"获取模型摘要失败：{e}", file=sys.stderr)
+            # 服务器上没有该模型时不再重复获取
+            self._digests.setdefault(model, "")
+        return f"{model}@{self._digests.get(model, '')}"
+
+    async def _lookup(self, model: str, messages: List[Dict[str, str]],
+                      options: Optional[Dict]) -> Tuple[Optional[str], Optional[Dict]]:
+        """返回缓存键和缓存的回复，请求不确定时缓存键为None"""
+        if not is_deterministic(options):
+            return None, None
+        key = cache_key(await self._model_id(model), messages, options)
+        start = time.perf_counter()
+        cached = self.cache.get_memory(key)
+        if cached is None and self.cache.has_disk:
+            # SQLite查询在线程池中执行，不阻塞事件循环
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.cache.get, key)
+        if cached is None:
+            self.metrics.increment("response_cache_misses")
+        else:
+            self.metrics.increment("response_cache_hits")
+            self.metrics.observe("response_cache_hit_seconds", time.perf_counter() - start)
+        return key, cached
+
+    async def _store(self, key: str, value: Dict) -> None:
+        """保存回复，写磁盘缓存时在线程池中执行"""
+        if self.cache.has_disk:
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.put, key, value)
+        else:
+            self.cache.put(key, value)
+
+    async def send_message(self, model: str, messages: List[Dict[str, str]],
+                           options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Dict:
+        key, cached = await self._lookup(model, messages, options)
+        if cached is not None:
+            return dict(cached)
+        response = await self.inner.send_message(model, messages, options, keep_alive)
+        if key is not None:
+            await self._store(key, response)
+        return response
+
+    async def stream_message(self, model: str, messages: List[Dict[str, str]],
+                             options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> AsyncIterator[Dict]:
+        """流式发送消息，完整接收且正常结束的回复才写入缓存"""
+        key, cached = await self._lookup(model, messages, options)
+        if cached is not None:
+            yield {"model": model, "message": dict(cached), "done": True, "done_reason": "cached"}
+            return
+
+        role = "assistant"
+        parts = []
+        async for chunk in self.inner.stream_message(model, messages, options, keep_alive):
+            delta = chunk.get("message", {})
+            role = delta.get("role", role)
+            parts.append(delta.get("content", ""))
+            if chunk.get("done") and key is not None:
+                await self._store(key, {"role": role, "content": "".join(parts)})
+            yield chunk
+
+    async def load_model(self, model: str, keep_alive: Optional[str] = None) -> None:
+        await self.inner.load_model(model, keep_alive)
+
+    async def embed(self, model: str, inputs: List[str], keep_alive: Optional[str] = None) -> List[List[float]]:
+        return await self.inner.embed(model, inputs, keep_alive)
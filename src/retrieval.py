@@ -0,0 +1,237 @@
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import os
+import sys
+from chat_api import ChatAPI
+from chat_store import ChatStore
+from vector_index import VectorIndex
+from constant import (
+    DEFAULT_EMBED_MODEL, DEFAULT_RETRIEVAL_TOP_K, DEFAULT_RETRIEVAL_MIN_SCORE, EMBED_BATCH_SIZE
+)
+
+CHUNK_SIZE = 800  # 每个片段的最大字符数
+CHUNK_OVERLAP = 100  # 相邻片段重叠的字符数，避免句子被切断后无法检索
+MIN_CHUNK_LENGTH = 10  # 短于该长度的消息（如问候）不建立索引
+SYNC_PAGE_SIZE = 256  # 增量建立索引时每次读取的消息数
+
+
+def split_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """把长文本切分为重叠的片段，尽量在换行或句号处切分"""
+    text = text.strip()
+    if len(text) <= size:
+        return [text] if text else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind("\n", start + overlap, end), text.rfind("。", start + overlap, end))
+            if cut > start:
+                end = cut + 1
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+def read_text(path: str) -> str:
+    """读取UTF-8文本文件"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class Retriever:
+    """
+    历史对话和参考文档的语义检索
+
+    已保存的消息按ID增量计算向量，记录已处理的最后一条消息ID，重启后只处理新消息。
+    参考文档按内容摘要判断是否变化，未变化时不重新计算。
+    """
+
+    def __init__(self, index: VectorIndex, store: Optional[ChatStore] = None,
+                 model: str = DEFAULT_EMBED_MODEL,
+                 top_k: int = DEFAULT_RETRIEVAL_TOP_K,
+                 min_score: float = DEFAULT_RETRIEVAL_MIN_SCORE,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        """
+        Args:
+            index: 向量索引
+            store: 对话历史存储，不提供时只检索参考文档
+            model: 向量模型，与索引中已有向量的模型不同时清空索引重新计算
+            top_k: 每次检索返回的片段数量
+            min_score: 返回片段的最低余弦相似度
+            batch_size: 每个向量请求包含的文本数
+        """
+        self.index = index
+        self.store = store
+        self.model = model
+        self.top_k = top_k
+        self.min_score = min_score
+        self.batch_size = batch_size
+        if index.model is not None and index.model != model:
+            print(f"向量模型已从 {index.model} 更换为 {model}，重新建立检索索引", file=sys.stderr)
+            index.reset(model)
+        elif index.recovered:
+            self._recover()
+
+    def _recover(self) -> None:
+        """
+        索引文件上次写入中断时，按实际加载的条目回退已建立索引的位置
+
+        条目行中间损坏时回退到损坏位置之前，之后的消息重新计算并按 key 替换原有条目。
+        丢失的消息在下次同步时重新计算；无法判断参考文档的片段是否完整，
+        清除文档摘要，再次添加时重新计算。
+        """
+        items = self.index.items[:self.index.lost_row]
+        last_id = max((item["message_id"] for item in items
+                       if item is not None and "message_id" in item), default=0)
+        if last_id < self.index.get_state("last_message_id", 0):
+            print(f"检索索引不完整，从消息 {last_id} 之后重新建立索引", file=sys.stderr)
+            self.index.set_state("last_message_id", last_id)
+        if self.index.get_state("documents"):
+            self.index.set_state("documents", {})
+        if self.index.lost_row is not None:
+            # 重写文件去掉损坏的行，下次加载时不再重复回退
+            self.index.compact()
+        self.index.recovered = False
+
+    @staticmethod
+    async def _in_executor(func: Callable, *args) -> Any:
+        """
+        在线程池中执行索引操作
+
+        写入向量文件、压缩和重建近似索引涉及numpy计算和文件读写，
+        在事件循环中执行会让同时进行的流式回复停顿。
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _embed_items(self, chat_api: ChatAPI, items: List[Dict]) -> None:
+        """分批计算条目文本的向量并加入索引"""
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            vectors = await chat_api.embed(self.model, [item["text"] for item in batch])
+            await self._in_executor(self.index.add, self.model, batch, vectors)
+
+    async def sync(self, chat_api: ChatAPI) -> int:
+        """
+        为上次之后保存的消息建立索引
+
+        Returns:
+            int: 新加入索引的片段数量
+        """
+        if not self.store:
+            return 0
+        added = 0
+        last_id = self.index.get_state("last_message_id", 0)
+        while True:
+            rows = await self._in_executor(self.store.messages_after, last_id, SYNC_PAGE_SIZE)
+            if not rows:
+                return added
+            items = []
+            for row in rows:
+                if len(row["content"].strip()) < MIN_CHUNK_LENGTH:
+                    continue
+                for part, chunk in enumerate(split_text(row["content"])):
+                    items.append({
+                        "key": f"message:{row['id']}:{part}",
+                        "source": "conversation",
+                        "conversation_id": row["conversation_id"],
+                        "message_id": row["id"],
+                        "role": row["role"],
+                        "text": chunk,
+                    })
+            await self._embed_items(chat_api, items)
+            added += len(items)
+            last_id = rows[-1]["id"]
+            await self._in_executor(self.index.set_state, "last_message_id", last_id)
+
+    async def add_document(self, chat_api: ChatAPI, path: str) -> int:
+        """
+        读取文本文件并加入索引，文件内容变化时替换之前的片段
+
+        Returns:
+            int: 加入索引的片段数量，内容未变化时为0
+
+        Raises:
+            OSError: 读取文件失败时
+            UnicodeDecodeError: 文件不是UTF-8文本时
+        """
+        path = os.path.abspath(path)
+        text = await self._in_executor(read_text, path)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        documents = self.index.get_state("documents", {})
+        if documents.get(path) == digest:
+            return 0
+
+        await self._in_executor(self.remove_document, path)
+        title = os.path.basename(path)
+        items = [
+            {"key": f"document:{path}:{part}", "source": "document", "path": path, "title": title, "text": chunk}
+            for part, chunk in enumerate(split_text(text))
+        ]
+        await self._embed_items(chat_api, items)
+        documents = self.index.get_state("documents", {})
+        documents[path] = digest
+        await self._in_executor(self.index.set_state, "documents", documents)
+        return len(items)
+
+    def remove_document(self, path: str) -> int:
+        """从索引中移除参考文档"""
+        path = os.path.abspath(path)
+        documents = self.index.get_state("documents", {})
+        if documents.pop(path, None) is not None:
+            self.index.set_state("documents", documents)
+        return self.index.delete_where(lambda item: item.get("path") == path)
+
+    def remove_conversation(self, conversation_id: str) -> int:
+        """从索引中移除已删除对话的消息"""
+        return self.index.delete_where(lambda item: item.get("conversation_id") == conversation_id)
+
+    async def retrieve(self, chat_api: ChatAPI, query: str,
+                       exclude_conversation: Optional[str] = None) -> List[Dict]:
+        """
+        检索与查询最相关的片段
+
+        Args:
+            chat_api: 用于计算查询向量的API客户端
+            query: 查询文本
+            exclude_conversation: 排除该对话中的消息（已在上下文中）
+
+        Returns:
+            List[Dict]: 条目字段加上 score，按相似度从高到低排列
+        """
+        if not len(self.index) or not query.strip():
+            return []
+        vector = (await chat_api.embed(self.model, [query]))[0]
+
+        def allowed(item: Dict) -> bool:
+            return exclude_conversation is None or item.get("conversation_id") != exclude_conversation
+
+        # 向量较多时检索可能需要重建近似索引
+        results = await self._in_executor(self.index.search, vector, self.top_k, allowed)
+        return [dict(item, score=score) for score, item in results if score >= self.min_score]
+
+
+def format_snippets(snippets: List[Dict]) -> str:
+    """把检索到的片段整理为注入提示词的系统消息内容"""
+    lines = ["以下是从历史对话和参考文档中检索到的内容，仅在与用户的问题相关时参考："]
+    for number, snippet in enumerate(snippets, 1):
+        if snippet.get("source") == "document":
+            origin = f"文档 {snippet['title']}"
+        else:
+            origin = "历史对话中的用户消息" if snippet.get("role") == "user" else "历史对话中的回复"
+        lines.append(f"\n[{number}] 来自{origin}：\n{snippet['text']}")
+    return "\n".join(lines)
+
+
+def create_retriever(settings: Dict, directory: str, store: Optional[ChatStore] = None) -> Retriever:
+    """根据检索设置创建检索器"""
+    return Retriever(
+        VectorIndex(directory, settings["approximate_threshold"]),
+        store,
+        settings["model"],
+        settings["top_k"],
+        settings["min_score"],
+    )
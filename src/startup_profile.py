@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional, TextIO, Tuple
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_PROCESS_START = time.perf_counter()
+
+
+class StartupProfiler:
+    """
+    启动耗时分析
+
+    启用后统计各顶层包的导入耗时（只计自身耗时，不含其中再导入的其他包），
+    并记录初始化各阶段的耗时，启动完成后输出报告。未启用时各方法几乎没有开销。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: List[Tuple[str, float, str]] = []  # (名称, 耗时, 线程名)
+        self.marks: List[Tuple[str, float]] = []  # (名称, 距进程启动的时间)
+        self.import_times: Dict[str, float] = {}
+        self._import_stack: List[list] = []
+        self._original_import = None
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        """开始统计导入耗时"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def disable(self) -> None:
+        """停止统计导入耗时"""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # 只统计主线程的导入，其他线程直接导入，避免栈交错
+        if threading.current_thread() is not threading.main_thread():
+            return self._original_import(name, globals, locals, fromlist, level)
+        if level:
+            root = ((globals or {}).get("__package__") or name or "<relative>").partition(".")[0]
+        else:
+            root = name.partition(".")[0]
+        frame = [root, time.perf_counter(), 0.0]
+        self._import_stack.append(frame)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._import_stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            self.import_times[root] = self.import_times.get(root, 0.0) + elapsed - frame[2]
+            if self._import_stack:
+                self._import_stack[-1][2] += elapsed
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个初始化阶段的耗时"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - start, threading.current_thread().name))
+
+    def mark(self, name: str) -> None:
+        """记录一个时间点（距进程启动的时间）"""
+        if self.enabled:
+            with self._lock:
+                self.marks.append((name, time.perf_counter() - _PROCESS_START))
+
+    def report(self, output: Optional[TextIO] = None, top: int = 15) -> None:
+        """输出启动耗时报告"""
+        output = output or sys.stderr
+        self.disable()
+        print("==== 启动耗时 ====", file=output)
+        print("导入耗时（自身）：", file=output)
+        imports = sorted(self.import_times.items(), key=lambda item: item[1], reverse=True)
+        for name, elapsed in imports[:top]:
+            print(f"  {name:30s} {elapsed * 1000:9.1f} ms", file=output)
+        print(f"  {'合计':30s} {sum(self.import_times.values()) * 1000:9.1f} ms", file=output)
+        print("初始化阶段：", file=output)
+        for name, elapsed, thread in self.phases:
+            suffix = "" if thread == "MainThread" else f"  [{thread}]"
+            print(f"  {name:30s} {elapsed * 1000:9.1f} ms{suffix}", file=output)
+        print("时间点（距进程启动）：", file=output)
+        for name, elapsed in self.marks:
+            print(f"  {name:30s} {elapsed * 1000:9.1f} ms", file=output)
+
+
+_profiler = StartupProfiler()
+
+
+def get_profiler() -> StartupProfiler:
+    """获取共享的启动耗时分析器"""
+    return _profiler
@@ -1,11 +1,14 @@
 from abc import ABC, abstractmethod
 import wx
 import wx.adv
-import wx.html2
-import markdown
 import os
 import sys
-from typing import List, Dict, Optional, Callable
+import json
+from typing import List, Dict, Optional, Callable, Tuple
+from chat_render import (render_message_html, render_placeholder_html, render_page, js_call, RenderPipeline,
+                         VIRTUAL_MARGIN, VIRTUAL_RENDER_TAIL)
+from metrics import MetricsRegistry, get_metrics
+from startup_profile import get_profiler
 
 
 def resource_path(relative_path):
@@ -21,12 +24,13 @@ def resource_path(relative_path):
 class ServerPanel(wx.Panel):
     """服务器连接面板"""
 
-    def __init__(self, parent, on_connect: Callable, on_favorite: Callable):
+    def __init__(self, parent, on_connect: Callable, on_favorite: Callable, on_model_change: Callable):
         super().__init__(parent)
         self.SetBackgroundColour(wx.Colour(255, 255, 255))
 
         self.on_connect = on_connect
         self.on_favorite = on_favorite
+        self.on_model_change = on_model_change
         self.favorite_servers: List[str] = []
 
         self._init_ui()
@@ -54,6 +58,7 @@ class ServerPanel(wx.Panel):
 
         # 模型选择
         self.model_choice = wx.Choice(self, choices=[])
+        self.model_choice.Bind(wx.EVT_CHOICE, self._on_model_choice)
         self.model_choice.Disable()
 
         # 布局
@@ -72,6 +77,11 @@ class ServerPanel(wx.Panel):
         self.on_favorite(self.ip_input.GetValue())
         event.Skip()
 
+    def _on_model_choice(self, event):
+        model = self.get_current_model()
+        if model:
+            self.on_model_change(model)
+
     def _on_address_change(self, event):
         """处理地址变化事件"""
         current_address = self.ip_input.GetValue()
@@ -112,32 +122,132 @@ class ServerPanel(wx.Panel):
         self.favorite_btn.Enable()
 
     def update_models(self, models: List[Dict]):
-        """更新模型列表"""
-        self.model_choice.Clear()
-        self.model_choice.AppendItems([model["name"] for model in models])
+        """更新模型列表，列表未变化时保持原样"""
+        names = [model["name"] for model in models]
+        if names == self.model_choice.GetItems():
+            return
+        self.model_choice.Set(names)
         if models:
             self.model_choice.SetSelection(0)
 
+    def set_current_model(self, model: str):
+        """选中指定模型"""
+        index = self.model_choice.FindString(model)
+        if index != wx.NOT_FOUND:
+            self.model_choice.SetSelection(index)
+
     def get_current_model(self) -> Optional[str]:
         """获取当前选中的模型"""
         index = self.model_choice.GetSelection()
         return self.model_choice.GetString(index) if index != wx.NOT_FOUND else None
 
 
+class ConversationPanel(wx.Panel):
+    """对话切换面板"""
+
+    def __init__(self, parent, on_new: Callable, on_switch: Callable, on_close: Callable,
+                 on_load_more: Callable, on_search: Callable):
+        super().__init__(parent)
+        self.SetBackgroundColour(wx.Colour(255, 255, 255))
+
+        self.on_new = on_new
+        self.on_switch = on_switch
+        self.on_close = on_close
+        self.on_load_more = on_load_more
+        self.on_search = on_search
+        self.conversation_ids: List[str] = []
+
+        self._init_ui()
+
+    def _init_ui(self):
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+        label = wx.StaticText(self, label="对话:")
+        self.conversation_choice = wx.Choice(self, choices=[])
+        self.conversation_choice.Bind(wx.EVT_CHOICE, self._on_choice)
+
+        self.new_btn = wx.Button(self, label="新对话")
+        self.new_btn.Bind(wx.EVT_BUTTON, lambda event: self.on_new())
+
+        self.close_btn = wx.Button(self, label="关闭对话")
+        self.close_btn.Bind(wx.EVT_BUTTON, self._on_close_click)
+
+        self.load_more_btn = wx.Button(self, label="更早消息")
+        self.load_more_btn.SetToolTip("读取当前对话更早的历史消息")
+        self.load_more_btn.Bind(wx.EVT_BUTTON, lambda event: self.on_load_more())
+        self.load_more_btn.Disable()
+
+        self.search_input = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.search_input.SetDescriptiveText("搜索聊天记录")
+        self.search_input.SetMinSize((180, -1))
+        self.search_input.Bind(wx.EVT_TEXT_ENTER, self._on_search)
+        self.search_input.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self._on_search)
+
+        sizer.Add(label, 0, wx.ALL | wx.CENTER, 5)
+        sizer.Add(self.conversation_choice, 1, wx.ALL | wx.EXPAND, 5)
+        sizer.Add(self.search_input, 0, wx.ALL | wx.CENTER, 5)
+        sizer.Add(self.load_more_btn, 0, wx.ALL | wx.CENTER, 5)
+        sizer.Add(self.new_btn, 0, wx.ALL | wx.CENTER, 5)
+        sizer.Add(self.close_btn, 0, wx.ALL | wx.CENTER, 5)
+
+        self.SetSizer(sizer)
+
+    def _on_choice(self, event):
+        index = self.conversation_choice.GetSelection()
+        if index != wx.NOT_FOUND:
+            self.on_switch(self.conversation_ids[index])
+
+    def _on_search(self, event):
+        query = self.search_input.GetValue().strip()
+        if query:
+            self.on_search(query)
+
+    def _on_close_click(self, event):
+        index = self.conversation_choice.GetSelection()
+        if index != wx.NOT_FOUND:
+            self.on_close(self.conversation_ids[index])
+
+    def set_load_more_state(self, has_more: bool):
+        """设置是否还有更早的消息可以读取"""
+        self.load_more_btn.Enable(has_more)
+
+    def update_conversations(self, conversations: List, active_id: Optional[str]):
+        """更新对话列表，进行中的对话标题前显示标记"""
+        self.conversation_ids = [conversation.id for conversation in conversations]
+        self.conversation_choice.Clear()
+        self.conversation_choice.AppendItems([
+            ("… " if conversation.is_busy else "") + conversation.title
+            for conversation in conversations
+        ])
+        if active_id in self.conversation_ids:
+            self.conversation_choice.SetSelection(self.conversation_ids.index(active_id))
+
+
 class ChatPanel(wx.Panel):
     """聊天面板"""
 
-    def __init__(self, parent, on_send: Callable):
+    def __init__(self, parent, on_send: Callable, on_stop: Callable, on_attach: Optional[Callable] = None):
         super().__init__(parent)
         self.on_send = on_send
+        self.on_stop = on_stop
+        self.on_attach = on_attach
+        self._rendered: List[Tuple[str, str]] = []  # 页面中已显示的消息，占位消息也从这里重新渲染
+        self._virtual = False  # WebView支持脚本消息时启用虚拟化显示
+        self._page_ready = False
+        self._pending_scripts: List[str] = []
+        self._stream_version = 0  # 每次页面更新加一，已过时的流式更新不再渲染
+        # Markdown和代码高亮在后台线程中生成，结果按提交顺序回到界面线程
+        self._pipeline = RenderPipeline(wx.CallAfter)
+        self.web_view = None
         self._init_ui()
+        self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
 
     def _init_ui(self):
         sizer = wx.BoxSizer(wx.VERTICAL)
 
-        # 聊天显示区域
-        self.web_view = wx.html2.WebView.New(self)
-        self.web_view.SetBackgroundColour(wx.Colour(255, 255, 255))
+        # 聊天显示区域：WebView创建较慢，先用空白面板占位，窗口显示后再创建
+        self.view_placeholder = wx.Panel(self)
+        self.view_placeholder.SetBackgroundColour(wx.Colour(255, 255, 255))
 
         # 输入区域
         input_panel = wx.Panel(self)
@@ -151,24 +261,69 @@ class ChatPanel(wx.Panel):
         self.send_btn.Bind(wx.EVT_BUTTON, self._on_send)
         self.send_btn.Disable()
 
+        self.stop_btn = wx.Button(input_panel, label="停止")
+        self.stop_btn.SetToolTip("停止生成回复")
+        self.stop_btn.Bind(wx.EVT_BUTTON, lambda event: self.on_stop())
+        self.stop_btn.Disable()
+
+        self.attach_btn = wx.Button(input_panel, label="文档")
+        self.attach_btn.SetToolTip("添加参考文档，提问时自动引用其中相关的内容")
+        self.attach_btn.Bind(wx.EVT_BUTTON, self._on_attach)
+        self.attach_btn.Hide()
+
         input_sizer.Add(self.message_input, 1, wx.ALL | wx.EXPAND, 5)
         input_sizer.Add(self.send_btn, 0, wx.ALL | wx.CENTER, 5)
+        input_sizer.Add(self.stop_btn, 0, wx.ALL | wx.CENTER, 5)
+        input_sizer.Add(self.attach_btn, 0, wx.ALL | wx.CENTER, 5)
         input_panel.SetSizer(input_sizer)
 
-        sizer.Add(self.web_view, 1, wx.ALL | wx.EXPAND, 5)
+        sizer.Add(self.view_placeholder, 1, wx.ALL | wx.EXPAND, 5)
         sizer.Add(input_panel, 0, wx.ALL | wx.EXPAND, 5)
 
         self.SetSizer(sizer)
 
+    def create_web_view(self):
+        """创建聊天显示区域，替换占位面板；创建前的页面更新会在页面加载后执行"""
+        if self.web_view is not None:
+            return
+        with get_profiler().phase("创建WebView"):
+            import wx.html2
+            self.web_view = wx.html2.WebView.New(self)
+            self.web_view.SetBackgroundColour(wx.Colour(255, 255, 255))
+            self.web_view.Bind(wx.html2.EVT_WEBVIEW_LOADED, self._on_page_loaded)
+            # 页面通过 window.ollamaChat.postMessage 请求占位消息的HTML，不支持的后端保持完整显示
+            if self.web_view.AddScriptMessageHandler("ollamaChat"):
+                self._virtual = True
+                self.web_view.Bind(wx.html2.EVT_WEBVIEW_SCRIPT_MESSAGE_RECEIVED, self._on_script_message)
+            self.GetSizer().Replace(self.view_placeholder, self.web_view)
+            self.view_placeholder.Destroy()
+            self.Layout()
+            self.web_view.SetPage(self._generate_chat_html([]), "")
+            if self._virtual:
+                self._run_script(js_call("enableVirtualization", VIRTUAL_MARGIN))
+
     def _on_send(self, event):
         message = self.message_input.GetValue().strip()
         if message:
             self.on_send(message)
 
+    def _on_attach(self, event):
+        dlg = wx.FileDialog(self, "选择参考文档", wildcard="文本文件 (*.txt;*.md)|*.txt;*.md|所有文件 (*.*)|*.*",
+                            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE)
+        if dlg.ShowModal() == wx.ID_OK and self.on_attach:
+            self.on_attach(dlg.GetPaths())
+        dlg.Destroy()
+
+    def set_attach_available(self, available: bool):
+        """启用语义检索时显示添加参考文档按钮"""
+        self.attach_btn.Show(available)
+        self.Layout()
+
     def set_send_state(self, enabled: bool, is_sending: bool = False):
         """设置发送状态"""
         self.send_btn.Enable(enabled)
         self.send_btn.SetLabel("发送中..." if is_sending else "发送")
+        self.stop_btn.Enable(is_sending)
         self.message_input.Enable(enabled)
         if enabled and not is_sending:
             self.message_input.SetFocus()
@@ -178,204 +333,141 @@ class ChatPanel(wx.Panel):
         self.message_input.SetValue("")
 
     def update_chat_display(self, messages: List[Dict[str, str]]):
-        """更新聊天显示"""
-        html_content = self._generate_chat_html(messages)
-        self.web_view.SetPage(html_content, "")
+        """
+        更新聊天显示
+
+        页面外壳只加载一次，之后只把新增消息转换为HTML并追加到页面中；
+        如果历史被截断或替换，则先移除不再匹配的消息。HTML在后台线程中生成。
+        启用虚拟化时，一次追加大量消息只完整渲染最后几条，其余先显示为占位，滚动到附近时再渲染。
+        """
+        with get_metrics().timer("ui_chat_update_seconds"):
+            self._update_chat_display(messages)
+
+    def _update_chat_display(self, messages: List[Dict[str, str]]):
+        keys = [(msg["role"], msg["content"]) for msg in messages]
+        common = 0
+        for rendered, key in zip(self._rendered, keys):
+            if rendered != key:
+                break
+            common += 1
+
+        self._stream_version += 1
+        if common == 0 and self._rendered:
+            # 整个对话被替换（如切换对话），之前尚未显示的渲染结果不再需要
+            self._pipeline.reset()
+
+        truncate = js_call("truncateMessages", common) if common < len(self._rendered) else ""
+        new_messages = messages[common:]
+        self._rendered = keys
+        if not truncate and not new_messages:
+            return
+
+        placeholders = len(new_messages) - VIRTUAL_RENDER_TAIL if self._virtual else 0
+
+        def render():
+            script = truncate
+            if new_messages:
+                html = "".join(
+                    render_placeholder_html(msg) if index < placeholders else render_message_html(msg)
+                    for index, msg in enumerate(new_messages)
+                )
+                script += js_call("appendMessages", html)
+            return script
+
+        self._pipeline.submit(render, self._run_script)
+
+    def scroll_to_message(self, index: int):
+        """滚动到指定位置的消息"""
+        self._pipeline.submit(lambda: js_call("scrollToMessage", index), self._run_script)
+
+    def update_streaming_message(self, content: str):
+        """更新正在生成中的AI回复，渲染完成前又有新内容时跳过旧内容"""
+        self._stream_version += 1
+        version = self._stream_version
+
+        def render():
+            if version != self._stream_version:
+                return None
+            html = render_message_html({"role": "assistant", "content": content})
+            return js_call("setStreaming", html)
+
+        self._pipeline.submit(render, self._run_script)
+
+    def _on_script_message(self, event):
+        """页面请求占位消息的HTML"""
+        try:
+            request = json.loads(event.GetString())
+            index = int(request["index"])
+        except (ValueError, KeyError, TypeError):
+            return
+        if request.get("type") != "render" or not 0 <= index < len(self._rendered):
+            return
+        key = self._rendered[index]
+
+        def render():
+            # 请求之后消息被截断或替换时不再恢复
+            if index >= len(self._rendered) or self._rendered[index] != key:
+                return None
+            html = render_message_html({"role": key[0], "content": key[1]})
+            return js_call("restoreMessage", index, html)
+
+        self._pipeline.submit(render, self._run_script)
+
+    def _run_script(self, script: str):
+        """执行页面脚本，WebView未创建或页面未加载完成时先缓存"""
+        if self._page_ready:
+            with get_metrics().timer("webview_script_seconds"):
+                self.web_view.RunScript(script)
+        else:
+            self._pending_scripts.append(script)
+
+    def _on_page_loaded(self, event):
+        """页面外壳加载完成，执行缓存的脚本"""
+        if not self._page_ready:
+            self._page_ready = True
+            for script in self._pending_scripts:
+                self.web_view.RunScript(script)
+            self._pending_scripts.clear()
+        event.Skip()
+
+    def _on_destroy(self, event):
+        if event.GetEventObject() is self:
+            self._pipeline.shutdown()
+        event.Skip()
 
     def _generate_chat_html(self, messages: List[Dict[str, str]]) -> str:
         """生成聊天HTML内容"""
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
-                    margin: 0;
-                    padding: 20px;
-                    background-color: #f5f5f5;
-                    font-size: 14px;
-                    line-height: 1.5;
-                }
-                .message {
-                    margin-bottom: 20px;
-                    padding: 15px;
-                    border-radius: 10px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                }
-                .user-message {
-                    background-color: #e3f2fd;
-                    margin-left: 20%;
-                }
-                .ai-message {
-                    background-color: #ffffff;
-                    margin-right: 20%;
-                }
-                .message-header {
-                    font-weight: 600;
-                    margin-bottom: 8px;
-                    color: #666;
-                    font-size: 12px;
-                }
-                pre {
-                    position: relative;
-                    background-color: #1e1e1e !important;
-                    color: #d4d4d4;
-                    padding: 1em 1.5em;
-                    border-radius: 8px;
-                    overflow-x: auto;
-                    font-family: "SF Mono", "Cascadia Code", Menlo, Consolas, "DejaVu Sans Mono", monospace;
-                    font-size: 13px;
-                    line-height: 1.6;
-                    margin: 1em 0;
-                    box-shadow: 0 2px 8px rgba(0,0,0,0.15);
-                    border: 1px solid #333;
-                }
-                pre::before {
-                    content: attr(data-language);
-                    position: absolute;
-                    top: 0;
-                    right: 0;
-                    padding: 4px 8px;
-                    font-size: 12px;
-                    font-weight: 600;
-                    color: #d4d4d4;
-                    background: #333;
-                    border-radius: 0 8px 0 8px;
-                }
-                code {
-                    font-family: "SF Mono", "Cascadia Code", Menlo, Consolas, "DejaVu Sans Mono", monospace;
-                    background-color: #f3f4f6;
-                    padding: 0.2em 0.4em;
-                    border-radius: 4px;
-                    font-size: 85%;
-                    color: #24292e;
-                }
-                pre code {
-                    background-color: transparent;
-                    padding: 0;
-                    font-size: inherit;
-                    color: inherit;
-                    white-space: pre;
-                    word-break: normal;
-                    word-wrap: normal;
-                }
-                /* VS Code Dark+ 主题配色 */
-                .codehilite .hll { background-color: #3c3c3c }
-                .codehilite .c { color: #6a9955 } /* Comment */
-                .codehilite .err { color: #f44747 } /* Error */
-                .codehilite .k { color: #569cd6 } /* Keyword */
-                .codehilite .l { color: #ce9178 } /* Literal */
-                .codehilite .n { color: #d4d4d4 } /* Name */
-                .codehilite .o { color: #d4d4d4 } /* Operator */
-                .codehilite .p { color: #d4d4d4 } /* Punctuation */
-                .codehilite .cm { color: #6a9955 } /* Comment.Multiline */
-                .codehilite .cp { color: #6a9955 } /* Comment.Preproc */
-                .codehilite .c1 { color: #6a9955 } /* Comment.Single */
-                .codehilite .cs { color: #6a9955 } /* Comment.Special */
-                .codehilite .kc { color: #569cd6 } /* Keyword.Constant */
-                .codehilite .kd { color: #569cd6 } /* Keyword.Declaration */
-                .codehilite .kn { color: #569cd6 } /* Keyword.Namespace */
-                .codehilite .kp { color: #569cd6 } /* Keyword.Pseudo */
-                .codehilite .kr { color: #569cd6 } /* Keyword.Reserved */
-                .codehilite .kt { color: #569cd6 } /* Keyword.Type */
-                .codehilite .ld { color: #ce9178 } /* Literal.Date */
-                .codehilite .m { color: #b5cea8 } /* Literal.Number */
-                .codehilite .s { color: #ce9178 } /* Literal.String */
-                .codehilite .na { color: #9cdcfe } /* Name.Attribute */
-                .codehilite .nb { color: #dcdcaa } /* Name.Builtin */
-                .codehilite .nc { color: #4ec9b0 } /* Name.Class */
-                .codehilite .no { color: #4fc1ff } /* Name.Constant */
-                .codehilite .nd { color: #dcdcaa } /* Name.Decorator */
-                .codehilite .ni { color: #d4d4d4 } /* Name.Entity */
-                .codehilite .ne { color: #f44747 } /* Name.Exception */
-                .codehilite .nf { color: #dcdcaa } /* Name.Function */
-                .codehilite .nl { color: #d4d4d4 } /* Name.Label */
-                .codehilite .nn { color: #d4d4d4 } /* Name.Namespace */
-                .codehilite .nx { color: #4ec9b0 } /* Name.Other */
-                .codehilite .py { color: #d4d4d4 } /* Name.Property */
-                .codehilite .nt { color: #569cd6 } /* Name.Tag */
-                .codehilite .nv { color: #9cdcfe } /* Name.Variable */
-                .codehilite .ow { color: #569cd6 } /* Operator.Word */
-                .codehilite .mb { color: #b5cea8 } /* Literal.Number.Bin */
-                .codehilite .mf { color: #b5cea8 } /* Literal.Number.Float */
-                .codehilite .mh { color: #b5cea8 } /* Literal.Number.Hex */
-                .codehilite .mi { color: #b5cea8 } /* Literal.Number.Integer */
-                .codehilite .mo { color: #b5cea8 } /* Literal.Number.Oct */
-                .codehilite .sa { color: #ce9178 } /* Literal.String.Affix */
-                .codehilite .sb { color: #ce9178 } /* Literal.String.Backtick */
-                .codehilite .sc { color: #ce9178 } /* Literal.String.Char */
-                .codehilite .dl { color: #ce9178 } /* Literal.String.Delimiter */
-                .codehilite .sd { color: #6a9955 } /* Literal.String.Doc */
-                .codehilite .s2 { color: #ce9178 } /* Literal.String.Double */
-                .codehilite .se { color: #ce9178 } /* Literal.String.Escape */
-                .codehilite .sh { color: #ce9178 } /* Literal.String.Heredoc */
-                .codehilite .si { color: #ce9178 } /* Literal.String.Interpol */
-                .codehilite .sx { color: #ce9178 } /* Literal.String.Other */
-                .codehilite .sr { color: #d16969 } /* Literal.String.Regex */
-                .codehilite .s1 { color: #ce9178 } /* Literal.String.Single */
-                .codehilite .ss { color: #ce9178 } /* Literal.String.Symbol */
-            </style>
-            <script>
-                function scrollToBottom() {
-                    window.scrollTo(0, document.body.scrollHeight);
-                }
-                
-                // 为代码块添加语言标识
-                document.addEventListener('DOMContentLoaded', function() {
-                    document.querySelectorAll('pre').forEach(function(pre) {
-                        var code = pre.querySelector('code');
-                        if (code && code.className) {
-                            var lang = code.className.split('-')[1];
-                            if (lang) {
-                                pre.setAttribute('data-language', lang);
-                            }
-                        }
-                    });
-                });
-            </script>
-        </head>
-        <body onload="scrollToBottom()">
-        """
+        return render_page(messages)
 
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-
-            if role == "user":
-                html_content = f"""
-                <div class="message user-message">
-                    <div class="message-header">用户</div>
-                    <div>{content}</div>
-                </div>
-                """
-            else:
-                md = markdown.markdown(
-                    content,
-                    extensions=["fenced_code", "codehilite", "tables"],
-                    extension_configs={
-                        "codehilite": {
-                            "css_class": "codehilite",
-                            "use_pygments": True,
-                            "noclasses": False,
-                            "guess_lang": True,
-                        }
-                    },
-                )
-                html_content = f"""
-                <div class="message ai-message">
-                    <div class="message-header">AI</div>
-                    <div>{md}</div>
-                </div>
-                """
-            html_template += html_content
-
-        html_template += """
-        </body>
-        </html>
-        """
 
-        return html_template
+class MetricsStatusBar(wx.StatusBar):
+    """在状态栏显示最近的延迟和吞吐量"""
+
+    FIELDS = ("首字", "生成速度", "建立连接", "渲染", "界面更新")
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.SetFieldsCount(len(self.FIELDS))
+        self.update_metrics(get_metrics())
+
+    @staticmethod
+    def _format_seconds(value: Optional[float]) -> str:
+        if value is None:
+            return "-"
+        return f"{value:.2f}s" if value >= 1 else f"{value * 1000:.1f}ms"
+
+    def update_metrics(self, metrics: MetricsRegistry):
+        """刷新状态栏：首字和生成速度显示最近一次，其余显示窗口内的中位数"""
+        tokens_per_second = metrics.last("ollama_tokens_per_second")
+        values = (
+            self._format_seconds(metrics.last("chat_first_token_seconds")),
+            f"{tokens_per_second:.1f} token/s" if tokens_per_second is not None else "-",
+            self._format_seconds(metrics.quantile("http_connect_seconds", 0.5)),
+            self._format_seconds(metrics.quantile("render_markdown_seconds", 0.5)),
+            self._format_seconds(metrics.quantile("webview_script_seconds", 0.5)),
+        )
+        for index, (label, value) in enumerate(zip(self.FIELDS, values)):
+            self.SetStatusText(f"{label}：{value}", index)
 
 
 class TaskBarIcon(wx.adv.TaskBarIcon):
@@ -0,0 +1,365 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import sys
+import threading
+import numpy as np
+from constant import DEFAULT_APPROXIMATE_THRESHOLD
+
+INDEX_GROW_ROWS = 1024  # 向量文件每次至少扩容的行数
+IVF_ITERATIONS = 8  # 近似索引聚类的迭代次数
+IVF_SAMPLE_SIZE = 20000  # 近似索引聚类使用的样本数
+IVF_NPROBE = 8  # 近似检索时查找的聚类数
+ASSIGN_BLOCK_ROWS = 65536  # 分配聚类时每批计算的向量数，限制临时内存
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化，归一化后的向量内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class IVFIndex:
+    """
+    倒排（IVF）近似索引
+
+    用球面k均值把向量分成约 sqrt(n) 个聚类，检索时只计算与查询最接近的 nprobe 个聚类中的向量。
+    建立之后新增的向量不属于任何聚类，由 VectorIndex 直接逐个比较。
+    """
+
+    def __init__(self, vectors: np.ndarray, rows: np.ndarray, nprobe: int = IVF_NPROBE, seed: int = 0):
+        """
+        Args:
+            vectors: 全部向量（通常是内存映射数组）
+            rows: 参与建立索引的行号
+            nprobe: 检索时查找的聚类数
+            seed: 聚类初始化的随机种子
+        """
+        self.nprobe = nprobe
+        self.built_rows = int(rows.max()) + 1 if len(rows) else 0
+        nlist = max(int(np.sqrt(len(rows))), 1)
+        rng = np.random.default_rng(seed)
+        sample = vectors[np.sort(rng.choice(rows, min(len(rows), IVF_SAMPLE_SIZE), replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(IVF_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = normalize(centroids)
+        self.centroids = centroids
+
+        labels = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), ASSIGN_BLOCK_ROWS):
+            block = vectors[rows[start:start + ASSIGN_BLOCK_ROWS]]
+            labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        self.lists = [rows[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """与查询最接近的若干个聚类中的行号"""
+        nprobe = min(self.nprobe, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[cluster] for cluster in nearest])
+
+
+class VectorIndex:
+    """
+    本地向量索引
+
+    向量归一化后保存在内存映射文件 vectors.f32 中，条目信息逐行追加到 items.jsonl，
+    启动时直接映射已有文件，不需要重新计算向量。检索默认对全部向量计算余弦相似度，
+    有效向量数超过 approximate_threshold 时改用倒排近似检索。
+    删除的条目只做标记，标记超过一半时在加载时压缩文件。
+    """
+
+    def __init__(self, directory: str, approximate_threshold: int = DEFAULT_APPROXIMATE_THRESHOLD):
+        """
+        Args:
+            directory: 索引文件所在目录，不存在时自动创建
+            approximate_threshold: 使用近似检索的向量数量阈值，0表示始终精确检索
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.approximate_threshold = approximate_threshold
+        self.vectors_file = os.path.join(directory, "vectors.f32")
+        self.items_file = os.path.join(directory, "items.jsonl")
+        self.meta_file = os.path.join(directory, "meta.json")
+        self.model: Optional[str] = None
+        self.dim = 0
+        self.state: Dict = {}
+        self.recovered = False  # 加载时发现文件写入中断，部分条目可能已丢失
+        self.lost_row: Optional[int] = None  # 第一个因条目行损坏而丢失的行号，压缩文件后清除
+        self.items: List[Optional[Dict]] = []  # 行号 -> 条目，已删除的条目为None
+        self.keys: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._vectors: Optional[np.memmap] = None
+        self._ivf: Optional[IVFIndex] = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _load(self) -> None:
+        """映射已有的索引文件，向量和条目数量不一致时以较少的为准"""
+        if not os.path.exists(self.meta_file):
+            return
+        with open(self.meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model = meta.get("model")
+        self.dim = meta.get("dim", 0)
+        self.state = meta.get("state", {})
+
+        entries = []
+        if os.path.exists(self.items_file):
+            valid = 0  # 已读取的完整行结束处的字节偏移
+            with open(self.items_file, "rb") as f:
+                for number, line in enumerate(f, 1):
+                    if not line.endswith(b"\n"):
+                        break  # 上次写入中断，最后一行不完整
+                    valid += len(line)
+                    try:
+                        entry = json.loads(line)
+                        if not isinstance(entry, dict) or ("delete" not in entry and "key" not in entry):
+                            raise ValueError("条目缺少 key")
+                    except (json.JSONDecodeError, UnicodeDecodeError, ValueError):
+                        # 中间损坏的行只跳过，之后的条目仍然有效；条目行对应一行向量，需要占位以保持行号对齐
+                        print(f"检索索引 {self.items_file} 第{number}行无法解析，已跳过", file=sys.stderr)
+                        entry = None if line.startswith(b'{"delete"') else {}
+                    if entry is not None:
+                        entries.append(entry)
+            # 只截掉末尾不完整的行，否则之后追加的条目会接在残缺的行后面，下次加载时丢失
+            if os.path.getsize(self.items_file) > valid:
+                with open(self.items_file, "r+b") as f:
+                    f.truncate(valid)
+                self.recovered = True
+        capacity = self._open_vectors()
+        truncated = False
+        for entry in entries:
+            if "delete" in entry:
+                row = self.keys.pop(entry["delete"], None)
+                if row is not None:
+                    self.items[row] = None
+            elif len(self.items) < capacity:
+                if entry:
+                    self._set_item(len(self.items), entry)
+                else:
+                    if self.lost_row is None:
+                        self.lost_row = len(self.items)
+                    self.items.append(None)
+            else:
+                truncated = True
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[list(self.keys.values())] = True
+
+        # 条目文件与向量文件不一致，或删除的条目过多时重写文件
+        self.recovered = self.recovered or truncated or self.lost_row is not None
+        if truncated or (len(self.items) > INDEX_GROW_ROWS and len(self.keys) < len(self.items) // 2):
+            self.compact()
+
+    def _open_vectors(self) -> int:
+        """打开向量文件的内存映射，返回可容纳的行数"""
+        self._vectors = None
+        if not self.dim or not os.path.exists(self.vectors_file):
+            return 0
+        rows = os.path.getsize(self.vectors_file) // (self.dim * 4)
+        if rows:
+            self._vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+        return rows
+
+    def _set_item(self, row: int, item: Dict) -> None:
+        old = self.keys.get(item["key"])
+        if old is not None:
+            self.items[old] = None
+            if old < len(self._alive):
+                self._alive[old] = False
+        if row == len(self.items):
+            self.items.append(item)
+        else:
+            self.items[row] = item
+        self.keys[item["key"]] = row
+
+    def _save_meta(self) -> None:
+        temp_file = self.meta_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "state": self.state}, f, ensure_ascii=False)
+        os.replace(temp_file, self.meta_file)
+
+    def reset(self, model: Optional[str] = None) -> None:
+        """清空索引，更换向量模型时需要重新计算所有向量"""
+        with self._lock:
+            self._vectors = None
+            self._ivf = None
+            for path in (self.vectors_file, self.items_file, self.meta_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.model = model
+            self.dim = 0
+            self.state = {}
+            self.items = []
+            self.keys = {}
+            self.lost_row = None
+            self._alive = np.zeros(0, dtype=bool)
+
+    def get_state(self, name: str, default=None):
+        """读取与索引一起保存的状态（如已建立索引的最后一条消息ID）"""
+        return self.state.get(name, default)
+
+    def set_state(self, name: str, value) -> None:
+        with self._lock:
+            self.state[name] = value
+            self._save_meta()
+
+    def _ensure_capacity(self, rows: int) -> None:
+        """扩大向量文件，容量按倍数增长以减少重新映射的次数"""
+        capacity = len(self._alive)
+        if rows <= capacity:
+            return
+        capacity = max(capacity * 2, rows, INDEX_GROW_ROWS)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_file, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._open_vectors()
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+
+    def add(self, model: str, items: List[Dict], vectors: List[List[float]]) -> None:
+        """
+        追加条目和对应的向量，key 相同的旧条目被替换
+
+        Args:
+            model: 计算向量使用的模型
+            items: 条目列表，每个条目必须包含唯一的 key，其余字段原样保存
+            vectors: 与 items 顺序对应的向量
+
+        Raises:
+            ValueError: 模型或向量维数与索引中已有的不一致时
+        """
+        if not items:
+            return
+        matrix = normalize(vectors)
+        with self._lock:
+            if self.model is not None and self.model != model:
+                raise ValueError(f"索引使用的向量模型是 {self.model}，不能加入 {model} 的向量")
+            if self.dim and self.dim != matrix.shape[1]:
+                raise ValueError(f"向量维数 {matrix.shape[1]} 与索引的维数 {self.dim} 不一致")
+            if not self.dim:
+                self.model = model
+                self.dim = matrix.shape[1]
+                self._save_meta()
+
+            start = len(self.items)
+            self._ensure_capacity(start + len(items))
+            self._vectors[start:start + len(items)] = matrix
+            self._vectors.flush()
+            # 先写向量再写条目，写入中断时多出的向量会被忽略
+            with open(self.items_file, "a", encoding="utf-8") as f:
+                for offset, item in enumerate(items):
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    self._set_item(start + offset, item)
+            self._alive[start:start + len(items)] = True
+
+    def delete(self, keys: Iterable[str]) -> int:
+        """
+        删除条目
+
+        Returns:
+            int: 删除的数量
+        """
+        with self._lock:
+            rows = [(key, self.keys.pop(key)) for key in keys if key in self.keys]
+            if not rows:
+                return 0
+            with open(self.items_file, "a", encoding="utf-8") as f:
+                for key, row in rows:
+                    f.write(json.dumps({"delete": key}, ensure_ascii=False) + "\n")
+                    self.items[row] = None
+                    self._alive[row] = False
+            return len(rows)
+
+    def delete_where(self, predicate: Callable[[Dict], bool]) -> int:
+        """删除满足条件的条目"""
+        with self._lock:
+            return self.delete([key for key, row in self.keys.items() if predicate(self.items[row])])
+
+    def compact(self) -> None:
+        """重写索引文件，去掉已删除的条目"""
+        with self._lock:
+            rows = sorted(self.keys.values())
+            vectors = np.array(self._vectors[rows]) if rows else np.zeros((0, self.dim), dtype=np.float32)
+            items = [self.items[row] for row in rows]
+            self._vectors = None
+            self._ivf = None
+            with open(self.vectors_file + ".tmp", "wb") as f:
+                f.write(vectors.tobytes())
+            with open(self.items_file + ".tmp", "w", encoding="utf-8") as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            os.replace(self.vectors_file + ".tmp", self.vectors_file)
+            os.replace(self.items_file + ".tmp", self.items_file)
+            self.items = []
+            self.keys = {}
+            self.lost_row = None
+            capacity = self._open_vectors()
+            for row, item in enumerate(items):
+                self._set_item(row, item)
+            self._alive = np.zeros(capacity, dtype=bool)
+            self._alive[:len(items)] = True
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        """需要计算相似度的行号：向量较少时为全部有效行，否则由近似索引筛选"""
+        count = len(self.items)
+        if not self.approximate_threshold or len(self.keys) < self.approximate_threshold:
+            return np.flatnonzero(self._alive[:count])
+        # 新增向量超过建立时的一倍后重建近似索引
+        if self._ivf is None or count > self._ivf.built_rows * 2:
+            self._ivf = IVFIndex(self._vectors, np.flatnonzero(self._alive[:count]))
+        rows = np.concatenate([self._ivf.candidates(query), np.arange(self._ivf.built_rows, count)])
+        return rows[self._alive[rows]]
+
+    def search(self, query: List[float], k: int,
+               predicate: Optional[Callable[[Dict], bool]] = None) -> List[Tuple[float, Dict]]:
+        """
+        检索与查询向量最相似的条目
+
+        Args:
+            query: 查询向量
+            k: 返回的数量
+            predicate: 条目过滤条件，只返回满足条件的条目
+
+        Returns:
+            List[Tuple[float, Dict]]: (余弦相似度, 条目)，按相似度从高到低排列
+        """
+        with self._lock:
+            if not self.keys or k <= 0:
+                return []
+            query = normalize(query)
+            if query.shape[-1] != self.dim:
+                raise ValueError(f"查询向量维数 {query.shape[-1]} 与索引的维数 {self.dim} 不一致")
+            rows = self._candidate_rows(query)
+            if not len(rows):
+                return []
+            scores = self._vectors[rows] @ query
+
+            # 先取出少量最高分的候选，被过滤掉太多时再对全部候选排序
+            limit = min(len(rows), max(k * 4, 32))
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            for order in (top[np.argsort(-scores[top])], np.argsort(-scores)):
+                results = []
+                for position in order:
+                    item = self.items[rows[position]]
+                    if predicate is None or predicate(item):
+                        results.append((float(scores[position]), item))
+                        if len(results) == k:
+                            return results
+                if limit == len(rows):
+                    break
+            return results
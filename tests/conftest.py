@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+from collections import Counter
+
+# 与 benchmarks 相同，直接导入 src 下的模块
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from chat_api import ChatAPI  # noqa: E402
+
+
+class FakeChatAPI(ChatAPI):
+    """
+    按预设的结果依次响应并记录请求次数的API客户端
+
+    calls 为请求总数，requests 按方法名记录请求次数，sent 记录 send_message 的参数。
+    每次请求取出 results 中的下一项，为异常时抛出；results 用完后 get_models 返回模型 m，
+    send_message 回显最后一条消息。流式回复按 chunks 分块，结果为列表时每块之前取出一项，
+    为异常时在该块抛出。
+    """
+
+    def __init__(self, results=None, chunks=("re", "ply"), delay=0.0, digest=None):
+        self.results = list(results or [])
+        self.chunks = chunks
+        self.delay = delay
+        self.digest = digest
+        self.calls = 0
+        self.requests = Counter()
+        self.sent = []
+
+    async def _next(self, method, default):
+        self.calls += 1
+        self.requests[method] += 1
+        await asyncio.sleep(self.delay)
+        result = self.results.pop(0) if self.results else default
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def get_models(self):
+        model = {"name": await self._next("get_models", "m")}
+        if self.digest is not None:
+            model["digest"] = self.digest
+        return [model]
+
+    async def send_message(self, model, messages, options=None, keep_alive=None):
+        self.sent.append({"model": model, "messages": messages, "options": options, "keep_alive": keep_alive})
+        content = await self._next("send_message", messages[-1]["content"] if messages else "ok")
+        return {"role": "assistant", "content": content}
+
+    async def stream_message(self, model, messages, options=None, keep_alive=None):
+        result = await self._next("stream_message", "ok")
+        for index, part in enumerate(self.chunks):
+            if isinstance(result, list):
+                item = result.pop(0)
+                if isinstance(item, BaseException):
+                    raise item
+            yield {"message": {"role": "assistant", "content": part}, "done": index == len(self.chunks) - 1}
+
+    async def load_model(self, model, keep_alive=None):
+        await self._next("load_model", None)
+
+    async def embed(self, model, inputs, keep_alive=None):
+        await self._next("embed", None)
+        return [[1.0] for _ in inputs]
@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+from batch import BatchCheckpoint, BatchStats, normalize_item
+from chat_api import OllamaChatAPI
+from chat_controller import ChatController
+from config_manager import IniConfigManager
+from mock_server import MockOllamaServer
+
+
+def read_ids(path):
+    checkpoint = BatchCheckpoint(str(path))
+    checkpoint.close()
+    return sorted(checkpoint.completed)
+
+
+def test_normalize_item_defaults():
+    item = normalize_item("你好", 3, "mock:latest")
+    assert item["id"] == 3
+    assert item["model"] == "mock:latest"
+    assert item["messages"] == [{"role": "user", "content": "你好"}]
+
+
+def test_checkpoint_truncates_torn_line(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text('{"id": 0, "response": "a"}\n{"id": 1, "resp', encoding="utf-8")
+
+    checkpoint = BatchCheckpoint(str(path))
+    assert sorted(checkpoint.completed) == ["0"]
+    checkpoint.record({"id": 2, "response": "c"})
+    checkpoint.record({"id": 3, "response": "d"})
+    checkpoint.close()
+    assert read_ids(path) == ["0", "2", "3"]
+
+    # 第二次恢复后继续追加，之前的结果不丢失
+    checkpoint = BatchCheckpoint(str(path))
+    checkpoint.record({"id": 4, "response": "e"})
+    checkpoint.close()
+    assert read_ids(path) == ["0", "2", "3", "4"]
+    for line in path.read_text(encoding="utf-8").splitlines():
+        json.loads(line)
+
+
+def test_checkpoint_skips_corrupt_middle_lines(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text('{"id": 0, "response": "a"}\n{"id": 1, "re\n{"response": "no id"}\n'
+                    '{"id": 3, "response": "d"}\n', encoding="utf-8")
+
+    checkpoint = BatchCheckpoint(str(path))
+    assert sorted(checkpoint.completed) == ["0", "3"]
+    assert checkpoint.skipped == 2
+    checkpoint.record({"id": 4, "response": "e"})
+    checkpoint.close()
+    assert read_ids(path) == ["0", "3", "4"]
+
+def run_batch(server_url, config_file, prompts, checkpoint_file, stop_after=None, ordered=False):
+    async def scenario():
+        config = IniConfigManager(config_file, server_url, 10)
+        controller = ChatController(config, OllamaChatAPI(server_url, 10))
+        controller.initialize()
+        await controller.connect(server_url)
+        controller.set_current_model("mock:latest")
+        stats = BatchStats()
+        results = []
+        try:
+            async for result in controller.run_batch(prompts, ordered=ordered,
+                                                     checkpoint_file=checkpoint_file, stats=stats):
+                results.append(result)
+                if stop_after is not None and len(results) >= stop_after:
+                    break
+        finally:
+            await controller.disconnect()
+        return results, stats
+
+    return scenario
+
+
+def test_run_batch_resumes_from_checkpoint(tmp_path):
+    prompts = [{"id": f"p{i}", "prompt": f"问题{i}"} for i in range(20)]
+    checkpoint_file = str(tmp_path / "progress.jsonl")
+    config_file = str(tmp_path / "config.ini")
+
+    async def scenario():
+        server = MockOllamaServer(response_tokens=5)
+        url = await server.start()
+        try:
+            first, _ = await run_batch(url, config_file, prompts, checkpoint_file, stop_after=7)()
+            # 模拟中断时最后一行只写了一半
+            with open(checkpoint_file, "a", encoding="utf-8") as f:
+                f.write('{"id": "p19", "respo')
+            second, stats = await run_batch(url, config_file, prompts, checkpoint_file, ordered=True)()
+            third, stats3 = await run_batch(url, config_file, prompts, checkpoint_file, ordered=True)()
+        finally:
+            await server.stop()
+        return first, second, stats, third, stats3
+
+    first, second, stats, third, stats3 = asyncio.run(scenario())
+    assert len(first) == 7
+    assert [result["id"] for result in second] == [prompt["id"] for prompt in prompts]
+    assert stats.resumed >= 7
+    assert stats.resumed + stats.completed == 20
+    assert stats.failed == 0
+    # 第三次运行全部从进度文件恢复
+    assert [result["id"] for result in third] == [prompt["id"] for prompt in prompts]
+    assert stats3.resumed == 20 and stats3.completed == 0
+
+
+def test_invalid_lines_become_error_records(tmp_path):
+    from cli import read_in_thread, read_prompts
+
+    lines = ['"问题1"\n', "不是JSON\n", '{"id": "x"}\n', '"问题4"\n']
+
+    async def scenario():
+        server = MockOllamaServer(response_tokens=3)
+        url = await server.start()
+        try:
+            prompts = read_in_thread(read_prompts(iter(lines)))
+            return await run_batch(url, str(tmp_path / "config.ini"), prompts, None, ordered=True)()
+        finally:
+            await server.stop()
+
+    results, stats = asyncio.run(scenario())
+    assert [result["id"] for result in results] == [1, 2, "x", 4]
+    assert "第2行" in results[1]["error"]
+    assert "error" in results[2]
+    assert "error" not in results[0] and "error" not in results[3]
+    assert stats.failed == 2 and stats.completed == 2
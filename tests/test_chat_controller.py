@@ -0,0 +1,78 @@
+import asyncio
+
+from chat_controller import ChatController
+from chat_store import ChatStore
+from config_manager import IniConfigManager
+from conftest import FakeChatAPI
+from model_cache import ModelCache
+
+
+class StalledChatAPI(FakeChatAPI):
+    """发送第一块回复后不再返回的API客户端"""
+
+    async def stream_message(self, model, messages, options=None, keep_alive=None):
+        yield {"message": {"role": "assistant", "content": "部分回复"}, "done": False}
+        await asyncio.Event().wait()
+
+
+def create_controller(tmp_path, api, **kwargs):
+    config = IniConfigManager(str(tmp_path / "config.ini"), "localhost:11434", 10)
+    controller = ChatController(config, api, api_factory=lambda server_url, timeout: api, **kwargs)
+    controller.initialize()
+    return controller
+
+
+def test_cancelled_send_keeps_partial_reply(tmp_path):
+    store = ChatStore(str(tmp_path / "history.db"))
+    controller = create_controller(tmp_path, StalledChatAPI(), store=store)
+
+    async def scenario():
+        await controller.connect("localhost:11434")
+        controller.set_current_model("m")
+        received = asyncio.Event()
+        completed = []
+
+        task = asyncio.create_task(controller.send_message("你好", lambda content: received.set()))
+        # 与界面相同：任务完成时才读取对话状态
+        task.add_done_callback(lambda task: completed.append(
+            (task.cancelled(), controller.conversations.active.is_busy, controller.get_messages())
+        ))
+        await received.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await controller.disconnect()
+        return completed
+
+    completed = asyncio.run(scenario())
+    cancelled, busy, messages = completed[0]
+    assert cancelled
+    assert not busy
+    assert [message["role"] for message in messages] == ["user", "assistant"]
+    assert messages[1]["content"] == "部分回复"
+    saved = store.load_messages(controller.conversations.active_id)
+    assert [row["content"] for row in saved] == [message["content"] for message in messages]
+    store.close()
+
+
+def test_failed_revalidation_is_reported(tmp_path):
+    cache = ModelCache(str(tmp_path / "models_cache.json"))
+    api = FakeChatAPI()
+    controller = create_controller(tmp_path, api, model_cache=cache)
+
+    async def scenario():
+        await controller.connect("localhost:11434")
+        api.results = [ConnectionError("无法连接")]
+
+        # 有缓存时立即连接成功，后台刷新失败后通过回调通知
+        failed = asyncio.get_running_loop().create_future()
+        models = await controller.connect("localhost:11434", on_revalidate_error=failed.set_result)
+        error = await asyncio.wait_for(failed, 10)
+        await controller.disconnect()
+        return models, error
+
+    models, error = asyncio.run(scenario())
+    assert models == cache.get("localhost:11434") == [{"name": "m"}]
+    assert isinstance(error, ConnectionError)
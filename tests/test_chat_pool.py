@@ -0,0 +1,41 @@
+import asyncio
+
+from chat_pool import PooledChatAPI
+from mock_server import MockOllamaServer
+
+
+def test_per_backend_concurrency_limit():
+    async def scenario():
+        slow = MockOllamaServer(latency=0.3, response_tokens=2)
+        fast = MockOllamaServer(latency=0.02, response_tokens=2)
+        urls = [await slow.start(), await fast.start()]
+        pool = PooledChatAPI(urls, 10, health_interval=60, max_concurrency=2)
+        peaks = {url: 0 for url in urls}
+        running = True
+
+        async def watch():
+            while running:
+                for backend in pool.backends:
+                    peaks[backend.url] = max(peaks[backend.url], backend.in_flight)
+                await asyncio.sleep(0.005)
+
+        async def ask(index):
+            return [chunk async for chunk in pool.stream_message("mock:latest", [{"role": "user", "content": str(index)}])]
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await pool.connect()
+            results = await asyncio.gather(*(ask(index) for index in range(12)))
+        finally:
+            running = False
+            await watcher
+            await pool.disconnect()
+            await slow.stop()
+            await fast.stop()
+        return urls, peaks, results, slow.requests, fast.requests
+
+    urls, peaks, results, slow_requests, fast_requests = asyncio.run(scenario())
+    assert len(results) == 12 and all(result[-1]["done"] for result in results)
+    assert all(peak <= 2 for peak in peaks.values())
+    # 慢的后端占满名额后，其余请求都由快的后端处理
+    assert fast_requests > slow_requests
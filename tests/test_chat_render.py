@@ -0,0 +1,14 @@
+from chat_render import render_message_html
+
+
+def test_user_content_is_escaped():
+    html = render_message_html({"role": "user", "content": '<img src=x onerror="window.ollamaChat.postMessage(1)">'})
+    assert "<img" not in html
+    assert "&lt;img" in html
+
+
+def test_raw_html_in_replies_is_escaped():
+    html = render_message_html({"role": "assistant", "content": "**粗体**\n\n<script>alert(1)</script>\n\n前 <b onclick=x>后"})
+    assert "<strong>粗体</strong>" in html
+    assert "<script>" not in html and "<b onclick" not in html
+    assert "&lt;script&gt;" in html
@@ -0,0 +1,89 @@
+import sqlite3
+
+from chat_store import ChatStore, cjk_bigrams, make_snippet
+
+
+def make_store(tmp_path):
+    store = ChatStore(str(tmp_path / "history.db"))
+    store.save_conversation("c1", "部署", "mock:latest", 0)
+    store.save_conversation("c2", "闲聊", "mock:latest", 0)
+    return store
+
+
+def test_cjk_bigrams():
+    assert cjk_bigrams("GPU显存不足").split() == ["GPU", "显存", "存不", "不足"]
+    assert cjk_bigrams("第3条").split() == ["第", "3", "条"]
+
+
+def test_short_chinese_terms_ranked_by_relevance(tmp_path):
+    store = make_store(tmp_path)
+    relevant = store.append_messages("c1", [
+        {"role": "user", "content": "端口端口端口，服务器的端口是多少"},
+    ])[0]
+    store.append_messages("c2", [
+        {"role": "user", "content": "今天天气不错，" + "随便聊聊。" * 40 + "顺便问一下端口"},
+        {"role": "assistant", "content": "没有相关内容"},
+    ])
+
+    results = store.search("端口")
+    assert len(results) == 2
+    # 较早但更相关的消息排在前面
+    assert results[0]["id"] == relevant
+    assert "【端口】" in results[0]["snippet"]
+
+    assert [result["id"] for result in store.search("端口 服务器")] == [relevant]
+    assert store.search("港口") == []
+    store.close()
+
+
+def test_single_character_and_mixed_terms(tmp_path):
+    store = make_store(tmp_path)
+    ids = store.append_messages("c1", [
+        {"role": "user", "content": "GPU显存不足怎么办"},
+        {"role": "assistant", "content": "可以换一个小一点的模型"},
+    ])
+    assert [result["id"] for result in store.search("显")] == [ids[0]]
+    assert [result["id"] for result in store.search("gpu显存")] == [ids[0]]
+    assert [result["id"] for result in store.search("模型")] == [ids[1]]
+    store.close()
+
+
+def test_long_terms_rank_all_matches(tmp_path):
+    store = make_store(tmp_path)
+    best = store.append_messages("c1", [{"role": "user", "content": "ollama ollama ollama"}])[0]
+    store.append_messages("c2", [
+        {"role": "user", "content": f"第{i}条消息提到 ollama，" + "其他内容" * 30} for i in range(400)
+    ])
+    results = store.search("ollama", limit=5)
+    assert len(results) == 5
+    assert results[0]["id"] == best
+
+
+def test_deleted_conversation_is_removed_from_index(tmp_path):
+    store = make_store(tmp_path)
+    store.append_messages("c1", [{"role": "user", "content": "删除之前的端口"}])
+    store.append_messages("c2", [{"role": "user", "content": "保留的端口"}])
+    store.delete_conversation("c1")
+    assert [result["conversation_id"] for result in store.search("端口")] == ["c2"]
+    store.close()
+
+
+def test_existing_history_is_indexed_on_upgrade(tmp_path):
+    path = str(tmp_path / "history.db")
+    store = make_store(tmp_path)
+    store.append_messages("c1", [{"role": "user", "content": "升级之前保存的端口"}])
+    store.close()
+    # 模拟之前的版本：只有trigram索引
+    conn = sqlite3.connect(path)
+    conn.executescript("DROP TRIGGER messages_cjk_insert; DROP TRIGGER messages_cjk_delete; DROP TABLE messages_cjk;")
+    conn.close()
+
+    store = ChatStore(path)
+    assert len(store.search("端口")) == 1
+    store.close()
+
+
+def test_make_snippet():
+    content = "前" * 50 + "端口" + "后" * 50
+    snippet = make_snippet(content, ["端口"], context=5)
+    assert snippet == "…前前前前前【端口】后后后后后…"
@@ -0,0 +1,13 @@
+from batch import InvalidItem, normalize_item
+from cli import read_prompts
+
+
+def test_read_prompts_is_lazy():
+    lines = iter(['"你好"\n', '{"messages": [{"role": "user", "content": "嗨"}], "model": "other"}\n', "不是JSON\n"])
+    prompts = read_prompts(lines)
+    assert next(prompts) == {"prompt": "你好", "id": 1}
+    item = normalize_item(next(prompts), 1, "mock:latest")
+    assert item["id"] == 2 and item["model"] == "other"
+    invalid = next(prompts)
+    assert isinstance(invalid, InvalidItem)
+    assert invalid.item_id == 3 and "第3行" in str(invalid)
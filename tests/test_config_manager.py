@@ -0,0 +1,79 @@
+import configparser
+import threading
+import time
+
+from config_manager import IniConfigManager
+
+
+def make_config(tmp_path, save_delay=0.05):
+    config = IniConfigManager(str(tmp_path / "config.ini"), "localhost:11434", 30, save_delay=save_delay)
+    config.load_config()
+    return config
+
+
+def read_value(tmp_path, section, key):
+    parser = configparser.ConfigParser()
+    parser.read(tmp_path / "config.ini", encoding="utf-8")
+    return parser.get(section, key)
+
+
+def test_changes_are_coalesced_into_one_write(tmp_path):
+    config = make_config(tmp_path)
+    writes = []
+    write_file = config._write_file
+    config._write_file = lambda text: (writes.append(text), write_file(text))
+    for timeout in range(10, 20):
+        config.set_timeout(timeout)
+    time.sleep(0.3)
+    assert len(writes) == 1
+    assert read_value(tmp_path, "Chat", "timeout") == "19"
+
+
+def test_slow_write_does_not_block_setters(tmp_path):
+    config = make_config(tmp_path)
+    started = threading.Event()
+    release = threading.Event()
+    write_file = config._write_file
+
+    def slow_write(text):
+        started.set()
+        release.wait(5)
+        write_file(text)
+
+    config._write_file = slow_write
+    config.set_timeout(42)
+    writer = threading.Thread(target=config.flush)
+    writer.start()
+    assert started.wait(5)
+
+    start = time.monotonic()
+    config.add_favorite_server("example:11434")
+    assert time.monotonic() - start < 0.5
+
+    release.set()
+    writer.join()
+    # 写入期间的修改没有丢失，修改标记仍在
+    assert config._dirty
+    config._write_file = write_file
+    config.flush()
+    assert read_value(tmp_path, "Chat", "timeout") == "42"
+    assert "example:11434" in read_value(tmp_path, "Favorites", "servers")
+
+
+def test_failed_write_is_retried(tmp_path):
+    config = make_config(tmp_path)
+    write_file = config._write_file
+
+    def failing_write(text):
+        raise OSError("磁盘已满")
+
+    config._write_file = failing_write
+    config.set_timeout(55)
+    config.flush()
+    assert config._dirty
+    assert config._save_timer is not None
+
+    config._write_file = write_file
+    config.flush()
+    assert not config._dirty
+    assert read_value(tmp_path, "Chat", "timeout") == "55"
@@ -0,0 +1,92 @@
+import asyncio
+
+from config_manager import IniConfigManager
+from conftest import FakeChatAPI
+from context_window import (
+    SlidingWindowPolicy, SummarizingPolicy, create_context_policy, estimate_tokens, truncate_to_tokens,
+)
+
+
+def conversation(count, size=100):
+    messages = [{"role": "system", "content": "你是助手"}]
+    for index in range(count):
+        role = "user" if index % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"{index} " + "x" * size})
+    return messages
+
+
+def prepare(policy, messages, model="m", api=None):
+    return asyncio.run(policy.prepare(model, messages, api or FakeChatAPI()))
+
+
+def test_default_config_does_not_truncate(tmp_path):
+    config = IniConfigManager(str(tmp_path / "config.ini"), "localhost:11434", 30)
+    config.load_config()
+    messages = conversation(400)
+    assert prepare(create_context_policy(config), messages) == messages
+
+
+def test_budget_from_num_ctx(tmp_path):
+    config = IniConfigManager(str(tmp_path / "config.ini"), "localhost:11434", 30)
+    config.load_config()
+    config.model_options = {"small": {"num_ctx": 1024}}
+    policy = create_context_policy(config)
+    messages = conversation(400)
+
+    assert policy.budget_for("small") == 768
+    assert policy.budget_for("other") == 0
+    assert prepare(policy, messages, "other") == messages
+    window = prepare(policy, messages, "small")
+    assert window[0] == messages[0] and window[-1] == messages[-1]
+    assert len(window) < len(messages)
+
+
+def test_sliding_window_keeps_prefix_stable():
+    policy = SlidingWindowPolicy(1000)
+    messages = conversation(60)
+    first = prepare(policy, messages)
+    assert first[0]["role"] == "system" and first[-1] == messages[-1]
+    # 下一轮沿用同一个窗口起点
+    messages += [{"role": "user", "content": "继续"}]
+    second = prepare(policy, messages)
+    assert second[:len(first)] == first
+
+
+def test_summary_is_capped():
+    api = FakeChatAPI(["很长的摘要" * 2000])
+    policy = SummarizingPolicy(1000)
+    context = prepare(policy, conversation(60), api=api)
+    summary = context[1]
+    assert summary["role"] == "system" and summary["content"].startswith("之前对话的摘要")
+    limit = api.sent[0]["options"]["num_predict"]
+    assert 0 < limit < 250
+    assert estimate_tokens(summary["content"]) <= 250
+    assert sum(estimate_tokens(message["content"]) + 4 for message in context) <= 1000
+
+
+def test_summary_uses_model_options_and_keep_alive(tmp_path):
+    config = IniConfigManager(str(tmp_path / "config.ini"), "localhost:11434", 30)
+    config.load_config()
+    config.model_options = {"m": {"num_ctx": 1024, "temperature": 0.2}}
+    config.context_summarize = True
+    api = FakeChatAPI(["摘要"])
+    context = prepare(create_context_policy(config), conversation(400), api=api)
+
+    assert context[1]["content"].endswith("摘要")
+    options = api.sent[0]["options"]
+    assert options["num_ctx"] == 1024 and options["temperature"] == 0.2 and options["num_predict"] > 0
+    assert api.sent[0]["keep_alive"] == config.get_keep_alive()
+
+
+def test_failed_summary_falls_back_to_window():
+    api = FakeChatAPI([RuntimeError("服务器错误")])
+    messages = conversation(60)
+    context = prepare(SummarizingPolicy(1000), messages, api=api)
+    assert context[0] == messages[0] and context[-1] == messages[-1]
+    assert all(not message["content"].startswith("之前对话的摘要") for message in context)
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("abcdefgh", 1) == "abcd"
+    assert truncate_to_tokens("中文内容", 2) == "中文"
+    assert truncate_to_tokens("short", 10) == "short"
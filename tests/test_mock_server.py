@@ -0,0 +1,44 @@
+import asyncio
+
+import aiohttp
+
+from mock_server import MockOllamaServer
+
+
+def test_mock_server_serves_tags_chat_and_embed():
+    async def scenario():
+        server = MockOllamaServer(response_tokens=3, token_size=4)
+        address = await server.start()
+        try:
+            async with aiohttp.ClientSession(f"http://{address}") as session:
+                async with session.get("/api/tags") as response:
+                    tags = await response.json()
+                async with session.post("/api/chat", json={
+                    "model": "mock:latest", "messages": [{"role": "user", "content": "hi"}], "stream": False,
+                }) as response:
+                    chat = await response.json()
+                async with session.post("/api/embed", json={"model": "mock:latest", "input": ["a", "a", "b"]}) as response:
+                    embed = await response.json()
+        finally:
+            await server.stop()
+        return address, tags, chat, embed
+
+    address, tags, chat, embed = asyncio.run(scenario())
+    assert address.startswith("127.0.0.1:") and int(address.split(":")[1]) > 0
+    assert [model["name"] for model in tags["models"]] == ["mock:latest"]
+    assert chat["message"]["content"] == "t0x t1x t2x "
+    assert chat["eval_count"] == 3
+    vectors = embed["embeddings"]
+    assert vectors[0] == vectors[1] != vectors[2]
+
+
+def test_two_servers_get_distinct_ports():
+    async def scenario():
+        servers = [MockOllamaServer(), MockOllamaServer()]
+        addresses = [await server.start() for server in servers]
+        for server in servers:
+            await server.stop()
+        return addresses
+
+    first, second = asyncio.run(scenario())
+    assert first != second
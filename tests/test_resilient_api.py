@@ -0,0 +1,144 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from conftest import FakeChatAPI
+from resilient_api import CircuitBreaker, CircuitOpenError, ResilientChatAPI
+
+
+def overloaded():
+    return aiohttp.ClientResponseError(None, (), status=503, message="Service Unavailable")
+
+
+def make_api(inner, **kwargs):
+    settings = dict(max_attempts=3, base_delay=0, max_delay=0, breaker_threshold=2,
+                    breaker_reset=0.05, hedge_delay=0)
+    settings.update(kwargs)
+    return ResilientChatAPI(inner, "test", **settings)
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_breaker_state_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.check("s") is False
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.check("s")
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.check("s") is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探期间其他请求仍被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.check("s")
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.check("s") is True
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.check("s") is False
+    assert breaker.check("s") is False
+
+
+def test_half_open_admits_one_probe():
+    inner = FakeChatAPI(delay=0.05)
+    api = make_api(inner, max_attempts=1)
+    api.breaker.record_failure()
+    api.breaker.record_failure()
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        return await asyncio.gather(*(api.embed("m", ["x"]) for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert inner.calls == 1
+    assert sum(isinstance(result, CircuitOpenError) for result in results) == 4
+    assert api.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_probe_releases_half_open():
+    inner = FakeChatAPI(delay=1)
+    api = make_api(inner)
+    api.breaker.record_failure()
+    api.breaker.record_failure()
+
+    async def scenario():
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(api.get_models())
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        inner.delay = 0
+        return await api.get_models()
+
+    assert asyncio.run(scenario()) == [{"name": "m"}]
+    assert api.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_hedged_request_cancels_inner_requests():
+    inner = FakeChatAPI(delay=1)
+    api = make_api(inner, hedge_delay=0.5)
+
+    async def scenario():
+        call = asyncio.create_task(api.get_models())
+        await asyncio.sleep(0.05)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(scenario()) == []
+    assert inner.calls == 1
+
+
+def test_idempotent_calls_are_retried():
+    inner = FakeChatAPI([overloaded(), asyncio.TimeoutError(), "ok"])
+    api = make_api(inner, breaker_threshold=10)
+    assert asyncio.run(api.get_models()) == [{"name": "ok"}]
+    assert inner.calls == 3
+
+    inner = FakeChatAPI([aiohttp.ClientConnectionError(), "ok"])
+    api = make_api(inner)
+    assert asyncio.run(api.embed("m", ["a", "b"])) == [[1.0], [1.0]]
+    assert inner.calls == 2
+
+
+def test_generation_is_not_retried():
+    inner = FakeChatAPI([overloaded(), "ok"])
+    api = make_api(inner)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(api.send_message("m", []))
+    assert inner.calls == 1
+
+    inner = FakeChatAPI([overloaded(), "ok"])
+    api = make_api(inner)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(api.load_model("m"))
+    assert inner.calls == 1
+
+
+def test_stream_retried_only_before_server_starts():
+    # 服务器拒绝请求时重试
+    inner = FakeChatAPI([overloaded(), "ok"])
+    assert len(asyncio.run(collect(make_api(inner).stream_message("m", [])))) == 2
+    assert inner.calls == 2
+
+    # 超时时服务器可能仍在生成，不重试
+    inner = FakeChatAPI([asyncio.TimeoutError(), "ok"])
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(collect(make_api(inner).stream_message("m", [])))
+    assert inner.calls == 1
+
+    # 收到第一块之后断开，不重试
+    inner = FakeChatAPI([["ok", aiohttp.ClientPayloadError("断开")], "ok"])
+    with pytest.raises(aiohttp.ClientPayloadError):
+        asyncio.run(collect(make_api(inner).stream_message("m", [])))
+    assert inner.calls == 1
@@ -0,0 +1,173 @@
+import asyncio
+import json
+
+import pytest
+
+import response_cache
+from conftest import FakeChatAPI
+from response_cache import CachingChatAPI, ResponseCache, cache_key, is_deterministic
+
+
+class Clock:
+    """可以手动推进的时钟"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+def entry_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = ResponseCache(memory_entries=2)
+    cache.put("a", {"content": "a"})
+    cache.put("b", {"content": "b"})
+    assert cache.get("a") == {"content": "a"}
+    cache.put("c", {"content": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"content": "a"}
+    assert cache.get("c") == {"content": "c"}
+
+
+def test_disk_cache_evicts_least_recently_accessed_over_byte_cap(tmp_path, clock):
+    value = {"content": "x" * 100}
+    size = entry_size(value)
+    cache = ResponseCache(str(tmp_path / "cache.db"), memory_entries=1, max_bytes=size * 3)
+    for key in ("a", "b", "c"):
+        cache.put(key, value)
+        clock.now += 1
+    # 访问a后b成为最久未访问的条目
+    assert cache.get("a") == value
+    clock.now += 1
+    cache.put("e", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("e") == value
+    assert cache._disk_bytes <= cache.max_bytes
+    cache.close()
+
+
+def test_disk_cache_skips_entries_larger_than_cap(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), memory_entries=0, max_bytes=10)
+    cache.put("big", {"content": "x" * 100})
+
+    assert cache.get("big") is None
+    assert cache._disk_bytes == 0
+    cache.close()
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=60)
+    cache.put("a", {"content": "a"})
+    clock.now += 59
+    assert cache.get("a") == {"content": "a"}
+    clock.now += 1
+    assert cache.get("a") is None
+    cache.close()
+
+
+def test_disk_entries_survive_reopen_until_ttl(tmp_path, clock):
+    db_file = str(tmp_path / "cache.db")
+    cache = ResponseCache(db_file, ttl=60)
+    cache.put("a", {"content": "a"})
+    cache.close()
+
+    cache = ResponseCache(db_file, ttl=60)
+    assert cache.get("a") == {"content": "a"}
+    cache.close()
+
+    clock.now += 61
+    cache = ResponseCache(db_file, ttl=60)
+    assert cache._disk_bytes == 0
+    assert cache.get("a") is None
+    cache.close()
+
+
+def test_disk_hits_defer_access_time_writes(tmp_path, clock):
+    import sqlite3
+
+    db_file = str(tmp_path / "cache.db")
+    cache = ResponseCache(db_file, memory_entries=0)
+    cache.put("a", {"content": "a"})
+    clock.now += 10
+    assert cache.get("a") == {"content": "a"}
+
+    def accessed_at():
+        conn = sqlite3.connect(db_file)
+        try:
+            return conn.execute("SELECT accessed_at FROM responses WHERE key = 'a'").fetchone()[0]
+        finally:
+            conn.close()
+
+    # 读取不写磁盘，关闭时写回访问时间
+    assert accessed_at() == 1000.0
+    cache.close()
+    assert accessed_at() == 1010.0
+
+
+def test_only_deterministic_options_are_cached():
+    assert not is_deterministic(None)
+    assert not is_deterministic({"temperature": 0.7})
+    assert is_deterministic({"temperature": 0})
+    assert is_deterministic({"seed": 42, "temperature": 0.7})
+
+
+def test_cache_key_ignores_extra_message_fields():
+    messages = [{"role": "user", "content": "你好"}]
+    assert cache_key("m@1", messages, None) == cache_key("m@1", [dict(messages[0], id=3)], None)
+    assert cache_key("m@1", messages, None) != cache_key("m@2", messages, None)
+
+
+def test_caching_api_reuses_deterministic_replies():
+    async def run():
+        inner = FakeChatAPI(digest="1")
+        api = CachingChatAPI(inner, ResponseCache())
+        messages = [{"role": "user", "content": "hi"}]
+
+        first = await api.send_message("m", messages, {"temperature": 0})
+        second = await api.send_message("m", messages, {"temperature": 0})
+        assert first == second
+        assert inner.requests["send_message"] == 1
+
+        await api.send_message("m", messages, {"temperature": 0.7})
+        await api.send_message("m", messages, {"temperature": 0.7})
+        assert inner.requests["send_message"] == 3
+
+        # 模型更新后摘要变化，旧的回复不再命中
+        inner.digest = "2"
+        await api.get_models()
+        await api.send_message("m", messages, {"temperature": 0})
+        assert inner.requests["send_message"] == 4
+
+    asyncio.run(run())
+
+
+def test_caching_api_stores_completed_streams():
+    async def run():
+        inner = FakeChatAPI(digest="1")
+        api = CachingChatAPI(inner, ResponseCache())
+        messages = [{"role": "user", "content": "hi"}]
+        options = {"seed": 1}
+
+        chunks = [chunk async for chunk in api.stream_message("m", messages, options)]
+        assert len(chunks) == 2
+        cached = [chunk async for chunk in api.stream_message("m", messages, options)]
+
+        assert inner.requests["stream_message"] == 1
+        assert cached == [{"model": "m", "message": {"role": "assistant", "content": "reply"},
+                           "done": True, "done_reason": "cached"}]
+
+    asyncio.run(run())
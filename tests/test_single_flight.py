@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+
+from chat_api import CoalescingChatAPI, SingleFlight
+from conftest import FakeChatAPI
+from metrics import MetricsRegistry
+
+
+class Call:
+    """可以手动结束的请求，记录调用、开始和取消次数"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"content": "done"}
+
+
+def single_flight():
+    return SingleFlight(MetricsRegistry())
+
+
+def test_concurrent_calls_share_one_request():
+    async def run():
+        flight = single_flight()
+        call = Call()
+        tasks = [asyncio.ensure_future(flight.do("op", "k", call)) for _ in range(3)]
+        await call.started.wait()
+        call.release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert results == [{"content": "done"}] * 3
+        assert call.calls == 1
+        assert flight.coalesced == {"op": 2}
+        assert flight._flights == {}
+
+        # 请求结束后重新发出
+        await flight.do("op", "k", call)
+        assert call.calls == 2
+
+    asyncio.run(run())
+
+
+def test_cancelling_one_waiter_keeps_shared_request():
+    async def run():
+        flight = single_flight()
+        call = Call()
+        first = asyncio.ensure_future(flight.do("op", "k", call))
+        second = asyncio.ensure_future(flight.do("op", "k", call))
+        await call.started.wait()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        call.release.set()
+        assert await second == {"content": "done"}
+        assert call.calls == 1
+        assert call.cancelled == 0
+
+    asyncio.run(run())
+
+
+def test_cancelling_all_waiters_cancels_shared_request():
+    async def run():
+        flight = single_flight()
+        call = Call()
+        tasks = [asyncio.ensure_future(flight.do("op", "k", call)) for _ in range(2)]
+        await call.started.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        assert call.cancelled == 1
+        assert flight._flights == {}
+
+        # 取消后的新请求不会等待被取消的请求
+        call.release.set()
+        assert await flight.do("op", "k", call) == {"content": "done"}
+        assert call.calls == 2
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_waiter():
+    async def run():
+        flight = single_flight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise ValueError("boom")
+
+        tasks = [asyncio.ensure_future(flight.do("op", "k", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight._flights == {}
+
+    asyncio.run(run())
+
+
+def test_stream_fans_out_chunks_to_late_subscribers():
+    async def run():
+        flight = single_flight()
+        opened = 0
+        gate = asyncio.Event()
+
+        async def source():
+            nonlocal opened
+            opened += 1
+            yield {"content": "a"}
+            await gate.wait()
+            yield {"content": "b"}
+
+        first = flight.stream("stream", "k", source)
+        assert await first.__anext__() == {"content": "a"}
+        second = flight.stream("stream", "k", source)
+        collect = asyncio.ensure_future(_collect(second))
+        await asyncio.sleep(0)
+        gate.set()
+
+        assert [chunk async for chunk in first] == [{"content": "b"}]
+        assert await collect == [{"content": "a"}, {"content": "b"}]
+        assert opened == 1
+        assert flight._broadcasts == {}
+
+    asyncio.run(run())
+
+
+def test_stream_cancelled_when_all_subscribers_stop():
+    async def run():
+        flight = single_flight()
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                yield {"content": "a"}
+                await asyncio.Event().wait()
+            finally:
+                closed.set()
+
+        stream = flight.stream("stream", "k", source)
+        assert await stream.__anext__() == {"content": "a"}
+        await stream.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+
+        assert flight._broadcasts == {}
+
+    asyncio.run(run())
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_coalescing_api_keys_by_server_and_arguments():
+    async def run():
+        flight = single_flight()
+        inner = FakeChatAPI()
+        api = CoalescingChatAPI(inner, "a:1", flight)
+        other = CoalescingChatAPI(inner, "b:1", flight)
+        messages = [{"role": "user", "content": "hi"}]
+
+        await asyncio.gather(
+            api.send_message("m", messages),
+            api.send_message("m", messages),
+            api.send_message("m", [{"role": "user", "content": "hello"}]),
+            other.send_message("m", messages),
+        )
+
+        assert inner.calls == 3
+        assert flight.coalesced == {"send_message": 1}
+
+    asyncio.run(run())
@@ -0,0 +1,125 @@
+import asyncio
+
+import numpy as np
+
+from chat_api import OllamaChatAPI
+from chat_store import ChatStore
+from mock_server import MockOllamaServer
+from retrieval import Retriever
+from vector_index import VectorIndex
+
+
+def make_items(start, count):
+    items = [{"key": f"k{i}", "text": f"条目{i}"} for i in range(start, start + count)]
+    rng = np.random.default_rng(start)
+    return items, rng.standard_normal((count, 8)).tolist()
+
+
+def test_reload_keeps_items_and_vectors(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    items, vectors = make_items(0, 10)
+    index.add("embed", items, vectors)
+    index.delete(["k3"])
+
+    reloaded = VectorIndex(str(tmp_path))
+    assert reloaded.model == "embed"
+    assert len(reloaded) == 9
+    score, item = reloaded.search(vectors[5], 1)[0]
+    assert item["key"] == "k5"
+    assert score > 0.999
+    assert all(item["key"] != "k3" for _, item in reloaded.search(vectors[3], 9))
+
+
+def test_compact_after_many_deletes(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    items, vectors = make_items(0, 20)
+    index.add("embed", items, vectors)
+    index.delete([f"k{i}" for i in range(15)])
+    index.compact()
+
+    reloaded = VectorIndex(str(tmp_path))
+    assert sorted(reloaded.keys) == [f"k{i}" for i in range(15, 20)]
+    assert reloaded.search(vectors[17], 1)[0][1]["key"] == "k17"
+
+
+def test_torn_items_line_is_truncated(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    items, vectors = make_items(0, 3)
+    index.add("embed", items, vectors)
+    with open(index.items_file, "a", encoding="utf-8") as f:
+        f.write('{"key": "k3", "te')
+
+    index = VectorIndex(str(tmp_path))
+    assert index.recovered
+    assert len(index) == 3
+    items, vectors = make_items(10, 2)
+    index.add("embed", items, vectors)
+
+    reloaded = VectorIndex(str(tmp_path))
+    assert not reloaded.recovered
+    assert sorted(reloaded.keys) == ["k0", "k1", "k10", "k11", "k2"]
+    assert reloaded.search(vectors[1], 1)[0][1]["key"] == "k11"
+
+
+def test_corrupt_middle_items_line_keeps_later_items(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    items, vectors = make_items(0, 4)
+    index.add("embed", items, vectors)
+    with open(index.items_file, "rb") as f:
+        lines = f.readlines()
+    lines[1] = b'{"key": "k1", "te\n'
+    with open(index.items_file, "wb") as f:
+        f.writelines(lines)
+
+    index = VectorIndex(str(tmp_path))
+    assert index.recovered
+    assert index.lost_row == 1
+    assert sorted(index.keys) == ["k0", "k2", "k3"]
+    # 损坏的行占位，之后的条目仍然对应原来的向量
+    assert index.search(vectors[3], 1)[0][1]["key"] == "k3"
+    assert index.search(vectors[2], 1)[0][1]["key"] == "k2"
+
+
+def test_approximate_search_finds_exact_match(tmp_path):
+    index = VectorIndex(str(tmp_path), approximate_threshold=100)
+    items, vectors = make_items(0, 500)
+    index.add("embed", items, vectors)
+    for row in (0, 123, 499):
+        assert index.search(vectors[row], 1)[0][1]["key"] == f"k{row}"
+
+
+def test_retriever_reindexes_messages_lost_from_torn_index(tmp_path):
+    store = ChatStore(str(tmp_path / "history.db"))
+    store.save_conversation("c1", "标题", "mock:latest", 0)
+    store.append_messages("c1", [{"role": "user", "content": f"第{i}条比较长的测试消息内容"} for i in range(6)])
+    directory = str(tmp_path / "index")
+
+    async def scenario():
+        server = MockOllamaServer(models=["mock:latest", "embed"])
+        url = await server.start()
+        api = OllamaChatAPI(url, 10)
+        try:
+            retriever = Retriever(VectorIndex(directory), store, model="embed")
+            assert await retriever.sync(api) == 6
+
+            # 模拟最后两条写入中断：删除最后一行并截断倒数第二行
+            with open(retriever.index.items_file, "rb") as f:
+                lines = f.readlines()
+            with open(retriever.index.items_file, "wb") as f:
+                f.writelines(lines[:-2])
+                f.write(lines[-2][:10])
+
+            retriever = Retriever(VectorIndex(directory), store, model="embed")
+            assert len(retriever.index) == 4
+            assert retriever.index.get_state("last_message_id") == 4
+            assert await retriever.sync(api) == 2
+        finally:
+            await api.disconnect()
+            await server.stop()
+        return retriever
+
+    retriever = asyncio.run(scenario())
+    reloaded = VectorIndex(directory)
+    assert sorted(item["message_id"] for item in reloaded.items if item) == [1, 2, 3, 4, 5, 6]
+    store.close()
+    assert retriever.index.get_state("last_message_id") == 6